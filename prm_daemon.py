@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+'''
+The headless DAQ driver: runs the manager without the GUI,
+controlled through an HTTP API on localhost
+'''
+
+import sys
+import signal
+import logging
+from PyQt5.QtCore import QCoreApplication, QTimer
+
+from sbndprmdaq.daemon import PrMDaemon
+from sbndprmdaq import startup
+
+
+def main():
+    '''
+    Runs the DAQ without the GUI.
+    '''
+    parser = startup.argument_parser('SBND Purity Monitor DAQ (headless)')
+    parser.add_argument('--port',
+                        type=int,
+                        default=None,
+                        help='Port of the control API (overrides the daemon port setting).')
+    args = parser.parse_args()
+
+    #
+    # Start the logger
+    #
+    startup.start_logging(args)
+    logger = logging.getLogger(__name__)
+    logger.info('SBND Purity Monitor daemon starts.')
+
+
+    #
+    # Get the settings, and check that no other DAQ uses the data directory
+    #
+    config = startup.load_config(args)
+
+    if startup.another_daq_running(config):
+        sys.exit(0)
+
+
+    #
+    # The event loop, no GUI
+    #
+    app = QCoreApplication(sys.argv)
+
+    # Let the Python signal handlers run from time to time
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    signal.signal(signal.SIGTERM, lambda *_: app.quit())
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(500)
+
+
+    #
+    # Construct the manager, without a window
+    #
+    manager = startup.make_manager(args, config)
+
+    daemon = PrMDaemon(manager, config)
+    daemon.start()
+
+
+    #
+    # Take it away
+    #
+    app.exec_()
+
+    logger.info('SBND Purity Monitor daemon stops.')
+    daemon.stop()
+    manager.exit()
+
+
+# The analysis processes import this module, which must not start another DAQ
+if __name__ == '__main__':
+    main()
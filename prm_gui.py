@@ -6,121 +6,81 @@ The main DAQ GUI driver
 
 import os
 import sys
-import time
-import argparse
+import logging
 from PyQt5 import QtGui, QtWidgets
-import yaml
 import qdarkstyle
 
 from sbndprmdaq.mainwindow import MainWindow
-from sbndprmdaq.prmlogger import get_logging, PrMLogWidget
+from sbndprmdaq.prmlogger import PrMLogWidget
+from sbndprmdaq import startup
 
-os.environ["QT_ENABLE_HIGHDPI_SCALING"]   = "1"
-os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
-os.environ["QT_SCALE_FACTOR"]             = "1"
 
-parser = argparse.ArgumentParser(description='SBND Purity Monitor DAQ')
-parser.add_argument('--mock', action='store_true',
-                    default=False,
-                    help='If true, runs a mock application for debugging purposes.')
-parser.add_argument('--datafiles',
-                    default='',
-                    help='Path where data files will be saved.')
-parser.add_argument('--logfile',
-                    default='prm_log.txt',
-                    help='File name where logs will be saved.')
+def main():
+    '''
+    Runs the DAQ.
+    '''
+    os.environ["QT_ENABLE_HIGHDPI_SCALING"]   = "1"
+    os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
+    os.environ["QT_SCALE_FACTOR"]             = "1"
 
-args = parser.parse_args()
-print(args)
+    args = startup.argument_parser('SBND Purity Monitor DAQ').parse_args()
 
-#
-# Start the logger
-#
-logging = get_logging(args.logfile)
-logger = logging.getLogger(__name__)
-logger.info('SBND Purity Monitor starts.')
+    #
+    # Start the logger
+    #
+    startup.start_logging(args)
+    logger = logging.getLogger(__name__)
+    logger.info('SBND Purity Monitor starts.')
 
 
-#
-# Get the settings from the settings file
-#
-settings = os.path.join(os.path.dirname(__file__), 'settings.yaml')
+    #
+    # Get the settings, and check that no other DAQ uses the data directory
+    #
+    config = startup.load_config(args)
 
-with open(settings, encoding="utf-8") as file:
-    config = yaml.load(file, Loader=yaml.FullLoader)
+    if startup.another_daq_running(config):
+        sys.exit(0)
 
-if args.datafiles:
-    config["data_files_path"] = args.datafiles
 
-if args.mock:
-    config['check_pmt_hv'] = False
-    config['check_lar_level'] = False
-    config['data_storage'] = False
-    config['populate_dataframe'] = False
-    config['summary_plot']['post_to_ecl'] = False
 
-print('Config:', yaml.dump(config), sep='\n')
+    #
+    # Construct the GUI
+    #
+    app = QtWidgets.QApplication(sys.argv)
+    logs = PrMLogWidget()
+    window = MainWindow(logs=logs, config=config)
+    app.setStyleSheet(qdarkstyle.load_stylesheet(qt_api='pyqt5'))
+    window.show()
 
-# logger.info(yaml.dump(config))
 
-#
-# Check Hertbeat
-#
-heartbeat_file_name = config['data_files_path'] + '/heartbeat.txt'
+    #
+    # Construct the manager
+    #
+    manager = startup.make_manager(args, config, window)
 
-if os.path.exists(heartbeat_file_name):
+    # manager.test()
 
-    with open(heartbeat_file_name, encoding="utf-8") as f:
-        for line in f:
-            time_stamp = float(line)
 
-        if abs(time_stamp - time.time()) < 5:
-            print('timestamp  :', time_stamp)
-            print('time.time():', time.time())
-            print('Another DAQ is running on this data directory:', config['data_files_path'])
-            print('Either stop the other DAQ, or use a different path.')
-            sys.exit(0)
+    #
+    # Pass the manager to the mainwindow
+    #
+    window.set_manager(manager)
 
 
+    #
+    # Set a unique font
+    #
+    font = QtGui.QFont("Tahoma", 8)
+    app.setFont(font)
 
-#
-# Construct the GUI
-#
-app = QtWidgets.QApplication(sys.argv)
-logs = PrMLogWidget()
-window = MainWindow(logs=logs, config=config)
-app.setStyleSheet(qdarkstyle.load_stylesheet(qt_api='pyqt5'))
-window.show()
 
 
-#
-# Construct the manager
-#
-if args.mock:
-    from sbndprmdaq.mock_manager import MockPrMManager
-    manager = MockPrMManager(config, window)
-else:
-    from sbndprmdaq.manager import PrMManager
-    manager = PrMManager(config, window)
+    #
+    # Take it away
+    #
+    app.exec_()
 
-# manager.test()
 
-
-#
-# Pass the manager to the mainwindow
-#
-window.set_manager(manager)
-
-
-#
-# Set a unique font
-#
-font = QtGui.QFont("Tahoma", 8)
-app.setFont(font)
-
-
-
-#
-# Take it away
-#
-app.exec_()
+# The analysis processes import this module, which must not start another DAQ
+if __name__ == '__main__':
+    main()
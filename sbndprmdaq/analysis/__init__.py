@@ -4,3 +4,4 @@ Purity monitor analysis module
 
 from .analysis_estimate import PrMAnalysisEstimate
 from .analysis_fit import PrMAnalysisFitter, PrMAnalysisFitterDiff
+from .analysis_pool import AnalysisPool, AnalysisResult
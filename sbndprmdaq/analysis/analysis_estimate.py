@@ -6,7 +6,8 @@ import datetime
 import subprocess
 
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
 
 from .analysis_base import PrMAnalysisBase
 
@@ -102,10 +103,11 @@ class PrMAnalysisEstimate(PrMAnalysisBase):
         if self._td < 0:
             return None, None
 
-        prop_cycle = plt.rcParams['axes.prop_cycle']
+        prop_cycle = matplotlib.rcParams['axes.prop_cycle']
         _colors = prop_cycle.by_key()['color']
 
-        fig, ax = plt.subplots(ncols=1, nrows=2, figsize=(12, 8), sharex=True)
+        fig = Figure(figsize=(12, 8))
+        ax = fig.subplots(ncols=1, nrows=2, sharex=True)
         fig.subplots_adjust(hspace=0)
 
         ax[0].plot(
@@ -172,8 +174,7 @@ class PrMAnalysisEstimate(PrMAnalysisBase):
         self._set_lifetime_axis(ax, self._plot_title, container, text_pos=[0.015, 0.56])
 
         if savename:
-            plt.savefig(savename)
-        # plt.show()
+            fig.savefig(savename)
 
         return fig, ax
 
@@ -499,10 +500,11 @@ class PrMAnalysisEstimateDiff(PrMAnalysisBase):
         if self._td < 0:
             return None, None
 
-        prop_cycle = plt.rcParams['axes.prop_cycle']
+        prop_cycle = matplotlib.rcParams['axes.prop_cycle']
         _colors = prop_cycle.by_key()['color']
 
-        fig, ax = plt.subplots(ncols=1, nrows=2, figsize=(12, 8), sharex=True)
+        fig = Figure(figsize=(12, 8))
+        ax = fig.subplots(ncols=1, nrows=2, sharex=True)
         fig.subplots_adjust(hspace=0)
 
         ax[0].plot(
@@ -569,8 +571,7 @@ class PrMAnalysisEstimateDiff(PrMAnalysisBase):
         self._set_lifetime_axis(ax, self._plot_title, container, text_pos=[0.015, 0.56])
 
         if savename:
-            plt.savefig(savename)
-        # plt.show()
+            fig.savefig(savename)
 
         return fig, ax
 
@@ -7,7 +7,8 @@ import subprocess
 import functools
 
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
 import scipy.signal
 import scipy.optimize
 
@@ -133,10 +134,11 @@ class PrMAnalysisFitter(PrMAnalysisBase):
         if self._td < 0:
             return None, None
 
-        prop_cycle = plt.rcParams['axes.prop_cycle']
+        prop_cycle = matplotlib.rcParams['axes.prop_cycle']
         _colors = prop_cycle.by_key()['color']
 
-        fig, ax = plt.subplots(ncols=1, nrows=2, figsize=(12, 8), sharex=True)
+        fig = Figure(figsize=(12, 8))
+        ax = fig.subplots(ncols=1, nrows=2, sharex=True)
         fig.subplots_adjust(hspace=0)
 
         ax[0].plot(
@@ -202,8 +204,7 @@ class PrMAnalysisFitter(PrMAnalysisBase):
         self._set_lifetime_axis(ax, self._plot_title, container, text_pos=[0.015, 0.56])
 
         if savename:
-            plt.savefig(savename)
-        plt.show()
+            fig.savefig(savename)
 
         return fig, ax
 
@@ -544,10 +545,11 @@ class PrMAnalysisFitterDiff(PrMAnalysisFitter):
         if self._td < 0:
             return None, None
 
-        prop_cycle = plt.rcParams['axes.prop_cycle']
+        prop_cycle = matplotlib.rcParams['axes.prop_cycle']
         _color = prop_cycle.by_key()['color'][0]
 
-        fig, ax = plt.subplots(ncols=1, nrows=1, figsize=(12, 8), sharex=True)
+        fig = Figure(figsize=(12, 8))
+        ax = fig.add_subplot()
         fig.subplots_adjust(hspace=0)
 
         ax.plot(
@@ -598,8 +600,7 @@ class PrMAnalysisFitterDiff(PrMAnalysisFitter):
         self._set_lifetime_axis(ax, self._plot_title, container, text_pos=[0.015, 0.76])
 
         if savename:
-            plt.savefig(savename)
-        plt.show()
+            fig.savefig(savename)
 
         return fig, ax
 
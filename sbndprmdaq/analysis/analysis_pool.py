@@ -0,0 +1,312 @@
+'''
+Contains a class running the PrM analyses in separate processes
+'''
+import time
+import logging
+import threading
+import traceback
+import multiprocessing
+from dataclasses import dataclass
+
+import numpy as np
+
+from .analysis_estimate import PrMAnalysisEstimate
+from .analysis_fit import PrMAnalysisFitter, PrMAnalysisFitterDiff
+
+ANALYSIS_TYPES = {
+    'estimate': PrMAnalysisEstimate,
+    'fit': PrMAnalysisFitter,
+    'fit_difference': PrMAnalysisFitterDiff,
+}
+
+# Arrays in shared memory start on multiples of this (in bytes)
+_ALIGNMENT = 64
+
+
+def _shared_memory():
+    '''
+    Returns the multiprocessing.shared_memory module,
+    None if not available (Python < 3.8).
+    '''
+    try:
+        #pylint: disable=import-outside-toplevel
+        from multiprocessing import shared_memory
+    except ImportError:
+        return None
+    return shared_memory
+
+
+#pylint: disable=too-many-instance-attributes
+@dataclass
+class AnalysisResult:
+    '''
+    The result of an analysis. The lifetime and charges are
+    negative error codes if the analysis ran but failed.
+    '''
+    status: str                  # 'ok', 'failed' or 'timeout'
+    td: float = None             # Drift time (ms)
+    qa: float = None             # Anode charge (mV)
+    qc: float = None             # Cathode charge (mV)
+    tau: float = None            # Lifetime (ms)
+    plot_file: str = None        # The summary plot, if saved
+    calculate_time: float = 0.   # Time (in seconds) spent in the analysis
+    plot_time: float = 0.        # Time (in seconds) spent making the plot
+    error: str = None            # The error, if not ok
+
+
+def _to_shared_memory(arrays):
+    '''
+    Copies arrays to a new shared memory block.
+
+    Args:
+        arrays (dict): The arrays, keyed by name.
+
+    Returns:
+        SharedMemory: The block (to be closed and unlinked by the caller).
+        dict: The (offset, shape, dtype) of every array, keyed by name.
+    '''
+    specs = {}
+    size = 0
+    for key, array in arrays.items():
+        specs[key] = (size, array.shape, array.dtype.str)
+        size += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+    shm = _shared_memory().SharedMemory(create=True, size=max(size, 1))
+    for key, array in arrays.items():
+        offset, shape, dtype = specs[key]
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = array
+
+    return shm, specs
+
+
+def _from_shared_memory(name, specs):
+    '''
+    Copies the arrays out of a shared memory block.
+
+    Args:
+        name (str): The name of the block.
+        specs (dict): The (offset, shape, dtype) of every array, keyed by name.
+
+    Returns:
+        dict: The arrays, keyed by name.
+    '''
+    shm = _shared_memory().SharedMemory(name=name)
+    try:
+        return {key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+                for key, (offset, shape, dtype) in specs.items()}
+    finally:
+        shm.close()
+
+
+#pylint: disable=too-many-arguments,too-many-locals
+def run_analysis(ana_type, config, wf_c, wf_a, wf_c_hvoff=None, wf_a_hvoff=None,
+                 container=None, plot_file=None):
+    '''
+    Runs an analysis, and saves its summary plot.
+
+    Args:
+        ana_type (str): The analysis type (see ANALYSIS_TYPES).
+        config (dict): The analysis configuration.
+        wf_c (np.ndarray): The cathode waveforms.
+        wf_a (np.ndarray): The anode waveforms.
+        wf_c_hvoff (np.ndarray): The HV off cathode waveforms.
+        wf_a_hvoff (np.ndarray): The HV off anode waveforms.
+        container (dict): The run data shown on the plot.
+        plot_file (str): Where to save the plot (not made if None).
+
+    Returns:
+        AnalysisResult: The result.
+    '''
+    start = time.monotonic()
+    prmana = ANALYSIS_TYPES[ana_type](wf_c, wf_a, config=config,
+                                      wf_c_hvoff=wf_c_hvoff, wf_a_hvoff=wf_a_hvoff)
+    prmana.calculate()
+    calculate_time = time.monotonic() - start
+
+    start = time.monotonic()
+    if plot_file is not None:
+        prmana.plot_summary(container=container, savename=plot_file)
+    plot_time = time.monotonic() - start
+
+    return AnalysisResult(status='ok',
+                          td=prmana.get_drifttime(unit='ms'),
+                          qa=prmana.get_qa(unit='mV'),
+                          qc=prmana.get_qc(unit='mV'),
+                          tau=prmana.get_lifetime(unit='ms'),
+                          plot_file=plot_file,
+                          calculate_time=calculate_time,
+                          plot_time=plot_time)
+
+
+def _worker(connection, shm_name, specs, ana_type, config, container, plot_file):
+    '''
+    Runs an analysis in a child process, taking the arrays
+    from shared memory, and sends back the result.
+    '''
+    try:
+        arrays = _from_shared_memory(shm_name, specs)
+        container = dict(container, **{key[len('container_'):]: value for key, value in arrays.items()
+                                       if key.startswith('container_')})
+        result = run_analysis(ana_type, config,
+                              arrays['wf_c'], arrays['wf_a'],
+                              arrays.get('wf_c_hvoff'), arrays.get('wf_a_hvoff'),
+                              container=container, plot_file=plot_file)
+    except Exception: #pylint: disable=broad-exception-caught
+        result = AnalysisResult(status='failed', error=traceback.format_exc())
+
+    connection.send(result)
+    connection.close()
+
+
+class AnalysisPool:
+    '''
+    Runs the analyses in child processes, so that the fits run on
+    separate cores, without holding the GIL of the DAQ. Every analysis
+    gets its own process, forked from a server which already imported
+    the analysis modules, so a stuck fit can be killed after a timeout
+    without losing the other analyses. The waveforms are passed
+    through shared memory, the result is returned as an AnalysisResult.
+
+    With n_processes set to 0, or if shared memory is not available
+    (Python < 3.8), the analyses run in the calling thread.
+    '''
+
+    def __init__(self, n_processes=3, timeout=120):
+        '''
+        Contructor.
+
+        Args:
+            n_processes (int): The max number of analyses running at once.
+            timeout (float): Time (in seconds) after which an analysis is killed.
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        if n_processes and _shared_memory() is None:
+            self._logger.warning('Shared memory is not available (Python < 3.8), '
+                                 'the analyses will run in the calling thread.')
+            n_processes = 0
+
+        self._n_processes = n_processes
+        self._timeout = timeout
+
+        self._context = None
+        if n_processes:
+            # The server imports the main module once, for all the analysis processes
+            self._context = multiprocessing.get_context('forkserver')
+            self._context.set_forkserver_preload(['__main__', 'sbndprmdaq.analysis.analysis_pool'])
+
+        self._slots = threading.BoundedSemaphore(max(n_processes, 1))
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    #pylint: disable=too-many-arguments
+    def analyse(self, ana_type, config, wf_c, wf_a, wf_c_hvoff=None, wf_a_hvoff=None,
+                container=None, plot_file=None):
+        '''
+        Runs an analysis, and waits for its result. Can be called from several threads.
+
+        Args:
+            ana_type (str): The analysis type (see ANALYSIS_TYPES).
+            config (dict): The analysis configuration.
+            wf_c (np.ndarray): The cathode waveforms.
+            wf_a (np.ndarray): The anode waveforms.
+            wf_c_hvoff (np.ndarray): The HV off cathode waveforms.
+            wf_a_hvoff (np.ndarray): The HV off anode waveforms.
+            container (dict): The run data shown on the plot.
+            plot_file (str): Where to save the plot (not made if None).
+
+        Returns:
+            AnalysisResult: The result.
+        '''
+        if ana_type not in ANALYSIS_TYPES:
+            raise ValueError(f'Invalid ana_type {ana_type}')
+
+        container = container if container is not None else {}
+
+        if not self._n_processes:
+            try:
+                return run_analysis(ana_type, config, wf_c, wf_a, wf_c_hvoff, wf_a_hvoff,
+                                    container, plot_file)
+            except Exception: #pylint: disable=broad-exception-caught
+                return AnalysisResult(status='failed', error=traceback.format_exc())
+
+        # The waveforms, and the arrays of the container, go through shared memory
+        arrays = {key: np.asarray(value) for key, value in [('wf_c', wf_c), ('wf_a', wf_a),
+                                                            ('wf_c_hvoff', wf_c_hvoff),
+                                                            ('wf_a_hvoff', wf_a_hvoff)]
+                  if value is not None and len(value)}
+        arrays.update({'container_' + key: value for key, value in container.items()
+                       if isinstance(value, np.ndarray) and value.ndim and value.dtype.kind in 'biuf'})
+        scalars = {key: value for key, value in container.items()
+                   if 'container_' + key not in arrays}
+
+        with self._slots:
+            if self._stopped:
+                return AnalysisResult(status='failed', error='Analysis pool stopped.')
+
+            shm, specs = _to_shared_memory(arrays)
+            try:
+                return self._run(shm.name, specs, ana_type, config, scalars, plot_file)
+            finally:
+                shm.close()
+                shm.unlink()
+
+    def _run(self, shm_name, specs, ana_type, config, container, plot_file):
+        '''
+        Runs an analysis in a child process, killing it after the timeout.
+        '''
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_worker,
+                                        args=(sender, shm_name, specs, ana_type,
+                                              config, container, plot_file),
+                                        name=f'PrMAnalysis-{ana_type}',
+                                        daemon=True)
+        with self._lock:
+            self._processes.add(process)
+
+        try:
+            process.start()
+            sender.close()
+
+            if not receiver.poll(self._timeout):
+                self._logger.error(f'Analysis {ana_type} did not finish in {self._timeout} s, killing it.')
+                process.kill()
+                return AnalysisResult(status='timeout', error=f'No result after {self._timeout} s.')
+
+            try:
+                return receiver.recv()
+            except EOFError:
+                return AnalysisResult(status='failed',
+                                      error=f'Analysis process died (exit code {process.exitcode}).')
+        finally:
+            receiver.close()
+            self._terminate(process)
+            with self._lock:
+                self._processes.discard(process)
+
+    @staticmethod
+    def _terminate(process):
+        '''
+        Stops a process, if still running, and waits for it.
+        '''
+        if process.pid is None:
+            return
+        process.join(1)
+        if process.is_alive():
+            process.terminate()
+            process.join(1)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def stop(self):
+        '''
+        Kills the running analyses. The pool cannot be used afterwards.
+        '''
+        self._stopped = True
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
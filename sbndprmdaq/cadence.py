@@ -0,0 +1,171 @@
+'''
+Contains the class adapting the interval between automatic runs to the purity stability
+'''
+import logging
+from collections import deque
+
+import numpy as np
+
+
+def relative_lifetime_error(qa, qc, qa_err, qc_err):
+    '''
+    Returns the relative error on the lifetime, tau = td / ln(Qc/Qa),
+    propagated from the errors on the charges (the drift time error is neglected).
+
+    Args:
+        qa (float): The anode charge.
+        qc (float): The cathode charge.
+        qa_err (float): The error on the anode charge.
+        qc_err (float): The error on the cathode charge.
+
+    Returns:
+        float: The relative error, or None if it cannot be computed.
+    '''
+    if qa <= 0 or qc <= 0 or qa == qc:
+        return None
+
+    return float(np.sqrt((qa_err / qa)**2 + (qc_err / qc)**2) / abs(np.log(qc / qa)))
+
+
+#pylint: disable=too-many-instance-attributes
+class AdaptiveCadence:
+    '''
+    Decides the interval between automatic runs of every PrM from its
+    recent measurements. The interval is shortened when the lifetime
+    drifts, when it is poorly measured, or when Qa/Qc jumps, and it is
+    lengthened while the measurements are stable. It always stays between
+    the min and max intervals, and long enough for the HV to be on at
+    most a max_hv_duty fraction of the time.
+    '''
+
+    def __init__(self, config=None):
+        '''
+        Contructor.
+
+        Args:
+            config (dict): The adaptive_cadence configuration section.
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        config = config if config is not None else {}
+
+        self._min_interval = config.get('min_interval', 300)
+        self._max_interval = config.get('max_interval', 7200)
+        self._drift_threshold = config.get('drift_threshold', 0.1)
+        self._precision_target = config.get('precision_target', 0.1)
+        self._ratio_threshold = config.get('ratio_threshold', 0.05)
+        self._growth = config.get('growth', 1.5)
+        self._max_hv_duty = config.get('max_hv_duty', 0.2)
+        self._history_size = config.get('history_size', 6)
+
+        self._history = {}  # prm_id -> deque of (timestamp, tau, tau_err, qa/qc)
+        self._hv_on_times = {} # prm_id -> deque of HV on time per run
+        self._intervals = {} # prm_id -> current interval
+        self._new_measurement = {} # prm_id -> True if a valid measurement was added since the last adaptation
+
+    def reset(self, prm_id, interval):
+        '''
+        Restarts the adaptation of a PrM from an interval (eg. when set from the GUI).
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            interval (float): The interval (in seconds).
+        '''
+        self._intervals[prm_id] = interval
+
+    def add_measurement(self, prm_id, timestamp, meas, hv_on_time):
+        '''
+        Adds the result of a run.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            timestamp (float): The time of the run (seconds since the epoch).
+            meas (dict): The analysis results, with tau_err (None if the analysis failed).
+            hv_on_time (float): The time the HV was on for the run (in seconds).
+        '''
+        self._hv_on_times.setdefault(prm_id, deque(maxlen=self._history_size)).append(hv_on_time)
+
+        # The analysis returns negative values when it fails
+        if meas is None or meas['tau'] <= 0 or meas['qc'] <= 0 or meas['qa'] <= 0:
+            self._logger.info(f'No valid lifetime for PrM {prm_id}, not used for the cadence.')
+            return
+
+        self._history.setdefault(prm_id, deque(maxlen=self._history_size)).append(
+            (timestamp, meas['tau'], meas.get('tau_err'), meas['qa'] / meas['qc']))
+        self._new_measurement[prm_id] = True
+
+    def _instability(self, prm_id):
+        '''
+        Returns how unstable the recent measurements are (above 1 means
+        unstable, below 0.5 stable), and the reason.
+        '''
+        history = self._history.get(prm_id, [])
+        if not self._new_measurement.get(prm_id):
+            return 1, 'no new valid measurement'
+
+        scores = {}
+
+        _, tau, tau_err, ratio = history[-1]
+        if tau_err is not None:
+            scores['uncertainty'] = tau_err / tau / self._precision_target
+
+        if len(history) >= 2:
+            times = np.array([h[0] for h in history]) / 3600 # hours
+            taus = np.array([h[1] for h in history])
+            if np.ptp(times) > 0:
+                slope = np.polyfit(times - times[0], taus, 1)[0]
+                scores['drift'] = abs(slope) / taus.mean() / self._drift_threshold
+
+            previous_ratio = history[-2][3]
+            scores['Qa/Qc change'] = abs(ratio - previous_ratio) / previous_ratio / self._ratio_threshold
+
+        if not scores:
+            return 1, 'no uncertainty'
+
+        reason = max(scores, key=scores.get)
+        return scores[reason], reason
+
+    def _duty_interval(self, prm_id):
+        '''
+        Returns the min interval keeping the HV duty below max_hv_duty.
+        '''
+        hv_on_times = self._hv_on_times.get(prm_id)
+        if not hv_on_times or not self._max_hv_duty:
+            return 0
+        return np.mean(hv_on_times) / self._max_hv_duty
+
+    def interval(self, prm_id):
+        '''
+        Returns the current interval of a PrM, or None if it was not adapted yet.
+        '''
+        return self._intervals.get(prm_id)
+
+    def next_interval(self, prm_id, interval):
+        '''
+        Returns the interval until the next run of a PrM.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            interval (float): The interval to start from, if the PrM was not adapted yet.
+
+        Returns:
+            float: The interval (in seconds).
+        '''
+        interval = self._intervals.get(prm_id, interval)
+
+        instability, reason = self._instability(prm_id)
+        self._new_measurement[prm_id] = False
+        if instability > 1:
+            # Down to 4 times faster at once
+            interval /= min(instability, 4)
+        elif instability < 0.5:
+            interval *= self._growth
+
+        min_interval = max(self._min_interval, self._duty_interval(prm_id))
+        interval = float(np.clip(interval, min_interval, max(min_interval, self._max_interval)))
+
+        self._intervals[prm_id] = interval
+        self._logger.info(f'Next interval for PrM {prm_id}: {interval:.0f} s '
+                          f'(instability {instability:.2f}, from {reason}).')
+
+        return interval
@@ -0,0 +1,416 @@
+'''
+Contains the classes to run the DAQ without the GUI, controlled
+through an HTTP API listening on localhost
+'''
+import os
+import re
+import hmac
+import json
+import logging
+import secrets
+import datetime
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+class MainThreadCaller(QObject):
+    '''
+    Runs functions on the thread that owns it (the Qt main thread), and
+    returns their result to the calling thread. The manager and the
+    scheduler are not thread safe, so every API call goes through it.
+    '''
+
+    _call = pyqtSignal(object, object) # function, future
+
+    def __init__(self):
+        '''
+        Contructor.
+        '''
+        super().__init__()
+        self._call.connect(self._run)
+
+    def _run(self, function, future):
+        '''
+        Runs a function and sets its result on the future.
+        '''
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(function())
+        except Exception as err: #pylint: disable=broad-exception-caught
+            future.set_exception(err)
+
+    def call(self, function, timeout=30):
+        '''
+        Runs a function on the main thread, and waits for its result.
+
+        Args:
+            function (fn): The function, taking no arguments.
+            timeout (float): Max time to wait (in seconds).
+
+        Returns:
+            The result of the function.
+        '''
+        future = Future()
+        self._call.emit(function, future)
+        return future.result(timeout)
+
+
+class APIError(Exception):
+    '''
+    An error reported to the API client, with an HTTP status code.
+    '''
+
+    def __init__(self, status, message):
+        '''
+        Contructor.
+
+        Args:
+            status (int): The HTTP status code.
+            message (str): The error message.
+        '''
+        super().__init__(message)
+        self.status = status
+
+
+def read_token(file_name):
+    '''
+    Reads the token of the API, creating the file (readable by the
+    owner only) with a new token if it does not exist.
+
+    Args:
+        file_name (str): The token file.
+
+    Returns:
+        str: The token.
+    '''
+    file_name = os.path.expanduser(file_name)
+    if not os.path.exists(file_name):
+        fd = os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(secrets.token_hex(32) + '\n')
+
+    if os.stat(file_name).st_mode & 0o077:
+        raise PermissionError(f'The API token file {file_name} must only be readable by its owner (chmod 600).')
+
+    with open(file_name, encoding='utf-8') as file:
+        return file.read().strip()
+
+
+def _to_json(obj):
+    '''
+    Converts the objects json cannot serialize.
+    '''
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f'Cannot serialize {type(obj)}')
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    '''
+    Passes the HTTP requests to the daemon.
+    '''
+
+    server_version = 'SBNDPrMDAQ'
+
+    #pylint: disable=invalid-name
+    def do_GET(self):
+        '''
+        Handles a GET request.
+        '''
+        self._handle('GET')
+
+    def do_POST(self):
+        '''
+        Handles a POST request.
+        '''
+        self._handle('POST')
+
+    def _handle(self, method):
+        '''
+        Runs the request, and sends back the result or the error as JSON.
+        '''
+        try:
+            self.server.prm_daemon.check_request(method, self.headers)
+
+            body = {}
+            length = int(self.headers.get('Content-Length', 0))
+            if length:
+                try:
+                    body = json.loads(self.rfile.read(length))
+                except json.JSONDecodeError as err:
+                    raise APIError(400, f'Invalid JSON: {err}') from err
+
+            status, result = 200, self.server.prm_daemon.handle(method, self.path, body)
+        except APIError as err:
+            status, result = err.status, {'error': str(err)}
+        except Exception as err: #pylint: disable=broad-exception-caught
+            self.server.prm_daemon.logger.exception(f'API call {method} {self.path} failed.')
+            status, result = 500, {'error': f'{type(err).__name__}: {err}'}
+
+        payload = json.dumps(result, default=_to_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args): #pylint: disable=redefined-builtin
+        self.server.prm_daemon.logger.debug(f'{self.address_string()} - {format % args}')
+
+
+#pylint: disable=too-many-instance-attributes
+class PrMDaemon:
+    '''
+    Runs the manager without the GUI. It writes the heartbeat, and serves
+    a JSON API on localhost to control the runs and read the status:
+
+        GET  /status                 All PrMs, plus the queue
+        GET  /queue                  The scheduled runs and their predicted start
+        GET  /prm/<id>               The status of a PrM
+        GET  /prm/<id>/results       The latest measurement and timing statistics of a PrM
+        POST /prm/<id>/start         Queues a run
+        POST /prm/<id>/stop          Removes a queued run
+        POST /prm/<id>/mode          {"mode": "auto" or "manual", "interval": seconds (optional)}
+        POST /prm/<id>/interval      {"interval": seconds}
+        POST /prm/<id>/hv            {"on": true or false}
+        POST /prm/<id>/inhibit       {"inhibit": true or false}
+        POST /comment                {"comment": "..."}
+
+    The POST requests must be sent as application/json, so that a web page
+    cannot send them from a browser (a cross-origin JSON request needs a
+    preflight, which is never answered). The requests must be addressed to
+    the host the API listens on, or localhost (against DNS rebinding), and,
+    if daemon:token_file is set, carry the token of that file in an
+    "Authorization: Bearer <token>" header.
+
+    The manager needs a running Qt event loop (eg. a QCoreApplication).
+    '''
+
+    def __init__(self, manager, config):
+        '''
+        Contructor.
+
+        Args:
+            manager (PrMManager): The manager, constructed without a window.
+            config (dict): The configuration dictionary.
+        '''
+        self.logger = logging.getLogger(__name__)
+
+        self._manager = manager
+        self._prm_ids = config['prm_ids']
+        self._bound_prms = config['bound_prms']
+
+        daemon_config = config.get('daemon', {})
+        self._address = (daemon_config.get('host', '127.0.0.1'), daemon_config.get('port', 8765))
+
+        token_file = daemon_config.get('token_file')
+        self._token = read_token(token_file) if token_file is not None else None
+
+        self._caller = MainThreadCaller()
+
+        self._server = None
+        self._server_thread = None
+
+        self._heartbeat_timer = QTimer()
+        self._heartbeat_timer.timeout.connect(self._manager.heartbeat)
+
+        self._routes = [
+            ('GET', r'/status', self._status),
+            ('GET', r'/queue', self._manager.get_queue_state),
+            ('GET', r'/prm/(\d+)', self._prm_status),
+            ('GET', r'/prm/(\d+)/results', self._prm_results),
+            ('POST', r'/prm/(\d+)/start', self._start),
+            ('POST', r'/prm/(\d+)/stop', self._stop),
+            ('POST', r'/prm/(\d+)/mode', self._set_mode),
+            ('POST', r'/prm/(\d+)/interval', self._set_interval),
+            ('POST', r'/prm/(\d+)/hv', self._set_hv),
+            ('POST', r'/prm/(\d+)/inhibit', self._set_inhibit),
+            ('POST', r'/comment', self._set_comment),
+        ]
+
+    @property
+    def address(self):
+        '''
+        The (host, port) the API listens on.
+        '''
+        if self._server is not None:
+            return self._server.server_address
+        return self._address
+
+    def start(self):
+        '''
+        Starts serving the API, and writing the heartbeat.
+        '''
+        self._server = ThreadingHTTPServer(self._address, _RequestHandler)
+        self._server.prm_daemon = self
+        self._server_thread = threading.Thread(target=self._server.serve_forever,
+                                               name='PrMDaemonAPI', daemon=True)
+        self._server_thread.start()
+
+        self._heartbeat_timer.start(1000)
+
+        self.logger.info(f'Control API listening on http://{self.address[0]}:{self.address[1]}.')
+
+    def stop(self):
+        '''
+        Stops the API and the heartbeat.
+        '''
+        self._heartbeat_timer.stop()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+            self._server = None
+
+    def check_request(self, method, headers):
+        '''
+        Checks the host, content type and token of a request.
+        Called from the server threads.
+
+        Args:
+            method (str): The HTTP method.
+            headers (Message): The HTTP headers.
+        '''
+        port = self.address[1]
+        hosts = {f'{host}:{port}' for host in ['127.0.0.1', 'localhost', self._address[0]]}
+        if headers.get('Host') not in hosts:
+            raise APIError(403, f'Host must be one of {sorted(hosts)}.')
+
+        if method == 'POST' and headers.get_content_type() != 'application/json':
+            raise APIError(415, 'Content-Type must be application/json.')
+
+        if self._token is not None:
+            authorization = headers.get('Authorization', '')
+            if not hmac.compare_digest(authorization.encode(), f'Bearer {self._token}'.encode()):
+                raise APIError(401, 'Missing or invalid token.')
+
+    def handle(self, method, path, body):
+        '''
+        Runs an API request, on the main thread. Called from the server threads.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path.
+            body (dict): The JSON body.
+
+        Returns:
+            The JSON-serializable result.
+        '''
+        path = path.split('?')[0].rstrip('/')
+
+        for route_method, pattern, function in self._routes:
+            match = re.fullmatch(pattern, path)
+            if match is None or route_method != method:
+                continue
+
+            args = [self._check_prm_id(int(arg)) for arg in match.groups()]
+            if method == 'POST':
+                args.append(body)
+
+            return self._caller.call(lambda: function(*args))
+
+        raise APIError(404, f'No {method} {path}.')
+
+    def _check_prm_id(self, prm_id):
+        '''
+        Returns the PrM ID, if valid.
+        '''
+        if prm_id not in self._prm_ids:
+            raise APIError(404, f'No PrM {prm_id}.')
+        return prm_id
+
+    def _check_not_bound(self, prm_id):
+        '''
+        Checks that the PrM is not controlled via another one.
+        '''
+        if prm_id in self._bound_prms:
+            raise APIError(400, f'PrM {prm_id} is controlled via PrM {self._bound_prms[prm_id]}.')
+
+    def _status(self):
+        return {
+            'prms': {prm_id: self._prm_status(prm_id) for prm_id in self._prm_ids},
+            'queue': self._manager.get_queue_state(),
+            'uploads': self._manager.get_upload_statistics(),
+        }
+
+    def _prm_status(self, prm_id):
+        cathode_hv, anode_hv, anodegrid_hv = self._manager.get_hv(prm_id)
+        qa, qc, tau = self._manager.get_latest_lifetime(prm_id)
+        return {
+            'prm_id': prm_id,
+            'bound_to': self._bound_prms.get(prm_id),
+            'running': self._manager.is_running(prm_id),
+            'queued': self._manager.is_queued(prm_id),
+            'mode': self._manager.get_mode(prm_id),
+            'interval': self._manager.get_interval(prm_id),
+            'next_run_in': self._manager.remaining_time(prm_id) / 1e3,
+            'run_number': self._manager.get_run_number(prm_id),
+            'hv': {'cathode': cathode_hv, 'anode': anode_hv, 'anodegrid': anodegrid_hv},
+            'hv_status': self._manager.get_hv_status(prm_id),
+            'latest': {'qa': qa, 'qc': qc, 'tau': tau},
+        }
+
+    def _prm_results(self, prm_id):
+        return {
+            'prm_id': prm_id,
+            'run_number': self._manager.get_run_number(prm_id),
+            'measurement': self._manager.get_latest_measurement(prm_id),
+            'timing': self._manager.get_timing(prm_id),
+            'timing_statistics': self._manager.get_timing_statistics(prm_id),
+        }
+
+    def _start(self, prm_id, _):
+        self._check_not_bound(prm_id)
+        self._manager.start_prm(prm_id)
+        return self._prm_status(prm_id)
+
+    def _stop(self, prm_id, _):
+        self._check_not_bound(prm_id)
+        self._manager.stop_prm(prm_id)
+        return self._prm_status(prm_id)
+
+    def _set_mode(self, prm_id, body):
+        self._check_not_bound(prm_id)
+        mode = body.get('mode')
+        if mode not in ('auto', 'manual'):
+            raise APIError(400, 'mode must be "auto" or "manual".')
+        if 'interval' in body:
+            self._manager.set_interval(prm_id, float(body['interval']))
+        self._manager.set_mode(prm_id, mode)
+        return self._prm_status(prm_id)
+
+    def _set_interval(self, prm_id, body):
+        self._check_not_bound(prm_id)
+        if 'interval' not in body:
+            raise APIError(400, 'Missing interval.')
+        self._manager.set_interval(prm_id, float(body['interval']))
+        return self._prm_status(prm_id)
+
+    def _set_hv(self, prm_id, body):
+        if 'on' not in body:
+            raise APIError(400, 'Missing on.')
+        if body['on']:
+            self._manager.hv_on(prm_id)
+        else:
+            self._manager.hv_off(prm_id)
+        return self._prm_status(prm_id)
+
+    def _set_inhibit(self, prm_id, body):
+        self._manager.inhibit_run(prm_id, bool(body.get('inhibit', True)))
+        return self._prm_status(prm_id)
+
+    def _set_comment(self, body):
+        if 'comment' not in body:
+            raise APIError(400, 'Missing comment.')
+        self._manager.set_comment(str(body['comment']))
+        return {'comment': str(body['comment'])}
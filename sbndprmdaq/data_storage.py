@@ -3,12 +3,11 @@ Contains data storage class for purity monitor data.
 '''
 import os
 import logging
-import subprocess
-import time
-import copy
 import paramiko
 from scp import SCPClient
-import pandas as pd
+
+from sbndprmdaq.kerberos import KerberosCredentialManager
+from sbndprmdaq.measurement_store import MeasurementStore
 
 #pylint: disable=too-few-public-methods,duplicate-code
 class DataStorage():
@@ -16,67 +15,35 @@ class DataStorage():
     A class that handles storage of purity monitor data
     '''
 
-    def __init__(self, config):
+    def __init__(self, config, credentials=None):
         '''
         Constructor.
 
         Args:
             config (dict): The overall configuration.
+            credentials (KerberosCredentialManager): The Kerberos credentials (one is made if None).
         '''
         self._logger = logging.getLogger(__name__)
         self._config = config
 
+        if credentials is None:
+            credentials = KerberosCredentialManager(config.get('kerberos'))
+        self._credentials = credentials
+
+        self._measurement_store = None
+
 
     def kinit(self):
         '''
         Authenticates via a keytab
         '''
-
-        os.environ["KRB5CCNAME"] = "/tmp/krb5cc_sbndprm"
-
-        cmd = 'kinit -kt /var/kerberos/krb5/user/25081/client.keytab sbndprm/sbnd-prm01.fnal.gov@FNAL.GOV'
-
-        start = time.time()
-
-        with subprocess.Popen(cmd.split()) as proc:
-            while proc.poll():
-                time.sleep(0.1)
-                if time.time() - start > 5:
-                    proc.terminate()
-                    self._logger.error(f'Timeout during command: {cmd}')
-
-        self._logger.info("Kerberos certificate obtained.")
+        self._credentials.renew()
 
     def check_ticket(self):
         '''
         Checks if a valid kerberos ticket is available
         '''
-
-        self._logger.info('Checking ticket...')
-
-        cmd = 'klist -f'
-
-        start = time.time()
-
-        with subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
-            while proc.poll():
-                time.sleep(0.1)
-            if time.time() - start > 5:
-                proc.terminate()
-                self._logger.error(f'Timeout during command: {cmd}')
-
-            comm = proc.communicate()
-            out = comm[0].decode("utf-8")
-            err = comm[1].decode("utf-8")
-
-            self._logger.info(f'out: {out}')
-            self._logger.info(f'err: {err}')
-
-            if 'No credentials cache found' in err:
-                self._logger.info('no ticket found...')
-                return False
-
-        return True
+        return self._credentials.remaining_time() > 0
 
     def store_files(self, filenames):
         '''
@@ -91,9 +58,7 @@ class DataStorage():
 
         #pylint: disable=broad-exception-caught
         try:
-            # if not self.check_ticket():
-                # self._logger.info('Ticket expired. Regenerating.')
-            self.kinit()
+            self._credentials.ensure_valid()
 
             real_filenames = []
             self._logger.info(f"Storing these files to {self._config['data_storage_host']}:{self._config['data_storage_path']}:")
@@ -149,50 +114,53 @@ class DataStorage():
         return os.path.isfile(filename)
 
 
-    def update_dataframe(self, measurement, prm_id):
+    def store_measurement(self, measurement, prm_id, run_number=None):
         '''
-        Updates the dataframe containing all the purity measurements
+        Adds the latest measurement to the measurement store
 
         Args:
             measurement (dict): the latest measturement
             prm_id (int): the purity monitor ID
+            run_number (int): the run number
         '''
-        #pylint: disable=invalid-name
-
-        self._logger.warning('Updating dataframe.')
-
         if measurement is None:
-            self._logger.warning('No measurement available to save to dataframe.')
+            self._logger.warning('No measurement available to save to the measurement store.')
             return
 
-        dataframe_file_name = self.get_dataframe_path()
+        store = self.get_measurement_store()
 
-        if dataframe_file_name is None:
-            self._logger.warning('No dataframe path. No measurement will be saved to the dataframe.')
+        if store is None:
+            self._logger.warning('No measurement store. No measurement will be saved.')
             return
 
-        if not os.path.exists(dataframe_file_name):
-            self._logger.info('Measurements dataframe file doesnt exist. One will be created.')
-        else:
-            self._logger.info('Measurements dataframe file exists. It will be updated.')
+        store.append(measurement, prm_id, run_number)
 
-        df = pd.read_csv(dataframe_file_name)
+    def get_measurement_store(self):
+        '''
+        Returns the measurement store, opened the first time. The
+        measurements of the CSV dataframe, if any, are imported once.
+        '''
+        if self._measurement_store is not None:
+            return self._measurement_store
+
+        dataframe_file_name = self.get_dataframe_path()
+
+        if dataframe_file_name is None:
+            return None
 
-        meas = copy.copy(measurement)
-        meas['prm_id'] = prm_id
-        meas['drifttime'] = meas.pop('td')
-        meas['lifetime'] = meas.pop('tau')
-        meas['hv_c'] = meas.pop('v_c')
-        meas['hv_ag'] = meas.pop('v_ag')
-        meas['hv_a'] = meas.pop('v_a')
+        store_file_name = os.path.join(self._config['data_files_path'],
+                                       self._config.get('measurement_store_file', 'prm_measurements.sqlite'))
+        self._measurement_store = MeasurementStore(store_file_name)
 
-        df = df.append(meas, ignore_index=True)
+        if os.path.exists(dataframe_file_name):
+            self._measurement_store.import_csv(dataframe_file_name)
 
-        df.to_csv(dataframe_file_name)
+        return self._measurement_store
 
     def get_dataframe_path(self):
         '''
-        Returns the path to the dataframe
+        Returns the path to the CSV dataframe, where the measurements
+        were stored before the measurement store
         '''
 
         if self._config['data_files_path'] is None:
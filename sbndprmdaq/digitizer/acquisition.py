@@ -0,0 +1,109 @@
+'''
+Contains the classes used for asynchronous acquisitions
+'''
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, CancelledError
+
+
+AcquisitionResult = namedtuple('AcquisitionResult', [
+    'status',        # True if the capture succeeded
+    'data',          # The captured data, as a WaveformBatch (None if accumulated)
+    'start_time',    # The datetime when the capture started
+    'capture_time',  # Time (in seconds) the capture took
+    'readout_time',  # Time (in seconds) the readout took after the capture
+])
+
+
+class AcquisitionCancelled(CancelledError):
+    '''
+    Raised by AcquisitionFuture.result() if the acquisition
+    was cancelled while running. Catching it also catches the
+    CancelledError raised if it was cancelled before starting.
+    '''
+
+
+class AcquisitionFuture(Future):
+    '''
+    A future for an acquisition, which resolves to an AcquisitionResult.
+    On top of the standard Future, it reports progress, tells when
+    the records have been captured (before they are read out), and can be
+    cancelled while running.
+    '''
+
+    def __init__(self, accumulator=None):
+        '''
+        Contructor.
+
+        Args:
+            accumulator (WaveformAccumulator): If passed, the data is added to it
+                                               as it is read out, instead of being
+                                               returned in the result.
+        '''
+        super().__init__()
+        self.accumulator = accumulator
+        self._cancel_requested = threading.Event()
+        self._captured = threading.Event()
+        self._captured_or_done = threading.Event()
+        self._progress_callbacks = []
+
+        self.add_done_callback(lambda _: self._captured_or_done.set())
+
+    def cancel(self):
+        '''
+        Requests the cancellation of the acquisition. If the acquisition
+        is already running, it is stopped at the next check and the future
+        raises AcquisitionCancelled.
+
+        Returns:
+            bool: True if the acquisition will not complete.
+        '''
+        self._cancel_requested.set()
+        return super().cancel() or not self.done()
+
+    def cancel_requested(self):
+        '''
+        Returns True if the cancellation was requested.
+        '''
+        return self._cancel_requested.is_set()
+
+    def add_progress_callback(self, callback):
+        '''
+        Adds a function called with (name, percentage) on every progress event.
+
+        Args:
+            callback (function): The callback.
+        '''
+        self._progress_callbacks.append(callback)
+
+    def report_progress(self, name, perc):
+        '''
+        Reports progress to the callbacks.
+
+        Args:
+            name (str): The name of the current step.
+            perc (float): The progress (0 to 100 percent).
+        '''
+        for callback in self._progress_callbacks:
+            callback(name, perc)
+
+    def set_captured(self):
+        '''
+        Flags that the records have been captured by the digitizer.
+        '''
+        self._captured.set()
+        self._captured_or_done.set()
+
+    def wait_captured(self, timeout=None):
+        '''
+        Waits until the records have been captured by the digitizer
+        (they may still need to be read out), or the acquisition ended.
+
+        Args:
+            timeout (float): Max time to wait (in seconds).
+
+        Returns:
+            bool: True if the records have been captured.
+        '''
+        self._captured_or_done.wait(timeout)
+        return self._captured.is_set()
@@ -3,14 +3,37 @@ Contains class to control Analog Discovery Pro digitizer
 '''
 import logging
 import time
+import json
+import datetime
 
 import requests
-import paramiko
-from sshtunnel import SSHTunnelForwarder
 
 from sbndprmdaq.digitizer.digitizer_base import DigitizerBase
+from sbndprmdaq.digitizer.acquisition import AcquisitionResult, AcquisitionCancelled
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+from sbndprmdaq.digitizer.sample_encoding import SampleEncoding
+from sbndprmdaq.digitizer.ssh_transport import SSHTransport
 
 
+class ADProException(Exception):
+    '''
+    Exception class for ADProControl.
+    '''
+
+    def __init__(self, logger, message):
+        '''
+        Contructor.
+
+        Args:
+            logger (PrMLogger): The logger widget.
+            message (str): The error message to display.
+        '''
+        self._message = message
+        logger.critical(self._message)
+        super().__init__(self._message)
+
+
+#pylint: disable=too-many-instance-attributes,too-many-public-methods
 class ADProControl(DigitizerBase):
     '''
     This class controls the Analog Discovery Pro digitizer
@@ -25,17 +48,40 @@ class ADProControl(DigitizerBase):
             prm_ids (list): List of PrM IDs (unused).
             config (dict): The configuration dictionary.
         '''
+        super().__init__()
 
         self._logger = logging.getLogger(__name__)
 
-        self._ssh_forward(config)
+        self._config = config
+
+        self._server = None
+        self._api_startup_time = None
+
+        if config.get('adpro_url'):
+            # Talk to the API directly (eg. the local emulator), without SSH
+            self._url = config['adpro_url']
+            self._logger.info(f'Using ADPro API at {self._url} without SSH tunnel')
+        else:
+            self._ssh_forward(config)
+
         self._start_api(config)
 
         self._to = 30 # timeout for requests
 
-        self.set_number_acquisitions(20)
+        # On-device reduction of the captured records
+        self._reduce_data = config.get('adpro_reduce_data', False)
+        self._reduce_n_raw = config.get('adpro_reduce_n_raw', 0)
+        self._record_summary = None
 
-        self._config = config
+        # Streaming of the records while the capture is in progress
+        self._stream_data = config.get('adpro_stream_data', False)
+        self._stream_chunk_size = config.get('adpro_stream_chunk_size', 5)
+
+        # Sampling rate and trigger sample, attached to every batch of
+        # waveforms (read once, and again after set_samples_per_second)
+        self._timing = None
+
+        self.set_number_acquisitions(20)
 
 
     def _ssh_forward(self, config):
@@ -48,10 +94,14 @@ class ADProControl(DigitizerBase):
 
         self._logger.info('Starting SSH forwarding for ADPro')
 
-        self._server = SSHTunnelForwarder(config['adpro_ip'],
-                                          ssh_username=config['adpro_username'],
-                                          ssh_password=config['adpro_password'],
-                                          remote_bind_address=('127.0.0.1', config['adpro_port']))
+        # One SSH connection carries both the port forward and the
+        # commands, and reconnects by itself if the connection drops
+        self._server = SSHTransport(config['adpro_ip'],
+                                    username=config['adpro_username'],
+                                    password=config['adpro_password'],
+                                    remote_port=config['adpro_port'],
+                                    keepalive=config.get('adpro_ssh_keepalive', 1),
+                                    on_reconnect=self.check_connection)
 
         self._server.start()
 
@@ -64,53 +114,85 @@ class ADProControl(DigitizerBase):
     def _start_api(self, config):
         '''
         Starts the Analog Discovery Pro API on the ditizer itself.
+        If a healthy API is already listening through the tunnel, it is reused
+        and no new server is launched. If there is no tunnel (adpro_url is set),
+        this only waits for the API to be ready.
 
         Args:
             config (dict): The configuration dictionary.
+
+        Returns:
+            float: The time (in seconds) it took for the API to be ready.
         '''
 
-        self._logger.info('Starting API on ADPro')
+        start = time.monotonic()
+
+        if self._check_digitizer():
+            self._api_startup_time = time.monotonic() - start
+            self._logger.info(f'ADPro API already running, reusing it (ready in {self._api_startup_time:.3f} s).')
+            return self._api_startup_time
 
-        self._ssh = paramiko.SSHClient()
-        self._ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self._ssh.connect(config['adpro_ip'],
-                          username=config['adpro_username'],
-                          password=config['adpro_password'])
+        if self._server is None:
+            return self._wait_for_api(start, config)
 
-        # stdin, stdout, stderr = self._ssh.exec_command(command)
+        self._logger.info('Starting API on ADPro')
 
-        # command = 'cd adpro_api; '
-        #command =  'sudo su; '
-        #stdin, stdout, stderr = self._ssh.exec_command(command)
-        #self._logger.info('Executed ' + command + ' on ' + config['adpro_ip'])
-        #command =  'export PYTHONPATH=/home/digilent/.local/lib/python3.7/site-packages/:$PYTHONPATH; '
+        # Run uvicorn in production mode: --reload adds a file watcher
+        # on the device and should only be used when developing the API
         command =  'cd /home/digilent/AnalogDiscoveryPro; '
-        command += 'sudo /home/digilent/.local/bin/uvicorn main:app --reload'
-        print('Executing command:', command)
-        stdin, stdout, stderr = self._ssh.exec_command(command)
+        command += f"sudo /home/digilent/.local/bin/uvicorn main:app --host 127.0.0.1 --port {config['adpro_port']}"
+        if config.get('adpro_api_reload', False):
+            command += ' --reload'
+        stdin, stdout, stderr = self._server.exec_command(command)
         self._logger.info(f"Executed {command} on {config['adpro_ip']}")
-        # self._logger.info('Errors:' + ' '.join(stderr.readlines()))
-        # self._logger.info('Out:' + ' '.join(stdout.readlines()))
+
+        return self._wait_for_api(start, config)
+
+    def _wait_for_api(self, start, config):
+        '''
+        Polls the API with backoff until it is ready.
+
+        Args:
+            start (float): The monotonic time when the startup began.
+            config (dict): The configuration dictionary.
+
+        Returns:
+            float: The time (in seconds) it took for the API to be ready.
+        '''
         self._logger.info('Waiting for ADPro API to start...')
 
-        time.sleep(8)
+        timeout = config.get('adpro_api_start_timeout', 30)
+        delay = 0.02
         while not self._check_digitizer():
-            time.sleep(1)
-        self._logger.info('ADPro API ready.')
+            if time.monotonic() - start > timeout:
+                raise ADProException(self._logger, f'ADPro API not ready after {timeout} seconds.')
+            time.sleep(delay)
+            delay = min(delay * 1.5, 0.25)
 
-    def check_connection(self):
+        self._api_startup_time = time.monotonic() - start
+        self._logger.info(f'ADPro API ready in {self._api_startup_time:.3f} s.')
+
+        return self._api_startup_time
+
+    def get_api_startup_time(self):
         '''
-        Checks if connection is still live
+        Returns the time (in seconds) it took for the API to be
+        ready the last time it was (re)started or reused.
         '''
-        if self._server.tunnel_is_up:
-            return
-
-        self._logger.warning('ADPro SSH tunnel is down. Restarting...')
+        return self._api_startup_time
 
-        self._server.stop()
-        self._server.start()
+    def check_connection(self):
+        '''
+        Checks if connection is still live, re-establishing the SSH
+        connection and restarting the API if needed. This is also called
+        automatically when the SSH connection is re-established.
+        '''
+        if self._server is not None:
+            self._server.ensure_connected()
 
-        self._start_api(self._config)
+        if not self._check_digitizer():
+            self._logger.warning('ADPro API is not reachable. Restarting...')
+            self._start_api(self._config)
 
 
     #pylint: disable=bare-except
@@ -141,6 +223,7 @@ class ADProControl(DigitizerBase):
 
     def set_samples_per_second(self, samples):
 
+        self._timing = None
         return requests.get(self._url + f"/digitizer/set_samples_per_second/{samples}", timeout=self._to).json()['set_samples_per_second']
 
 
@@ -168,6 +251,13 @@ class ADProControl(DigitizerBase):
 
         return requests.get(self._url + "/digitizer/input_range_volts", timeout=self._to).json()['input_range_volts']
 
+    def get_sample_encoding(self):
+        '''
+        The API sends volts, from a 14-bit ADC: they are stored
+        as 16-bit codes, finer than the ADC resolution.
+        '''
+        return SampleEncoding.from_bits(16, self.get_input_range_volts())
+
 
     def lamp_on(self):
 
@@ -195,6 +285,8 @@ class ADProControl(DigitizerBase):
 
     def start_capture(self):
 
+        self.check_connection()
+
         self._logger.info('Starting capture')
 
         response = requests.get(self._url + "/digitizer/start_capture", timeout=self._to)
@@ -217,24 +309,172 @@ class ADProControl(DigitizerBase):
         return False
 
 
+    def _make_batch(self, data):
+        '''
+        Makes a WaveformBatch from the records sent by the API.
+        '''
+        return WaveformBatch.from_dict(data, *self._timing_info())
+
+
+    def _timing_info(self):
+        '''
+        Returns the sampling rate and the trigger sample.
+        '''
+        if self._timing is None:
+            self._timing = (self.get_samples_per_second(), self.get_trigger_sample())
+
+        return self._timing
+
+
     def get_data(self):
 
+        if self._reduce_data:
+            # Every capture has the same number of records, so the mean
+            # waveform is returned as a single record per channel and
+            # averaging over repetitions downstream is still unbiased
+            reduced = self.get_reduced_data()
+            return self._make_batch({ch: [values['mean']] for ch, values in reduced.items()})
+
         response = requests.get(self._url + "/digitizer/get_data", timeout=self._to)
 
-        # if response.json()['data'] != 'true':
-        #     self._logger.critical('API error: start_capture failed')
+        return self._make_batch(response.json()['data'])
+
+
+    def stream_data(self, chunk_size=None):
+        '''
+        Yields the records in chunks, as (data, status) tuples, while the
+        capture is still in progress. The API sends one JSON line per chunk
+        via /digitizer/stream_data/{chunk_size}, the last one carrying the
+        capture status. Falls back to the default implementation (waiting
+        for the capture to complete) if adpro_stream_data is not set or if
+        the data is reduced on the device.
+
+        Args:
+            chunk_size (int): The number of records per chunk
+                              (defaults to adpro_stream_chunk_size).
+        '''
+
+        if not self._stream_data or self._reduce_data:
+            yield from super().stream_data(chunk_size)
+            return
+
+        if chunk_size is None:
+            chunk_size = self._stream_chunk_size
+
+        with requests.get(self._url + f"/digitizer/stream_data/{chunk_size}",
+                          stream=True, timeout=self._to) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                yield self._make_batch(chunk['data']), chunk['status']
+                if chunk['status'] is not None:
+                    return
+
+        self._logger.critical('API error: stream_data ended before the capture completed')
+        yield WaveformBatch.empty(), False
+
+
+    def _acquire(self, future):
+        '''
+        Performs one acquisition. If streaming is enabled, the records are
+        read out while the capture is in progress, reporting progress and
+        checking for cancellation after every chunk.
+        '''
+
+        if not self._stream_data or self._reduce_data:
+            return super()._acquire(future)
+
+        start_time = datetime.datetime.today()
+        start = time.monotonic()
+
+        self.start_capture()
+
+        chunks = []
+        status = False
+        n_expected = max(self.get_number_acquisitions(), 1)
+        n_received = 0
 
-        data = response.json()['data']
+        for chunk, status in self.stream_data():
+            if future.cancel_requested():
+                raise AcquisitionCancelled()
 
-        # Rename 1->A 2->B, and embed list into another list
-        # data['A'] = [data[1]]
-        # data['B'] = [data[2]]
-        # data['A'] = [data[1]]
-        # data['B'] = [data[2]]
-        # del data[1]
-        # del data[2]
+            # Chunks are added to the accumulator (if any) as they arrive
+            n_received += chunk.n_records
+            chunk = self._accumulate(future, chunk)
+            if chunk is not None:
+                chunks.append(chunk)
 
-        return data
+            future.report_progress('Retrieving Data', min(n_received / n_expected * 100, 100))
+
+        future.set_captured()
+
+        # Records are read out during the capture, so there is no readout time left
+        return AcquisitionResult(status=status,
+                                 data=WaveformBatch.concatenate(chunks) if future.accumulator is None else None,
+                                 start_time=start_time,
+                                 capture_time=time.monotonic() - start,
+                                 readout_time=0.)
+
+
+    def _read_out(self, future):
+        '''
+        Reads out the captured data. If the data is reduced on the device,
+        its mean and variance are added to the accumulator, together with
+        the raw records sent.
+        '''
+        if not self._reduce_data or future.accumulator is None:
+            return super()._read_out(future)
+
+        reduced = self.get_reduced_data()
+        channels = [ch for ch, values in reduced.items() if values['n_records']]
+        if not channels:
+            return None
+
+        future.accumulator.add_stats(channels,
+                                     reduced[channels[0]]['n_records'],
+                                     [reduced[ch]['mean'] for ch in channels],
+                                     [reduced[ch]['variance'] for ch in channels],
+                                     *self._timing_info(),
+                                     records=self._make_batch({ch: reduced[ch]['raw'] for ch in channels}))
+        return None
+
+
+    def get_reduced_data(self, n_raw=None):
+        '''
+        Returns the captured data reduced on the device, so that the amount
+        of data transferred does not depend on the number of acquisitions.
+
+        For every channel, the returned dictionary contains:
+        'n_records' (the number of records reduced), 'mean' and 'variance'
+        (the waveforms averaged over the records), 'min', 'max' and
+        'baseline' (one value per record, the baseline being the mean of the
+        pre-trigger samples), and 'raw' (the first n_raw raw records).
+
+        Args:
+            n_raw (int): The number of raw records to return per channel
+                         (defaults to adpro_reduce_n_raw).
+
+        Returns:
+            dict: The reduced data, keyed by channel.
+        '''
+
+        if n_raw is None:
+            n_raw = self._reduce_n_raw
+
+        response = requests.get(self._url + f"/digitizer/get_reduced_data/{n_raw}", timeout=self._to)
+
+        self._record_summary = response.json()['data']
+
+        return self._record_summary
+
+
+    def get_record_summary(self):
+        '''
+        Returns the reduced data from the latest call to get_reduced_data,
+        or None if no reduced data has been retrieved yet.
+        '''
+        return self._record_summary
 
 
 if __name__ == "__main__":
@@ -0,0 +1,433 @@
+'''
+Contains a local stand-in for the Analog Discovery Pro REST API,
+for development and load testing without the physical digitizer.
+
+Run it with:
+
+    python -m sbndprmdaq.digitizer.adpro_emulator --port 8000
+
+and set ``adpro_url: 'http://127.0.0.1:8000'`` in the configuration to
+talk to it without the SSH tunnel.
+'''
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+
+#pylint: disable=too-many-instance-attributes
+class ADProEmulator:
+    '''
+    Emulates the state of the Analog Discovery Pro digitizer and lamp,
+    and produces purity monitor waveforms for two PrMs (channels 1, 2
+    for the first PrM and channels 3, 4 for the second one).
+    '''
+
+    _n_channels = 4
+
+    #pylint: disable=too-many-arguments
+    def __init__(self, capture_time=None, time_scale=1.,
+                 latency=0., failure_rate=0., seed=None):
+        '''
+        Contructor.
+
+        Args:
+            capture_time (float): Time (in seconds) a capture takes. If None,
+                                  it is the number of acquisitions divided by the lamp rate.
+            time_scale (float): Factor applied to the capture time.
+            latency (float): Time (in seconds) added to every response.
+            failure_rate (float): Probability for a request to fail with HTTP 500.
+            seed (int): Seed for the random number generator.
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        self.capture_time = capture_time
+        self.time_scale = time_scale
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+        self._samples_per_second = 2000000
+        self._pre_trigger_samples = 300
+        self._post_trigger_samples = 2700
+        self._input_range_volts = 5
+        self._number_acquisitions = 20
+
+        self._lamp_on = False
+        self._lamp_frequency = 2
+
+        self._capture_start = None
+        self._capture_n = 0
+        self._records = None
+
+        # Signal parameters per PrM: (qc [V], td [s], tau [s])
+        self.signals = {
+            0: (0.15, 1.0e-3, 2.0e-3),
+            1: (0.10, 0.4e-3, 2.0e-3),
+        }
+        self.noise = 1e-3 # V
+
+    def get_capture_time(self):
+        '''
+        Returns the time (in seconds) the current capture takes.
+        '''
+        if self.capture_time is not None:
+            return self.capture_time * self.time_scale
+        return self._capture_n / max(self._lamp_frequency, 1e-3) * self.time_scale
+
+    def busy(self):
+        '''
+        Returns True if a capture is ongoing.
+        '''
+        with self._lock:
+            return self._busy()
+
+    def _busy(self):
+        if self._capture_start is None:
+            return False
+        return time.monotonic() - self._capture_start < self.get_capture_time()
+
+    def start_capture(self):
+        '''
+        Starts a capture of number_acquisitions records.
+        '''
+        with self._lock:
+            self._capture_start = time.monotonic()
+            self._capture_n = self._number_acquisitions
+            self._records = None
+        return True
+
+    def check_capture(self):
+        '''
+        Returns True if the capture has completed.
+        '''
+        with self._lock:
+            return self._capture_start is not None and not self._busy()
+
+    def get_records(self):
+        '''
+        Returns the captured records as an array of
+        shape (channel, record, sample), in volts.
+        '''
+        with self._lock:
+            if self._capture_start is None or self._busy():
+                return np.zeros((self._n_channels, 0, self.n_samples()))
+            return self._get_all_records()
+
+    def _get_all_records(self):
+        if self._records is None:
+            self._records = self.make_records(self._capture_n)
+        return self._records
+
+    def get_available_records(self):
+        '''
+        Returns the records digitized so far in the current capture,
+        assuming the lamp flashes at a constant rate, and whether the
+        capture has completed.
+
+        Returns:
+            np.ndarray: The records, of shape (channel, record, sample), in volts.
+            bool: True if the capture has completed.
+        '''
+        with self._lock:
+            if self._capture_start is None:
+                return np.zeros((self._n_channels, 0, self.n_samples())), False
+            done = not self._busy()
+            n_available = self._capture_n
+            if not done:
+                elapsed = time.monotonic() - self._capture_start
+                n_available = int(elapsed / self.get_capture_time() * self._capture_n)
+            return self._get_all_records()[:, :n_available], done
+
+    def stream_records(self, chunk_size):
+        '''
+        Yields chunks of records as they are digitized, as (data, status)
+        tuples, where status is None until the last chunk.
+
+        Args:
+            chunk_size (int): The number of records per chunk.
+        '''
+        chunk_size = max(chunk_size, 1)
+        n_sent = 0
+        while True:
+            records, done = self.get_available_records()
+            n_available = records.shape[1]
+
+            while n_available - n_sent >= chunk_size or (done and n_available > n_sent):
+                chunk = records[:, n_sent:n_sent + chunk_size]
+                n_sent += chunk.shape[1]
+                last = done and n_sent == n_available
+                yield {str(i + 1): chunk[i].tolist() for i in range(self._n_channels)}, (True if last else None)
+                if last:
+                    return
+
+            if done:
+                yield {str(i + 1): [] for i in range(self._n_channels)}, True
+                return
+
+            time.sleep(0.01)
+
+    def n_samples(self):
+        '''
+        Returns the number of samples per record.
+        '''
+        return self._pre_trigger_samples + self._post_trigger_samples
+
+    #pylint: disable=too-many-locals
+    def make_records(self, n_records):
+        '''
+        Produces n_records purity monitor records for all channels.
+
+        Args:
+            n_records (int): The number of records.
+
+        Returns:
+            np.ndarray: The records, of shape (channel, record, sample), in volts.
+        '''
+        n_samples = self.n_samples()
+        t = (np.arange(n_samples) - self._pre_trigger_samples) / self._samples_per_second
+
+        records = self._rng.normal(0., self.noise, size=(self._n_channels, n_records, n_samples))
+
+        if not self._lamp_on:
+            return records
+
+        rc = 119e-6 # s
+        t_rise = 10e-6 # s
+        for prm, (qc, td, tau) in self.signals.items():
+            qa = qc * np.exp(-td / tau)
+            jitter = self._rng.normal(1., 0.02, size=(n_records, 1))
+
+            # Cathode: fast negative pulse recovering with the electronics RC
+            cathode = np.where(t > 0, -qc * np.minimum(t / t_rise, 1.) * np.exp(-np.clip(t, 0, None) / rc), 0.)
+
+            # Anode: positive pulse once the electrons have drifted
+            t_a = t - td
+            anode = np.where(t_a > 0, qa * np.minimum(t_a / t_rise, 1.) * np.exp(-np.clip(t_a, 0, None) / rc), 0.)
+
+            # Lamp pickup at the trigger on both channels
+            pickup = 0.02 * np.exp(-np.abs(t) / 2e-6)
+
+            records[2 * prm] += cathode * jitter + pickup
+            records[2 * prm + 1] += anode * jitter + pickup
+
+        return records
+
+    def get_reduced_records(self, n_raw):
+        '''
+        Returns the captured records reduced per channel.
+
+        Args:
+            n_raw (int): The number of raw records to return per channel.
+
+        Returns:
+            dict: The reduced records, keyed by channel ('1' to '4').
+        '''
+        records = self.get_records()
+        pre = self._pre_trigger_samples
+
+        reduced = {}
+        for i in range(self._n_channels):
+            recs = records[i]
+            reduced[str(i + 1)] = {
+                'n_records': len(recs),
+                'mean': recs.mean(axis=0).tolist() if len(recs) else [],
+                'variance': recs.var(axis=0).tolist() if len(recs) else [],
+                'min': recs.min(axis=1).tolist() if len(recs) else [],
+                'max': recs.max(axis=1).tolist() if len(recs) else [],
+                'baseline': recs[:, :pre].mean(axis=1).tolist() if len(recs) else [],
+                'raw': recs[:n_raw].tolist(),
+            }
+        return reduced
+
+    #pylint: disable=too-many-return-statements
+    def handle(self, path):
+        '''
+        Handles a GET request to the emulated API.
+
+        Args:
+            path (str): The requested path.
+
+        Returns:
+            dict: The response, or None if the path is unknown.
+        '''
+        if path == '/is_online/':
+            return {'is_online': True}
+
+        if path.startswith('/lamp_control/'):
+            self._lamp_on = path.endswith('/on')
+            return {'status': 'on' if self._lamp_on else 'off'}
+
+        match = re.fullmatch(r'/lamp_frequency/([0-9.]+)', path)
+        if match:
+            self._lamp_frequency = float(match.group(1))
+            return {'frequency': match.group(1)}
+
+        if not path.startswith('/digitizer/'):
+            return None
+
+        name = path[len('/digitizer/'):]
+
+        getters = {
+            'busy': self.busy,
+            'trigger_sample': lambda: self._pre_trigger_samples,
+            'samples_per_second': lambda: self._samples_per_second,
+            'number_acquisitions': lambda: self._number_acquisitions,
+            'pre_trigger_samples': lambda: self._pre_trigger_samples,
+            'post_trigger_samples': lambda: self._post_trigger_samples,
+            'input_range_volts': lambda: self._input_range_volts,
+        }
+        if name in getters:
+            return {name: getters[name]()}
+
+        if name == 'start_capture':
+            return {'status': self.start_capture()}
+
+        if name == 'check_capture':
+            return {'status': self.check_capture()}
+
+        if name == 'get_data':
+            records = self.get_records()
+            return {'data': {str(i + 1): records[i].tolist() for i in range(self._n_channels)}}
+
+        match = re.fullmatch(r'get_reduced_data/([0-9]+)', name)
+        if match:
+            return {'data': self.get_reduced_records(int(match.group(1)))}
+
+        match = re.fullmatch(r'set_(samples_per_second|number_acquisitions)/([0-9]+)', name)
+        if match:
+            setattr(self, '_' + match.group(1), int(match.group(2)))
+            return {'set_' + match.group(1): int(match.group(2))}
+
+        return None
+
+
+class ADProEmulatorHandler(BaseHTTPRequestHandler):
+    '''
+    HTTP handler that forwards requests to the ADProEmulator
+    attached to the server.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    # pylint: disable=invalid-name
+    def do_GET(self):
+        '''
+        Handles GET requests.
+        '''
+        emulator = self.server.emulator
+
+        if emulator.latency:
+            time.sleep(emulator.latency)
+
+        if emulator.failure_rate and random.random() < emulator.failure_rate:
+            self._send(500, {'detail': 'Injected failure'})
+            return
+
+        match = re.fullmatch(r'/digitizer/stream_data/([0-9]+)', self.path)
+        if match:
+            self._stream(emulator.stream_records(int(match.group(1))))
+            return
+
+        response = emulator.handle(self.path)
+
+        if response is None:
+            self._send(404, {'detail': 'Not Found'})
+            return
+
+        self._send(200, response)
+
+    def _stream(self, chunks):
+        '''
+        Sends the chunks as JSON lines, using chunked transfer encoding.
+        '''
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            for data, status in chunks:
+                line = json.dumps({'data': data, 'status': status}).encode('utf-8') + b'\n'
+                self.wfile.write(f'{len(line):X}\r\n'.encode('ascii') + line + b'\r\n')
+                self.wfile.flush()
+
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (e.g. a cancelled acquisition)
+            self.close_connection = True
+
+    def _send(self, code, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # pylint: disable=redefined-builtin
+    def log_message(self, format, *args):
+        '''
+        Sends the request logs to the logger instead of stderr.
+        '''
+        self.server.emulator._logger.debug(format % args) #pylint: disable=protected-access
+
+
+def start_emulator(host='127.0.0.1', port=0, **kwargs):
+    '''
+    Starts the emulated ADPro API in a background thread.
+
+    Args:
+        host (str): The host to bind to.
+        port (int): The port to bind to (0 for a free port).
+        kwargs: Arguments passed to ADProEmulator.
+
+    Returns:
+        ThreadingHTTPServer: The running server. Its url is in server.url
+                             and it can be stopped with server.shutdown().
+    '''
+    server = ThreadingHTTPServer((host, port), ADProEmulatorHandler)
+    server.daemon_threads = True
+    server.emulator = ADProEmulator(**kwargs)
+    server.url = f'http://{host}:{server.server_address[1]}'
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Emulated Analog Discovery Pro API')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Host to bind to.')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Port to bind to.')
+    parser.add_argument('--capture-time', type=float, default=None,
+                        help='Capture time in seconds (default: acquisitions / lamp rate).')
+    parser.add_argument('--time-scale', type=float, default=1.,
+                        help='Factor applied to the capture time.')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='Latency added to every response, in seconds.')
+    parser.add_argument('--failure-rate', type=float, default=0.,
+                        help='Probability for a request to fail with HTTP 500.')
+    cli_args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    emulator_server = ThreadingHTTPServer((cli_args.host, cli_args.port), ADProEmulatorHandler)
+    emulator_server.emulator = ADProEmulator(capture_time=cli_args.capture_time,
+                                             time_scale=cli_args.time_scale,
+                                             latency=cli_args.latency,
+                                             failure_rate=cli_args.failure_rate)
+    print(f'Emulated ADPro API available at http://{cli_args.host}:{cli_args.port}')
+    emulator_server.serve_forever()
@@ -5,12 +5,14 @@ from __future__ import division
 import ctypes
 import time
 import logging
-import copy
 
 import numpy as np
 
 from sbndprmdaq.digitizer.lamp_control_arduino import LampControlArduino
 from sbndprmdaq.digitizer.digitizer_base import DigitizerBase
+from sbndprmdaq.digitizer.acquisition import AcquisitionCancelled
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+from sbndprmdaq.digitizer.sample_encoding import SampleEncoding
 try:
     import sbndprmdaq.digitizer.atsapi as ats
 except OSError:
@@ -49,6 +51,8 @@ class ATS310(DigitizerBase):
             systemId (int): The system ID
             boardId (int): The board ID
         '''
+        super().__init__()
+
         self._logger = logging.getLogger(__name__)
 
         self._board = ats.Board(systemId, boardId)
@@ -166,6 +170,17 @@ class ATS310(DigitizerBase):
         return self._input_range_volts
 
 
+    def get_sample_encoding(self):
+        '''
+        Getter for the encoding of the samples: 12-bit codes, in the
+        most significant bits of 16-bit samples.
+
+        Returns:
+            SampleEncoding: The sample encoding.
+        '''
+        return SampleEncoding.from_bits(12, self._input_range_volts, bit_shift=4)
+
+
     def configure_board(self):
         '''
         Configures the board for acquisition
@@ -327,20 +342,42 @@ class ATS310(DigitizerBase):
         '''
         #pylint: disable=unused-variable
 
+        def report_progress(name, perc):
+            if progress_callback is not None:
+                progress_callback.emit(prm_id, name, perc)
+
+        return self._wait_for_capture(report_progress)
+
+    def _wait_for_capture(self, report_progress, cancel_requested=None):
+        '''
+        Waits for a capture to finish, aborting it on timeout.
+
+        Args:
+            report_progress (function): Called with (name, percentage) while waiting.
+            cancel_requested (function): If it returns True, the capture is aborted
+                                         and AcquisitionCancelled is raised.
+
+        Returns:
+            bool: True if the capture succeeded.
+        '''
+
         self._capture_success = False
 
         status = False
 
         while self._acquisition_timeout_sec > time.time() - self._start:
 
+            if cancel_requested is not None and cancel_requested():
+                self._board.abortCapture() # Stop the acquisition
+                raise AcquisitionCancelled()
+
             if not self._board.busy():
                 # Acquisition is done
                 status = True
                 break
 
             perc = (time.time() - self._start) / self._acquisition_timeout_sec * 100
-            if progress_callback is not None:
-                progress_callback.emit(prm_id, 'Check Capture', perc)
+            report_progress('Check Capture', perc)
             time.sleep(0.1)
 
         if not status:
@@ -371,25 +408,35 @@ class ATS310(DigitizerBase):
         return True
 
 
+    def _wait_capture(self, future):
+        '''
+        Waits for the capture, reporting progress to the future
+        and aborting the capture if cancellation is requested.
+        '''
+        return self._wait_for_capture(future.report_progress, future.cancel_requested)
+
+
     def get_data(self):
         '''
         Getter for the latest data.
 
         Returns:
-            dict: A dictionary containg the waveform for channel A and B.
+            WaveformBatch: The waveforms for channel A and B.
         '''
 
         start = time.time() # Keep track of when acquisition started
 
-        self._data = {
-        'A': [],
-        'B': [],
-        'C': [], # Not used
-        'D': [], # Not used
-        }
+        channel_names = [name for name, channel_id in zip(['A', 'B', 'C', 'D'], ats.channels)
+                         if channel_id & self._channels]
 
         if not self._capture_success:
-            return self._data
+            return WaveformBatch.empty(self._samples_per_sec, self._pre_trigger_samples,
+                                       channel_names, self._samples_per_record)
+
+        # Records are copied from the DMA buffer straight into one
+        # preallocated (channel, record, sample) array of ADC codes
+        codes = np.empty((len(channel_names), self._records_per_capture, self._samples_per_record),
+                         dtype=np.uint16)
 
         # buffersCompleted = 0
         bytesTransferred = 0
@@ -434,18 +481,12 @@ class ATS310(DigitizerBase):
                 #     buffer.buffer[:self._samples_per_record].tofile(dataFile)
 
                 if channel_id == ats.CHANNEL_A:
-                    self._data['A'].append(copy.copy(buffer.buffer[:self._samples_per_record]))
+                    codes[channel_names.index('A'), record] = buffer.buffer[:self._samples_per_record]
                 elif channel_id == ats.CHANNEL_B:
-                    self._data['B'].append(copy.copy(buffer.buffer[:self._samples_per_record]))
+                    codes[channel_names.index('B'), record] = buffer.buffer[:self._samples_per_record]
                 else:
                     raise ATS310Exception(self._logger, f'Unkown channel {channel_id}')
 
-                print(channel_id, buffer.buffer[:self._samples_per_record])
-
-                # plt.plot(buffer.buffer[:self._samples_per_record])
-                # plt.ylabel('some numbers')
-                # plt.show()
-
                 if ats.enter_pressed():
                     break
 
@@ -458,39 +499,26 @@ class ATS310(DigitizerBase):
 
         del buffer
 
-        self._convert_to_volts()
+        self._data = WaveformBatch(self._convert_to_volts(codes),
+                                   channel_names,
+                                   self._samples_per_sec,
+                                   self._pre_trigger_samples,
+                                   np.full(self._records_per_capture, self._start))
 
-        print('Returning data, self._samples_per_record', self._samples_per_record)
         return self._data
 
 
-    def _convert_to_volts(self):
+    def _convert_to_volts(self, codes):
         '''
-        Converts self._data from ADC to volts
-        '''
-        #pylint: disable=no-member
-
-        bit_shift = int(4)
-        bits_per_sample = int(12)
-        code_zero = float(1 << (bits_per_sample - 1)) - 0.5
-        code_range = float(1 << (bits_per_sample - 1)) - 0.5
+        Converts an array of ADC codes to volts.
 
-        if len(self._data['A']):
-            print('type(self._data[A])', type(self._data['A']))
-            print('type(self._data[A][0])', type(self._data['A'][0]))
-            sample_code = np.right_shift(self._data['A'], bit_shift)
-            self._data['A'] = self._input_range_volts * ((sample_code - code_zero) / code_range)
-            self._data['A'] = self._data['A'].tolist()
-
-        if len(self._data['B']):
-            sample_code = np.right_shift(self._data['B'], bit_shift)
-            self._data['B'] = self._input_range_volts * ((sample_code - code_zero) / code_range)
-            self._data['B'] = self._data['B'].tolist()
+        Args:
+            codes (np.ndarray): The ADC codes.
 
-        # sample_value = self._data['A'][0]
-        # sample_code = sample_value >> bit_shift
-        # sampleVolts = self._input_range_volts * (float(sample_code - code_zero) / code_range)
-        # print('from', sample_value, 'to', sampleVolts)
+        Returns:
+            np.ndarray: The values in volts.
+        '''
+        return self.get_sample_encoding().to_volts(codes, dtype=float)
 
 
 
@@ -2,7 +2,12 @@
 Contains base abstract class for the digitizer
 '''
 
+import time
+import datetime
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from sbndprmdaq.digitizer.acquisition import AcquisitionFuture, AcquisitionResult, AcquisitionCancelled
 
 class DigitizerBase(ABC):
     '''
@@ -10,7 +15,9 @@ class DigitizerBase(ABC):
     '''
 
     def __init__(self):
-        pass
+        # Acquisitions on one digitizer are run one after the other
+        self._acquisition_executor = ThreadPoolExecutor(max_workers=1,
+                                                        thread_name_prefix=type(self).__name__)
 
     @abstractmethod
     def busy(self):
@@ -48,6 +55,10 @@ class DigitizerBase(ABC):
     def get_input_range_volts(self):
         '''Returns the range in Volts'''
 
+    def get_sample_encoding(self):
+        '''Returns the SampleEncoding of the samples, or None if they are only available in volts'''
+        return None
+
     @abstractmethod
     def lamp_on(self):
         '''Turns on the flash lamp'''
@@ -70,4 +81,134 @@ class DigitizerBase(ABC):
 
     @abstractmethod
     def get_data(self):
-        '''Returns the captured data'''
+        '''Returns the captured data, as a WaveformBatch'''
+
+    def stream_data(self, chunk_size=None):
+        '''
+        Yields the captured data in chunks, as (data, status) tuples, while
+        the capture is in progress. status is None for all the chunks
+        but the last one, for which it is True if the capture succeeded.
+
+        This default implementation waits for the capture to complete
+        and yields all the data in one chunk.
+
+        Args:
+            chunk_size (int): The number of records per chunk (unused here).
+        '''
+        #pylint: disable=unused-argument
+        status = self.check_capture()
+        yield self.get_data(), status
+
+    def acquire_async(self, n_records=None, progress_callback=None, accumulator=None, *,
+                      configured_callback=None):
+        '''
+        Starts an acquisition in the background.
+
+        Args:
+            n_records (int): The number of records to acquire
+                             (if None, the current number of acquisitions is used).
+            progress_callback (function): Called with (name, percentage) on progress.
+            accumulator (WaveformAccumulator): If passed, the data is added to it
+                                               as it is read out.
+            configured_callback (function): Called, on the acquisition thread, once
+                                            the number of records is set.
+
+        Returns:
+            AcquisitionFuture: The future, resolving to an AcquisitionResult.
+        '''
+        future = AcquisitionFuture(accumulator)
+        if progress_callback is not None:
+            future.add_progress_callback(progress_callback)
+
+        self._acquisition_executor.submit(self._run_acquisition, future, n_records, configured_callback)
+
+        return future
+
+    #pylint: disable=broad-exception-caught
+    def _run_acquisition(self, future, n_records, configured_callback=None):
+        '''
+        Runs the acquisition for future, and sets its result.
+        '''
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            if n_records is not None:
+                self.set_number_acquisitions(n_records)
+            if configured_callback is not None:
+                configured_callback()
+            future.set_result(self._acquire(future))
+        except Exception as err:
+            future.set_exception(err)
+
+    def _acquire(self, future):
+        '''
+        Performs one acquisition: starts the capture, waits for it, and
+        reads out the data. Digitizers can override this to report progress
+        and handle cancellation natively.
+
+        Args:
+            future (AcquisitionFuture): The future of this acquisition.
+
+        Returns:
+            AcquisitionResult: The result.
+        '''
+        start_time = datetime.datetime.today()
+        start = time.monotonic()
+
+        future.report_progress('Start Capture', 0)
+        self.start_capture()
+        status = self._wait_capture(future)
+        capture_end = time.monotonic()
+        future.set_captured()
+
+        if future.cancel_requested():
+            raise AcquisitionCancelled()
+
+        future.report_progress('Retrieving Data', 100)
+        data = self._read_out(future)
+
+        return AcquisitionResult(status=status,
+                                 data=data,
+                                 start_time=start_time,
+                                 capture_time=capture_end - start,
+                                 readout_time=time.monotonic() - capture_end)
+
+    def _read_out(self, future):
+        '''
+        Reads out the captured data. Digitizers that can send
+        the data already reduced can override this.
+
+        Args:
+            future (AcquisitionFuture): The future of this acquisition.
+
+        Returns:
+            WaveformBatch: The data, or None if it was added to the accumulator.
+        '''
+        return self._accumulate(future, self.get_data())
+
+    @staticmethod
+    def _accumulate(future, data):
+        '''
+        Adds data to the accumulator of the future, if any.
+
+        Returns:
+            WaveformBatch: The data, or None if it was added to the accumulator.
+        '''
+        if future.accumulator is None:
+            return data
+        future.accumulator.add(data)
+        return None
+
+    def _wait_capture(self, future): #pylint: disable=unused-argument
+        '''
+        Waits for the capture started by _acquire to finish. Digitizers
+        can override this to report progress and stop on cancellation.
+
+        Args:
+            future (AcquisitionFuture): The future of this acquisition.
+
+        Returns:
+            bool: True if the capture succeeded.
+        '''
+        return self.check_capture()
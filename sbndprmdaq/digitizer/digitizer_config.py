@@ -0,0 +1,40 @@
+'''
+Contains the digitizer configuration snapshot
+'''
+from dataclasses import dataclass
+
+from sbndprmdaq.digitizer.sample_encoding import SampleEncoding
+
+
+#pylint: disable=too-many-instance-attributes
+@dataclass(frozen=True)
+class DigitizerConfig:
+    '''
+    An immutable snapshot of the configuration of a digitizer.
+    '''
+    samples_per_second: float
+    trigger_sample: int
+    pre_trigger_samples: int
+    post_trigger_samples: int
+    number_acquisitions: int
+    input_range_volts: float
+    sample_encoding: SampleEncoding = None
+
+    @classmethod
+    def from_digitizer(cls, digitizer):
+        '''
+        Reads the configuration from a digitizer.
+
+        Args:
+            digitizer (DigitizerBase): The digitizer.
+
+        Returns:
+            DigitizerConfig: The configuration snapshot.
+        '''
+        return cls(samples_per_second=digitizer.get_samples_per_second(),
+                   trigger_sample=digitizer.get_trigger_sample(),
+                   pre_trigger_samples=digitizer.get_pre_trigger_samples(),
+                   post_trigger_samples=digitizer.get_post_trigger_samples(),
+                   number_acquisitions=digitizer.get_number_acquisitions(),
+                   input_range_volts=digitizer.get_input_range_volts(),
+                   sample_encoding=digitizer.get_sample_encoding())
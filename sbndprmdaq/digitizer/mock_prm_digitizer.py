@@ -5,6 +5,8 @@ Contains a mock PrM digitizer class for testing purposed
 import datetime
 import numpy as np
 from .prm_digitizer import PrMDigitizer, DigitizerBase
+from .acquisition import AcquisitionResult, AcquisitionCancelled
+from .waveform_batch import WaveformBatch
 
 
 class MockDigitizer(DigitizerBase):
@@ -12,6 +14,7 @@ class MockDigitizer(DigitizerBase):
     A mock PrM digitizer class for testing purposed
     '''
     def __init__(self, prm_id):
+        super().__init__()
         self._prm_id = prm_id
 
     def busy(self):
@@ -75,16 +78,28 @@ class MockDigitizer(DigitizerBase):
         records_per_capture=1
         sample_size=4096
         offset = self._prm_id * 10
-        data = {
-            'prm_id': 1,
-            'status': True,
-            'time': datetime.datetime.today(),
-            'A': [np.random.normal(loc=0.0, scale=1.0, size=sample_size)+offset] * records_per_capture,
-            'B': [np.random.normal(loc=0.0, scale=1.0, size=sample_size)+offset] * records_per_capture,
-            'C': [np.random.normal(loc=0.0, scale=1.0, size=sample_size)+offset] * records_per_capture,
-            'D': [np.random.normal(loc=0.0, scale=1.0, size=sample_size)+offset] * records_per_capture
-        }
-        return data
+        waveforms = np.random.normal(loc=0.0, scale=1.0, size=(4, 1, sample_size)) + offset
+        return WaveformBatch(np.repeat(waveforms, records_per_capture, axis=1),
+                             ['A', 'B', 'C', 'D'],
+                             self.get_samples_per_second(),
+                             self.get_trigger_sample())
+
+    def _acquire(self, future):
+        '''Acquires mock data, reporting progress for every record'''
+        start_time = datetime.datetime.today()
+
+        n_records = self.get_number_acquisitions()
+        for i in range(n_records):
+            if future.cancel_requested():
+                raise AcquisitionCancelled()
+            future.report_progress('Check Capture', (i + 1) / n_records * 100)
+        future.set_captured()
+
+        return AcquisitionResult(status=True,
+                                 data=self._read_out(future),
+                                 start_time=start_time,
+                                 capture_time=0.,
+                                 readout_time=0.)
 
 
 class MockPrMDigitizer(PrMDigitizer):
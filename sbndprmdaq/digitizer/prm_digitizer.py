@@ -2,8 +2,10 @@
 Contains an overall digitizer control class
 '''
 import logging
+import threading
 
 from sbndprmdaq.digitizer.digitizer_base import DigitizerBase
+from sbndprmdaq.digitizer.digitizer_config import DigitizerConfig
 try:
     import sbndprmdaq.digitizer.atsapi as ats
 except OSError:
@@ -11,11 +13,13 @@ except OSError:
 from sbndprmdaq.digitizer.ats310 import ATS310
 from sbndprmdaq.digitizer.adpro_control import ADProControl
 
+#pylint: disable=too-many-public-methods
 class PrMDigitizer(DigitizerBase):
     '''
     This class manages all the PrM digitizers
     '''
 
+    #pylint: disable=super-init-not-called
     def __init__(self, config=None):
         '''
         Contructor.
@@ -27,6 +31,10 @@ class PrMDigitizer(DigitizerBase):
         self._logger = logging.getLogger(__name__)
         self._digitizers = {}
 
+        # Cached configuration snapshot per digitizer, invalidated by the setters
+        self._configs = {}
+        self._configs_lock = threading.Lock()
+
         print('prm_id_to_ats_systemid', config['prm_id_to_ats_systemid'])
         print('prm_id_to_adpro_channels', config['prm_id_to_adpro_channels'])
         print('prm_id_to_digitizer_type', config['prm_id_to_digitizer_type'])
@@ -124,6 +132,39 @@ class PrMDigitizer(DigitizerBase):
         self._logger.error(f'PrM {prm_id} not available.')
         raise ValueError()
 
+    def get_config(self, prm_id=1):
+        '''
+        Returns the configuration snapshot for the digitizer used by prm_id.
+        The snapshot is read from the digitizer only the first time, or
+        after it has been invalidated.
+
+        Args:
+            prm_id (int): The PrM ID
+
+        Returns:
+            DigitizerConfig: the configuration snapshot
+        '''
+        prm_id = self._process_prm_id(prm_id)
+
+        with self._configs_lock:
+            if prm_id not in self._configs:
+                self._configs[prm_id] = DigitizerConfig.from_digitizer(self._digitizers[prm_id])
+            return self._configs[prm_id]
+
+    def invalidate_config(self, prm_id=None):
+        '''
+        Invalidates the cached configuration snapshot, so that it is read
+        again from the digitizer. To be called when a digitizer is reconfigured.
+
+        Args:
+            prm_id (int): The PrM ID (if None, all snapshots are invalidated)
+        '''
+        with self._configs_lock:
+            if prm_id is None:
+                self._configs = {}
+            else:
+                self._configs.pop(self._process_prm_id(prm_id), None)
+
     def busy(self, prm_id=1):
 
         prm_id = self._process_prm_id(prm_id)
@@ -132,45 +173,47 @@ class PrMDigitizer(DigitizerBase):
 
     def get_trigger_sample(self, prm_id=1):
 
-        prm_id = self._process_prm_id(prm_id)
-        return self._digitizers[prm_id].get_trigger_sample()
+        return self.get_config(prm_id).trigger_sample
 
 
     def get_samples_per_second(self, prm_id=1):
 
-        prm_id = self._process_prm_id(prm_id)
-        return self._digitizers[prm_id].get_samples_per_second()
+        return self.get_config(prm_id).samples_per_second
 
     def set_samples_per_second(self, samples, prm_id=1):
 
         prm_id = self._process_prm_id(prm_id)
-        return self._digitizers[prm_id].set_samples_per_second(samples)
+        ret = self._digitizers[prm_id].set_samples_per_second(samples)
+        self.invalidate_config(prm_id)
+        return ret
 
     def get_number_acquisitions(self, prm_id=1):
 
-        prm_id = self._process_prm_id(prm_id)
-        return self._digitizers[prm_id].get_number_acquisitions()
+        return self.get_config(prm_id).number_acquisitions
 
     def set_number_acquisitions(self, n_acquisitions, prm_id=1):
 
         prm_id = self._process_prm_id(prm_id)
         print('prm_digitizer, set_number_acquisitions with ', prm_id)
-        return self._digitizers[prm_id].set_number_acquisitions(n_acquisitions)
+        ret = self._digitizers[prm_id].set_number_acquisitions(n_acquisitions)
+        self.invalidate_config(prm_id)
+        return ret
 
     def get_pre_trigger_samples(self, prm_id=1):
 
-        prm_id = self._process_prm_id(prm_id)
-        return self._digitizers[prm_id].get_pre_trigger_samples()
+        return self.get_config(prm_id).pre_trigger_samples
 
     def get_post_trigger_samples(self, prm_id=1):
 
-        prm_id = self._process_prm_id(prm_id)
-        return self._digitizers[prm_id].get_post_trigger_samples()
+        return self.get_config(prm_id).post_trigger_samples
 
     def get_input_range_volts(self, prm_id=1):
 
-        prm_id = self._process_prm_id(prm_id)
-        return self._digitizers[prm_id].get_input_range_volts()
+        return self.get_config(prm_id).input_range_volts
+
+    def get_sample_encoding(self, prm_id=1):
+
+        return self.get_config(prm_id).sample_encoding
 
     def start_capture(self, prm_id=1):
 
@@ -188,6 +231,27 @@ class PrMDigitizer(DigitizerBase):
         prm_id = self._process_prm_id(prm_id)
         return self._digitizers[prm_id].get_data()
 
+    def stream_data(self, chunk_size=None, prm_id=1):
+
+        prm_id = self._process_prm_id(prm_id)
+        return self._digitizers[prm_id].stream_data(chunk_size)
+
+    def acquire_async(self, n_records=None, progress_callback=None, accumulator=None, prm_id=1, *,
+                      configured_callback=None):
+
+        prm_id = self._process_prm_id(prm_id)
+
+        # The number of records is set later, on the acquisition thread:
+        # the snapshot is invalidated once it is set
+        def configured():
+            if n_records is not None:
+                self.invalidate_config(prm_id)
+            if configured_callback is not None:
+                configured_callback()
+
+        return self._digitizers[prm_id].acquire_async(n_records, progress_callback, accumulator,
+                                                      configured_callback=configured)
+
 
     def lamp_on(self, prm_id=1):
 
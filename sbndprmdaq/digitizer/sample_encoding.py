@@ -0,0 +1,88 @@
+'''
+Contains the conversion between the digitizer samples and volts
+'''
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class SampleEncoding:
+    '''
+    How a digitizer encodes the samples as integers:
+
+        volts = ((sample >> bit_shift) - code_zero) * input_range_volts / code_range
+
+    Storing the integer samples with these parameters takes 2 bytes per
+    sample instead of 8 for float64 volts, with no loss for a digitizer
+    that produces integer codes.
+    '''
+    bits_per_sample: int
+    bit_shift: int
+    code_zero: float
+    code_range: float
+    input_range_volts: float
+
+    @classmethod
+    def from_bits(cls, bits_per_sample, input_range_volts, bit_shift=0):
+        '''
+        Returns the encoding of unsigned codes spanning the input range
+        symmetrically around 0 V (eg. 0x000 is the negative full scale,
+        0x800 ~0 V and 0xFFF the positive full scale for 12 bits).
+
+        Args:
+            bits_per_sample (int): The number of significant bits.
+            input_range_volts (float): The full scale (in volts).
+            bit_shift (int): The samples are the codes shifted left by this.
+        '''
+        half = float(1 << (bits_per_sample - 1)) - 0.5
+        return cls(bits_per_sample=bits_per_sample,
+                   bit_shift=bit_shift,
+                   code_zero=half,
+                   code_range=half,
+                   input_range_volts=input_range_volts)
+
+    @property
+    def dtype(self):
+        '''
+        The integer type of the samples.
+        '''
+        return np.uint8 if self.bits_per_sample + self.bit_shift <= 8 else np.uint16
+
+    @property
+    def volts_per_code(self):
+        '''
+        The size of one code (in volts).
+        '''
+        return self.input_range_volts / self.code_range
+
+    def to_volts(self, samples, dtype=np.float32):
+        '''
+        Converts samples to volts.
+
+        Args:
+            samples (np.ndarray): The integer samples.
+            dtype (type): The float type of the result.
+
+        Returns:
+            np.ndarray: The values in volts.
+        '''
+        volts = np.right_shift(samples, self.bit_shift).astype(dtype)
+        volts -= dtype(self.code_zero)
+        volts *= dtype(self.volts_per_code)
+        return volts
+
+    def to_samples(self, volts):
+        '''
+        Converts volts to samples, rounding to the closest code,
+        and clipping to the range.
+
+        Args:
+            volts (np.ndarray): The values in volts.
+
+        Returns:
+            np.ndarray: The integer samples.
+        '''
+        codes = np.rint(np.asarray(volts) / self.volts_per_code + self.code_zero)
+        codes = np.clip(codes, 0, (1 << self.bits_per_sample) - 1).astype(self.dtype)
+        return np.left_shift(codes, self.bit_shift)
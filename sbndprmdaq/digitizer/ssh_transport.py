@@ -0,0 +1,230 @@
+'''
+Contains a class that manages one SSH connection carrying both
+a local port forward and remote command execution
+'''
+import time
+import select
+import logging
+import threading
+import socketserver
+
+import paramiko
+
+from sbndprmdaq import ssh_client
+
+
+class _ForwardServer(socketserver.ThreadingTCPServer):
+    '''
+    Local TCP server whose connections are forwarded through the SSH transport.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, ssh_transport):
+        self.ssh_transport = ssh_transport
+        super().__init__(server_address, _ForwardHandler)
+
+
+class _ForwardHandler(socketserver.BaseRequestHandler):
+    '''
+    Forwards one local connection through a direct-tcpip channel.
+    '''
+
+    def handle(self):
+        ssh_transport = self.server.ssh_transport
+
+        try:
+            chan = ssh_transport.open_forward_channel(self.request.getpeername())
+        except (paramiko.SSHException, OSError) as err:
+            ssh_transport.logger.warning(f'Cannot open forward channel: {err}')
+            return
+
+        try:
+            while True:
+                ready, _, _ = select.select([self.request, chan], [], [], 1)
+                if not ready and (chan.closed or not ssh_transport.is_active()):
+                    break
+                if self.request in ready:
+                    data = self.request.recv(16384)
+                    if not data:
+                        break
+                    chan.sendall(data)
+                if chan in ready:
+                    data = chan.recv(16384)
+                    if not data:
+                        break
+                    self.request.sendall(data)
+        except OSError:
+            pass
+        finally:
+            chan.close()
+
+
+#pylint: disable=too-many-instance-attributes
+class SSHTransport:
+    '''
+    A single SSH connection to a remote host, used both to forward a local
+    port to a remote port and to execute commands. The connection is kept
+    alive and monitored, and is transparently re-established if it drops,
+    keeping the same local port.
+    '''
+
+    #pylint: disable=too-many-arguments
+    def __init__(self, host, username, password, remote_port,
+                 remote_host='127.0.0.1', keepalive=1, monitor_interval=0.2,
+                 on_reconnect=None):
+        '''
+        Contructor.
+
+        Args:
+            host (str): The remote host.
+            username (str): The SSH username.
+            password (str): The SSH password.
+            remote_port (int): The remote port to forward to.
+            remote_host (str): The host to forward to, as seen by the remote host.
+            keepalive (int): Interval (in seconds) between SSH keepalives.
+            monitor_interval (float): Interval (in seconds) between health checks.
+            on_reconnect (function): Called after the connection is re-established.
+        '''
+        self.logger = logging.getLogger(__name__)
+
+        self._host = host
+        self._username = username
+        self._password = password
+        self._remote = (remote_host, remote_port)
+        self._keepalive = keepalive
+        self._monitor_interval = monitor_interval
+        self._on_reconnect = on_reconnect
+
+        self._client = None
+        self._lock = threading.RLock()
+        self._forward_server = None
+        self._monitor = None
+        self._stop = threading.Event()
+
+        self._n_reconnections = 0
+        self._last_reconnection_time = None
+
+    def start(self):
+        '''
+        Connects, starts the local port forward and the health monitor.
+        '''
+        self._stop.clear()
+        self._connect()
+
+        self._forward_server = _ForwardServer(('127.0.0.1', 0), self)
+        threading.Thread(target=self._forward_server.serve_forever, daemon=True).start()
+
+        self._monitor = threading.Thread(target=self._monitor_connection, daemon=True)
+        self._monitor.start()
+
+    def stop(self):
+        '''
+        Stops the health monitor, the port forward and the connection.
+        '''
+        self._stop.set()
+
+        if self._forward_server is not None:
+            self._forward_server.shutdown()
+            self._forward_server.server_close()
+            self._forward_server = None
+
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    @property
+    def local_bind_port(self):
+        '''
+        The local port forwarded to the remote port.
+        '''
+        return self._forward_server.server_address[1]
+
+    def _connect(self):
+        '''
+        Opens the SSH connection and enables keepalives.
+        '''
+        self._client = ssh_client.connect(self._host, self._keepalive,
+                                          username=self._username,
+                                          password=self._password,
+                                          timeout=5)
+
+    def is_active(self):
+        '''
+        Returns True if the SSH connection is up.
+        '''
+        return ssh_client.is_active(self._client)
+
+    def ensure_connected(self):
+        '''
+        Re-establishes the SSH connection if it is down.
+
+        Returns:
+            bool: True if the connection had to be re-established.
+        '''
+        with self._lock:
+            if self.is_active():
+                return False
+
+            self.logger.warning(f'SSH connection to {self._host} is down. Reconnecting...')
+            start = time.monotonic()
+
+            if self._client is not None:
+                self._client.close()
+            self._connect()
+
+            self._n_reconnections += 1
+            self._last_reconnection_time = time.monotonic() - start
+            self.logger.info(f'SSH connection to {self._host} re-established '
+                             f'in {self._last_reconnection_time:.3f} s.')
+
+        return True
+
+    def get_n_reconnections(self):
+        '''
+        Returns the number of times the connection was re-established.
+        '''
+        return self._n_reconnections
+
+    def open_forward_channel(self, src_addr):
+        '''
+        Opens a channel to the forwarded remote port.
+
+        Args:
+            src_addr (tuple): The address of the local connection.
+
+        Returns:
+            paramiko.Channel: The channel.
+        '''
+        self.ensure_connected()
+        return self._client.get_transport().open_channel('direct-tcpip', self._remote, src_addr, timeout=5)
+
+    def exec_command(self, command):
+        '''
+        Executes a command on the remote host.
+
+        Args:
+            command (str): The command.
+
+        Returns:
+            tuple: stdin, stdout and stderr of the command.
+        '''
+        self.ensure_connected()
+        return self._client.exec_command(command)
+
+    #pylint: disable=broad-exception-caught
+    def _monitor_connection(self):
+        '''
+        Checks the connection periodically and reconnects if needed.
+        '''
+        wait = self._monitor_interval
+        while not self._stop.wait(wait):
+            try:
+                if self.ensure_connected() and self._on_reconnect is not None:
+                    self._on_reconnect()
+                wait = self._monitor_interval
+            except Exception as err:
+                self.logger.error(f'Cannot reconnect to {self._host}: {err}')
+                # Back off while the host is unreachable
+                wait = min(wait * 2, 5)
@@ -0,0 +1,239 @@
+'''
+Contains a class accumulating running statistics of waveforms
+'''
+import time
+import threading
+
+import numpy as np
+
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+
+
+#pylint: disable=too-many-instance-attributes
+class WaveformAccumulator:
+    '''
+    Accumulates the per-sample mean and variance of waveforms, one batch of
+    records at a time (Welford's algorithm, in the pairwise form of Chan et al.,
+    vectorized over the records of a batch). Optionally, it also keeps a
+    bounded reservoir of raw records, uniformly sampled among all the records
+    seen. The memory used does not depend on the number of records added.
+    '''
+
+    def __init__(self, reservoir_size=0, channel_map=None, seed=None):
+        '''
+        Contructor.
+
+        Args:
+            reservoir_size (int): The max number of raw records kept per channel.
+            channel_map (dict): Renames the channels of the added batches.
+            seed (int): Seed for the reservoir sampling.
+        '''
+        self._reservoir_size = reservoir_size
+        self._channel_map = channel_map if channel_map is not None else {}
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+        self.channels = ()
+        self.samples_per_second = None
+        self.trigger_sample = None
+
+        self._count = 0
+        self._mean = None # (channel, sample)
+        self._m2 = None   # (channel, sample), sum of squared differences from the mean
+
+        self._reservoir = None # (channel, record, sample)
+        self._reservoir_timestamps = np.empty(0)
+        self._n_reservoir = 0
+
+        # Time (in seconds) spent adding records
+        self.processing_time = 0.
+
+    @property
+    def count(self):
+        '''
+        The number of records accumulated.
+        '''
+        return self._count
+
+    def add(self, batch):
+        '''
+        Adds the records of a batch.
+
+        Args:
+            batch (WaveformBatch): The records.
+        '''
+        if not batch.n_records:
+            return
+
+        start = time.monotonic()
+
+        waveforms = batch.waveforms
+        mean = waveforms.mean(axis=1)
+        m2 = ((waveforms - mean[:, np.newaxis, :])**2).sum(axis=1)
+
+        with self._lock:
+            self._setup(batch.channels, batch.n_samples, batch.samples_per_second, batch.trigger_sample)
+            self._merge(batch.n_records, mean, m2)
+            self._sample(waveforms, batch.timestamps)
+            self.processing_time += time.monotonic() - start
+
+    #pylint: disable=too-many-arguments
+    def add_stats(self, channels, count, mean, variance,
+                  samples_per_second=None, trigger_sample=None, records=None):
+        '''
+        Adds statistics of records computed elsewhere (eg. on the digitizer).
+
+        Args:
+            channels (list): The channel names.
+            count (int): The number of records.
+            mean (np.ndarray): The (channel, sample) mean of the records.
+            variance (np.ndarray): The (channel, sample) variance (ddof=0) of the records.
+            samples_per_second (float): The sampling rate.
+            trigger_sample (int): The sample where the trigger happens.
+            records (WaveformBatch): Some of the raw records, offered to the reservoir.
+        '''
+        if not count:
+            return
+
+        start = time.monotonic()
+
+        mean = np.asarray(mean, dtype=float)
+        m2 = np.asarray(variance, dtype=float) * count
+
+        with self._lock:
+            self._setup(channels, mean.shape[1], samples_per_second, trigger_sample)
+            self._merge(count, mean, m2)
+            if records is not None and records.n_records:
+                self._sample(records.waveforms, records.timestamps)
+            self.processing_time += time.monotonic() - start
+
+    def _setup(self, channels, n_samples, samples_per_second, trigger_sample):
+        '''
+        Allocates the arrays when the first records are added.
+        '''
+        channels = tuple(self._channel_map.get(ch, ch) for ch in channels)
+
+        if self._mean is not None:
+            if channels != self.channels:
+                raise ValueError(f'Cannot add channels {channels} to {self.channels}.')
+            return
+
+        self.channels = channels
+        self.samples_per_second = samples_per_second
+        self.trigger_sample = trigger_sample
+
+        self._mean = np.zeros((len(channels), n_samples))
+        self._m2 = np.zeros((len(channels), n_samples))
+        self._reservoir = np.empty((len(channels), self._reservoir_size, n_samples))
+        self._reservoir_timestamps = np.empty(self._reservoir_size)
+
+    def _merge(self, count, mean, m2):
+        '''
+        Merges the statistics of count records into the running ones.
+        '''
+        total = self._count + count
+        delta = mean - self._mean
+        self._mean += delta * (count / total)
+        self._m2 += m2 + delta**2 * (self._count * count / total)
+        self._count = total
+
+    def _sample(self, waveforms, timestamps):
+        '''
+        Offers records to the reservoir (Vitter's algorithm R).
+        '''
+        for record in range(waveforms.shape[1]):
+            if self._n_reservoir < self._reservoir_size:
+                slot = self._n_reservoir
+            else:
+                slot = self._rng.integers(0, self._n_reservoir + 1)
+            self._n_reservoir += 1
+
+            if slot < self._reservoir_size:
+                self._reservoir[:, slot] = waveforms[:, record]
+                self._reservoir_timestamps[slot] = timestamps[record]
+
+    def keys(self):
+        '''
+        Returns the channel names.
+        '''
+        return self.channels
+
+    def __contains__(self, channel):
+        return channel in self.channels
+
+    def _index(self, channel):
+        try:
+            return self.channels.index(channel)
+        except ValueError as err:
+            raise KeyError(channel) from err
+
+    def mean(self, channel):
+        '''
+        Returns the mean waveform of a channel.
+        '''
+        return self._mean[self._index(channel)]
+
+    def variance(self, channel, ddof=0):
+        '''
+        Returns the per-sample variance of the waveforms of a channel.
+
+        Args:
+            channel (str): The channel.
+            ddof (int): Delta degrees of freedom (1 for the sample variance).
+        '''
+        if self._count <= ddof:
+            return np.full_like(self.mean(channel), np.nan)
+        return self._m2[self._index(channel)] / (self._count - ddof)
+
+    def std_error(self, channel):
+        '''
+        Returns the per-sample standard error on the mean waveform of a channel.
+        '''
+        return np.sqrt(self.variance(channel, ddof=1) / self._count)
+
+    def reservoir(self):
+        '''
+        Returns the raw records kept in the reservoir.
+
+        Returns:
+            WaveformBatch: The records.
+        '''
+        if self._mean is None:
+            return WaveformBatch.empty()
+
+        n_records = min(self._n_reservoir, self._reservoir_size)
+        return WaveformBatch(self._reservoir[:, :n_records],
+                             self.channels,
+                             self.samples_per_second,
+                             self.trigger_sample,
+                             self._reservoir_timestamps[:n_records])
+
+    def select(self, channels, names=None):
+        '''
+        Returns an accumulator with a subset of the channels.
+
+        Args:
+            channels (list): The channels to select.
+            names (list): The names of the channels in the new accumulator
+                          (defaults to the same names).
+        '''
+        indices = [self._index(ch) for ch in channels]
+
+        selected = WaveformAccumulator(self._reservoir_size)
+        selected.channels = tuple(channels if names is None else names)
+        selected.samples_per_second = self.samples_per_second
+        selected.trigger_sample = self.trigger_sample
+
+        #pylint: disable=protected-access
+        selected._count = self._count
+        selected._mean = self._mean[indices]
+        selected._m2 = self._m2[indices]
+        selected._reservoir = self._reservoir[indices]
+        selected._reservoir_timestamps = self._reservoir_timestamps
+        selected._n_reservoir = self._n_reservoir
+
+        return selected
+
+    def __repr__(self):
+        return (f'WaveformAccumulator(channels={self.channels}, count={self._count}, '
+                f'reservoir={min(self._n_reservoir, self._reservoir_size)})')
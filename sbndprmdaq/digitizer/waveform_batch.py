@@ -0,0 +1,190 @@
+'''
+Contains the class holding a batch of waveforms acquired by a digitizer
+'''
+import time
+
+import numpy as np
+
+
+class WaveformBatch:
+    '''
+    A batch of waveforms, stored in one contiguous (channel, record, sample)
+    array. Channels are accessed by name (e.g. batch['A']), which returns
+    a (record, sample) view of the array, without copies.
+    '''
+
+    __slots__ = ('waveforms', 'channels', 'samples_per_second', 'trigger_sample', 'timestamps')
+
+    #pylint: disable=too-many-arguments
+    def __init__(self, waveforms, channels, samples_per_second, trigger_sample, timestamps=None):
+        '''
+        Contructor.
+
+        Args:
+            waveforms (np.ndarray): The (channel, record, sample) array, in volts.
+            channels (tuple): The channel names, one per entry of the first axis.
+            samples_per_second (float): The sampling rate.
+            trigger_sample (int): The sample where the trigger happens.
+            timestamps (np.ndarray): The time (seconds since the epoch) of every record.
+        '''
+        waveforms = np.asarray(waveforms)
+        if waveforms.ndim != 3:
+            raise ValueError(f'Expected a (channel, record, sample) array, got shape {waveforms.shape}.')
+        if waveforms.shape[0] != len(channels):
+            raise ValueError(f'Got {len(channels)} channel names for {waveforms.shape[0]} channels.')
+
+        if timestamps is None:
+            timestamps = np.full(waveforms.shape[1], time.time())
+
+        self.waveforms = waveforms
+        self.channels = tuple(channels)
+        self.samples_per_second = samples_per_second
+        self.trigger_sample = trigger_sample
+        self.timestamps = np.asarray(timestamps, dtype=float)
+
+    @classmethod
+    def from_dict(cls, data, samples_per_second, trigger_sample, timestamp=None):
+        '''
+        Makes a batch from a dictionary of records keyed by channel, as sent
+        by the digitizer APIs. Channels with no records are dropped.
+
+        Args:
+            data (dict): The records (lists of lists) keyed by channel.
+            samples_per_second (float): The sampling rate.
+            trigger_sample (int): The sample where the trigger happens.
+            timestamp (float): The time of the records (defaults to now).
+
+        Returns:
+            WaveformBatch: The batch.
+        '''
+        channels = [ch for ch, records in data.items() if len(records)]
+
+        if not channels:
+            return cls.empty(samples_per_second, trigger_sample)
+
+        waveforms = np.array([data[ch] for ch in channels], dtype=float)
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        return cls(waveforms, channels, samples_per_second, trigger_sample,
+                   np.full(waveforms.shape[1], timestamp))
+
+    @classmethod
+    def empty(cls, samples_per_second=None, trigger_sample=None, channels=(), n_samples=0):
+        '''
+        Makes a batch with no records.
+        '''
+        return cls(np.empty((len(channels), 0, n_samples)), channels,
+                   samples_per_second, trigger_sample, np.empty(0))
+
+    @classmethod
+    def concatenate(cls, batches):
+        '''
+        Concatenates the records of batches with the same channels.
+
+        Args:
+            batches (list): The batches.
+
+        Returns:
+            WaveformBatch: The concatenated batch.
+        '''
+        batches = [batch for batch in batches if batch.n_records]
+
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+
+        first = batches[0]
+        for batch in batches[1:]:
+            if batch.channels != first.channels:
+                raise ValueError(f'Cannot concatenate channels {batch.channels} to {first.channels}.')
+
+        return cls(np.concatenate([batch.waveforms for batch in batches], axis=1),
+                   first.channels,
+                   first.samples_per_second,
+                   first.trigger_sample,
+                   np.concatenate([batch.timestamps for batch in batches]))
+
+    @property
+    def n_records(self):
+        '''
+        The number of records per channel.
+        '''
+        return self.waveforms.shape[1]
+
+    @property
+    def n_samples(self):
+        '''
+        The number of samples per record.
+        '''
+        return self.waveforms.shape[2]
+
+    def keys(self):
+        '''
+        Returns the channel names.
+        '''
+        return self.channels
+
+    def __contains__(self, channel):
+        return channel in self.channels
+
+    def __getitem__(self, channel):
+        '''
+        Returns the (record, sample) view of a channel.
+        '''
+        return self.waveforms[self._index(channel)]
+
+    def _index(self, channel):
+        try:
+            return self.channels.index(channel)
+        except ValueError as err:
+            raise KeyError(channel) from err
+
+    def __len__(self):
+        return len(self.channels)
+
+    def mean(self, channel):
+        '''
+        Returns the average waveform of a channel.
+        '''
+        return self[channel].mean(axis=0)
+
+    def rename(self, channel_map):
+        '''
+        Returns a batch sharing the same array, with channels renamed
+        according to channel_map (channels not in it keep their name).
+        '''
+        return WaveformBatch(self.waveforms,
+                             [channel_map.get(ch, ch) for ch in self.channels],
+                             self.samples_per_second,
+                             self.trigger_sample,
+                             self.timestamps)
+
+    def select(self, channels, names=None):
+        '''
+        Returns a batch with a subset of the channels. If the channels are
+        adjacent in the array the new batch is a view, otherwise a copy.
+
+        Args:
+            channels (list): The channels to select.
+            names (list): The names of the channels in the new batch
+                          (defaults to the same names).
+        '''
+        indices = [self._index(ch) for ch in channels]
+
+        if indices == list(range(indices[0], indices[0] + len(indices))):
+            waveforms = self.waveforms[indices[0]:indices[0] + len(indices)]
+        else:
+            waveforms = self.waveforms[indices]
+
+        return WaveformBatch(waveforms,
+                             channels if names is None else names,
+                             self.samples_per_second,
+                             self.trigger_sample,
+                             self.timestamps)
+
+    def __repr__(self):
+        return (f'WaveformBatch(channels={self.channels}, n_records={self.n_records}, '
+                f'n_samples={self.n_samples})')
@@ -0,0 +1,127 @@
+'''
+Contains the classes to stop the acquisitions once the lifetime is precise enough
+'''
+import logging
+
+import numpy as np
+
+from sbndprmdaq.cadence import relative_lifetime_error
+
+
+def _charge(waveform, error2, signal_range, baseline_range, sign):
+    '''
+    Returns the peak height above the baseline, and its error.
+    '''
+    baseline = waveform[baseline_range[0]:baseline_range[1]]
+    baseline_error2 = np.mean(error2[baseline_range[0]:baseline_range[1]]) / len(baseline)
+
+    signal = sign * waveform[signal_range[0]:signal_range[1]]
+    peak = np.argmax(signal)
+
+    charge = signal[peak] - sign * np.mean(baseline)
+    return charge, np.sqrt(error2[signal_range[0] + peak] + baseline_error2)
+
+
+def quick_lifetime_estimate(data_hv_on, data_hv_off, channels, config):
+    '''
+    Estimates Qa and Qc from the mean waveforms, as the peak heights above
+    the baselines, and the relative error on the lifetime they give. It is
+    much cheaper than the analysis, and it is only used to decide when
+    enough records have been taken.
+
+    Args:
+        data_hv_on (WaveformAccumulator): The HV on records.
+        data_hv_off (WaveformAccumulator): The HV off records, subtracted (or None).
+        channels (list): The cathode and anode channels.
+        config (dict): The analysis configuration of the PrM (signal and baseline ranges).
+
+    Returns:
+        dict: qa, qc, qa_err, qc_err (in volts) and tau_rel_err, or None
+              if there are not enough records.
+    '''
+    if data_hv_on is None or data_hv_on.count < 2:
+        return None
+
+    waveforms, errors2 = [], []
+    for channel in channels:
+        waveform = data_hv_on.mean(channel).copy()
+        error2 = data_hv_on.std_error(channel)**2
+        if data_hv_off is not None and channel in data_hv_off and data_hv_off.count >= 2:
+            waveform -= data_hv_off.mean(channel)
+            error2 += data_hv_off.std_error(channel)**2
+        waveforms.append(waveform)
+        errors2.append(error2)
+
+    qc, qc_err = _charge(waveforms[0], errors2[0],
+                         config.get('signal_range_c', [310, 500]),
+                         config.get('baseline_range_c', [0, 450]), sign=-1)
+    qa, qa_err = _charge(waveforms[1], errors2[1],
+                         config.get('signal_range_a', [600, 1000]),
+                         config.get('baseline_range_a', [2000, 2400]), sign=1)
+
+    return {
+        'qa': float(qa),
+        'qc': float(qc),
+        'qa_err': float(qa_err),
+        'qc_err': float(qc_err),
+        'tau_rel_err': relative_lifetime_error(qa, qc, qa_err, qc_err),
+    }
+
+
+class EarlyStopping:
+    '''
+    Decides when to stop taking records with the HV on: once the lifetime
+    of every PrM measured is estimated with the target relative precision,
+    or when the max number of repetitions or the max time is reached.
+    Small signals get more records, large ones stop early, which saves
+    lamp flashes and HV on time.
+    '''
+
+    def __init__(self, config=None):
+        '''
+        Contructor.
+
+        Args:
+            config (dict): The early_stopping configuration section.
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        config = config if config is not None else {}
+
+        self.enabled = config.get('enabled', False)
+        self._target_precision = config.get('target_precision', 0.05)
+        self._min_repetitions = config.get('min_repetitions', 1)
+        self._max_repetitions = config.get('max_repetitions', 10)
+        self._max_time = config.get('max_time', 300)
+
+    @property
+    def max_repetitions(self):
+        '''
+        The max number of repetitions.
+        '''
+        return self._max_repetitions
+
+    def check(self, n_repetitions, elapsed, estimates):
+        '''
+        Tells if the acquisition can stop.
+
+        Args:
+            n_repetitions (int): The number of repetitions taken.
+            elapsed (float): The time (in seconds) since the first repetition started.
+            estimates (dict): The quick_lifetime_estimate of every PrM (can be None).
+
+        Returns:
+            bool: True if the acquisition can stop.
+            str: The reason, or None.
+        '''
+        precise = all(estimate is not None and estimate['tau_rel_err'] is not None
+                      and estimate['tau_rel_err'] <= self._target_precision
+                      for estimate in estimates.values())
+
+        if precise and n_repetitions >= self._min_repetitions:
+            return True, 'precision reached'
+        if n_repetitions >= self._max_repetitions:
+            return True, 'max repetitions'
+        if elapsed >= self._max_time:
+            return True, 'max time'
+        return False, None
@@ -106,16 +106,21 @@ class HVControlBase(ABC):
         self._logger.info(f'Waiting for HV to stabilize for PrM {prm_id}...')
         status = 0
 
-        for item in ['cathode', 'anodegrid', 'anode']:
-            measurements = []
-            for _ in range(n_measurements):
-                hv = self.get_hv_sense_value(item, 'voltage', prm_id)
-                measurements.append(hv)
-                time.sleep(0.2)
+        items = ['cathode', 'anodegrid', 'anode']
+
+        # Sample all the items in the same loop, so that the check takes
+        # n_measurements * 0.2 seconds regardless of the number of items
+        measurements = {item: [] for item in items}
+        for _ in range(n_measurements):
+            for item in items:
+                measurements[item].append(self.get_hv_sense_value(item, 'voltage', prm_id))
+            time.sleep(0.2)
+
+        for item in items:
 
-            # print('prm_id, ', prm_id, 'item', item, 'RMS: ', np.std(measurements))
+            # print('prm_id, ', prm_id, 'item', item, 'RMS: ', np.std(measurements[item]))
 
-            if np.std(measurements) < 0.5:
+            if np.std(measurements[item]) < 0.5:
                 status = status + 1
 
         if status == 3:
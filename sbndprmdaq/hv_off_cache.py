@@ -0,0 +1,161 @@
+'''
+Contains a class keeping the HV off reference waveforms between runs
+'''
+import time
+import logging
+import threading
+
+import numpy as np
+
+
+#pylint: disable=too-few-public-methods
+class _Reference:
+    '''
+    A cached HV off reference.
+    '''
+
+    def __init__(self, data):
+        self.data = data
+        self.created = time.monotonic()
+        self.uses = 0
+
+    def age(self):
+        '''
+        Returns the time (in seconds) since the reference was taken.
+        '''
+        return time.monotonic() - self.created
+
+
+class HVOffReferenceCache:
+    '''
+    Keeps the HV off waveforms (the lamp pickup, subtracted in the
+    analysis) of every PrM and digitizer configuration, so that most runs
+    only need the HV on acquisition. A reference is refreshed when it is
+    older than max_age, after it was used max_uses times, when the digitizer
+    configuration changes, or when the baseline before the trigger drifts
+    away from the one of the reference. The drift is checked before a run
+    uses the reference, on a short HV off capture of check_records records.
+    '''
+
+    def __init__(self, config=None):
+        '''
+        Contructor.
+
+        Args:
+            config (dict): The hv_off_cache configuration section.
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        config = config if config is not None else {}
+
+        self._enabled = config.get('enabled', False)
+        self._max_age = config.get('max_age', 3600)
+        self._max_uses = config.get('max_uses', 10)
+        self._max_baseline_drift = config.get('max_baseline_drift', 2e-3)
+        self.check_records = config.get('check_records', 2)
+
+        self._references = {} # (prm_id, digitizer_config) -> _Reference
+        self._lock = threading.Lock()
+
+    def get(self, prm_id, digitizer_config):
+        '''
+        Returns the reference of a PrM, if it can be used for another run.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            digitizer_config (DigitizerConfig): The digitizer configuration of the run.
+
+        Returns:
+            WaveformAccumulator: The HV off data, or None if a new one has to be taken.
+            dict: The age (in seconds) and number of uses of the reference, if any.
+        '''
+        if not self._enabled:
+            return None, None
+
+        with self._lock:
+            reference = self._references.get((prm_id, digitizer_config))
+
+            reason = None
+            if reference is None:
+                reason = 'no reference for this digitizer configuration'
+            elif reference.age() > self._max_age:
+                reason = f'reference is {reference.age():.0f} s old'
+            elif reference.uses >= self._max_uses:
+                reason = f'reference used {reference.uses} times'
+
+            if reason is not None:
+                self._references.pop((prm_id, digitizer_config), None)
+                self._logger.info(f'Taking a new HV off reference for PrM {prm_id}: {reason}.')
+                return None, None
+
+            reference.uses += 1
+            info = {'age': reference.age(), 'uses': reference.uses}
+
+        self._logger.info(f'Using the HV off reference of PrM {prm_id} '
+                          f'({info["age"]:.0f} s old, use {info["uses"]}/{self._max_uses}).')
+        return reference.data, info
+
+    def store(self, prm_id, digitizer_config, data):
+        '''
+        Stores a new reference.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            digitizer_config (DigitizerConfig): The digitizer configuration of the run.
+            data (WaveformAccumulator): The HV off data.
+        '''
+        if not self._enabled or data is None or not data.count:
+            return
+
+        with self._lock:
+            self._references[(prm_id, digitizer_config)] = _Reference(data)
+
+    def check_drift(self, prm_id, digitizer_config, reference, data):
+        '''
+        Compares the baseline before the trigger of new data with the
+        one of the reference, and drops the reference if it drifted.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            digitizer_config (DigitizerConfig): The digitizer configuration of the run.
+            reference (WaveformAccumulator): The HV off reference.
+            data (WaveformAccumulator): The new data (eg. the check capture).
+
+        Returns:
+            float: The largest baseline difference among the channels (in volts),
+                   None if there is no data to compare (the reference is then dropped).
+        '''
+        if data is None or not data.count:
+            self.invalidate(prm_id, digitizer_config)
+            return None
+
+        n_samples = reference.trigger_sample or len(reference.mean(reference.channels[0])) // 10
+        drift = max(abs(np.mean(data.mean(ch)[:n_samples]) - np.mean(reference.mean(ch)[:n_samples]))
+                    for ch in reference.channels if ch in data)
+
+        if drift > self._max_baseline_drift:
+            self._logger.info(f'Baseline of PrM {prm_id} drifted by {drift * 1e3:.2f} mV '
+                              'from the HV off reference, it is taken again.')
+            self.invalidate(prm_id, digitizer_config)
+
+        return float(drift)
+
+    def drifted(self, drift):
+        '''
+        Returns True if a drift returned by check_drift means
+        that the reference cannot be used.
+        '''
+        return drift is None or drift > self._max_baseline_drift
+
+    def invalidate(self, prm_id, digitizer_config=None):
+        '''
+        Drops the references of a PrM.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            digitizer_config (DigitizerConfig): Only the reference for this configuration.
+        '''
+        with self._lock:
+            for key in list(self._references):
+                if key[0] == prm_id and digitizer_config in (None, key[1]):
+                    del self._references[key]
@@ -0,0 +1,293 @@
+'''
+Contains the class keeping a valid Kerberos ticket for the uploads
+'''
+import os
+import time
+import struct
+import logging
+import threading
+import subprocess
+
+from sbndprmdaq.timing import TimingStatistics
+
+
+class _Reader:
+    '''
+    Reads the big-endian fields of a credential cache file.
+    '''
+
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+
+    def unpack(self, fmt):
+        '''
+        Reads the fields of a struct format.
+        '''
+        values = struct.unpack_from('>' + fmt, self._data, self._offset)
+        self._offset += struct.calcsize('>' + fmt)
+        return values
+
+    def octets(self):
+        '''
+        Reads a counted octet string.
+        '''
+        length, = self.unpack('I')
+        value = self._data[self._offset:self._offset + length]
+        if len(value) != length:
+            raise ValueError('truncated credential cache')
+        self._offset += length
+        return value
+
+    def principal(self):
+        '''
+        Reads a principal, returns it as a string.
+        '''
+        _, n_components = self.unpack('II')
+        realm = self.octets().decode()
+        components = [self.octets().decode() for _ in range(n_components)]
+        return '/'.join(components) + '@' + realm
+
+    def at_end(self):
+        '''
+        True once everything is read.
+        '''
+        return self._offset >= len(self._data)
+
+
+def read_ccache(file_name):
+    '''
+    Reads the tickets in an MIT Kerberos credential cache file
+    (FILE: type, format version 3 or 4), without calling klist.
+
+    Args:
+        file_name (str): The credential cache file.
+
+    Returns:
+        str: The default principal.
+        list: One dict per ticket, with the server principal and the
+              start, end and renew_till times (unix time).
+    '''
+    with open(file_name, 'rb') as file:
+        reader = _Reader(file.read())
+
+    version, = reader.unpack('H')
+    if version not in (0x0503, 0x0504):
+        raise ValueError(f'unsupported credential cache version {version:#06x}')
+
+    if version == 0x0504:
+        header_length, = reader.unpack('H')
+        reader.unpack(f'{header_length}s')
+
+    principal = reader.principal()
+
+    tickets = []
+    while not reader.at_end():
+        reader.principal() # client
+        server = reader.principal()
+        reader.unpack('H') # key type
+        if version == 0x0503:
+            reader.unpack('H')
+        reader.octets() # key
+        _, start_time, end_time, renew_till = reader.unpack('IIII')
+        reader.unpack('BI') # is_skey, flags
+        for _ in range(reader.unpack('I')[0]): # addresses
+            reader.unpack('H')
+            reader.octets()
+        for _ in range(reader.unpack('I')[0]): # authorization data
+            reader.unpack('H')
+            reader.octets()
+        reader.octets() # ticket
+        reader.octets() # second ticket
+
+        # Skip the configuration entries kept by the Kerberos library
+        if server.startswith('X-CACHECONF:'):
+            continue
+
+        tickets.append({
+            'server': server,
+            'start_time': start_time,
+            'end_time': end_time,
+            'renew_till': renew_till,
+        })
+
+    return principal, tickets
+
+
+#pylint: disable=too-many-instance-attributes
+class KerberosCredentialManager:
+    '''
+    Keeps a valid Kerberos ticket in a credential cache, for the GSSAPI
+    authentication of the uploads. The expiry of the ticket is read from
+    the credential cache, and a background thread gets a new ticket from
+    the keytab before it expires, so the uploads do not wait for kinit.
+    '''
+
+    def __init__(self, config=None):
+        '''
+        Contructor.
+
+        Args:
+            config (dict): The kerberos configuration section.
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        config = config if config is not None else {}
+
+        self._ccache = config.get('ccache', '/tmp/krb5cc_sbndprm')
+        self._keytab = config.get('keytab', '/var/kerberos/krb5/user/25081/client.keytab')
+        self._principal = config.get('principal', 'sbndprm/sbnd-prm01.fnal.gov@FNAL.GOV')
+        self._renew_before = config.get('renew_before', 3600)
+        self._check_interval = config.get('check_interval', 300)
+        self._timeout = config.get('timeout', 10)
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._end_time = None
+        self._renewals = 0
+        self._failures = 0
+        self._last_error = None
+        self._latency = TimingStatistics(config.get('history_size', 50))
+
+    @property
+    def ccache(self):
+        '''
+        The credential cache, as set in KRB5CCNAME.
+        '''
+        return 'FILE:' + self._ccache
+
+    def start(self):
+        '''
+        Gets a ticket if needed, and starts the background renewal.
+        '''
+        if self._thread is not None:
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._renew_loop, name='kerberos', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the background renewal.
+        '''
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._timeout + 1)
+            self._thread = None
+
+    def remaining_time(self):
+        '''
+        Returns the time (in seconds) before the ticket expires,
+        0 if there is no valid ticket.
+        '''
+        try:
+            principal, tickets = read_ccache(self._ccache)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            self._end_time = None
+            return 0
+
+        realm = principal.rsplit('@', 1)[-1]
+        end_times = [ticket['end_time'] for ticket in tickets
+                     if ticket['server'] == f'krbtgt/{realm}@{realm}']
+
+        self._end_time = min(end_times) if end_times and principal == self._principal else None
+        return max(self._end_time - time.time(), 0) if self._end_time is not None else 0
+
+    def ensure_valid(self):
+        '''
+        Makes sure there is a valid ticket, getting a new one if needed,
+        and points KRB5CCNAME to it. This is what the uploader calls
+        before connecting, and it only waits for kinit if the background
+        renewal could not keep a ticket.
+
+        Returns:
+            str: The credential cache (the KRB5CCNAME value).
+        '''
+        start = time.monotonic()
+
+        os.environ['KRB5CCNAME'] = self.ccache
+
+        with self._lock:
+            if self.remaining_time() <= 0:
+                self._logger.info('No valid Kerberos ticket, getting one.')
+                self._kinit()
+
+        self._latency.add('auth', {'ensure_valid': time.monotonic() - start})
+        return self.ccache
+
+    def renew(self):
+        '''
+        Gets a new ticket from the keytab.
+
+        Returns:
+            bool: True if a ticket was obtained.
+        '''
+        with self._lock:
+            return self._kinit()
+
+    def statistics(self):
+        '''
+        Returns the state of the credentials.
+
+        Returns:
+            dict: end_time (unix time) and remaining time (in seconds) of
+                  the ticket, renewals, failures, last_error, and the
+                  percentiles of the kinit and ensure_valid durations (see
+                  TimingStatistics.percentiles).
+        '''
+        remaining = self.remaining_time()
+        return {
+            'end_time': self._end_time,
+            'remaining': remaining,
+            'renewals': self._renewals,
+            'failures': self._failures,
+            'last_error': self._last_error,
+            'latency': self._latency.percentiles('auth'),
+        }
+
+    def _renew_loop(self):
+        '''
+        Renews the ticket before it expires, until stopped.
+        '''
+        while not self._stop_event.is_set():
+            with self._lock:
+                remaining = self.remaining_time()
+                if remaining < self._renew_before:
+                    self._logger.info(f'Kerberos ticket expires in {remaining:.0f} s, renewing it.')
+                    self._kinit()
+
+            self._stop_event.wait(self._check_interval)
+
+    def _kinit(self):
+        '''
+        Runs kinit with the keytab. Must be called with the lock held.
+        '''
+        start = time.monotonic()
+        env = dict(os.environ, KRB5CCNAME=self.ccache)
+        cmd = ['kinit', '-kt', self._keytab, self._principal]
+
+        try:
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True,
+                                  timeout=self._timeout, check=False)
+            error = proc.stderr.strip() if proc.returncode else None
+        except subprocess.TimeoutExpired:
+            error = f'timeout after {self._timeout} s'
+        except OSError as err:
+            error = str(err)
+
+        duration = time.monotonic() - start
+        self._latency.add('auth', {'kinit': duration})
+
+        if error is not None:
+            self._failures += 1
+            self._last_error = error
+            self._logger.error(f'kinit failed: {error}')
+            return False
+
+        self._renewals += 1
+        self._logger.info(f'Kerberos ticket obtained in {duration:.2f} s, '
+                          f'valid for {self.remaining_time() / 3600:.1f} h.')
+        return True
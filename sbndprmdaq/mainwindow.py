@@ -14,6 +14,7 @@ import pyqtgraph as pg
 from sbndprmdaq.prm_settings.settings import HVSettings
 from sbndprmdaq.prm_settings.settings import DigitizerSettings
 from sbndprmdaq.configuration_form import Form
+from sbndprmdaq.timing_window import TimingWindow
 from sbndprmdaq.externals import pmt_hv_on, IgnitionAPI
 
 ICON_RED_LED = os.path.join(os.path.dirname(
@@ -317,6 +318,10 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self._prm_manager = None
 
+        # Scheduled runs, always visible in the status bar
+        self._queue_label = QtWidgets.QLabel('No runs scheduled')
+        self._status_bar.addPermanentWidget(self._queue_label)
+
         self._status_timer = QTimer()
         self._status_timer.timeout.connect(self._check_status)
         self._status_timer.start(1000)
@@ -391,12 +396,14 @@ class MainWindow(QtWidgets.QMainWindow):
             self.setup_latest_data(latest_data)
 
         self._config_form = Form(self)
+        self._timing_window = TimingWindow(list(self._prm_controls), self)
 
         self.menuMenu.actions()[0].triggered.connect(self._logs.show)
         self.menuMenu.actions()[1].triggered.connect(self.show_comment)
         self.menuMenu.actions()[2].triggered.connect(self._config_form.show)
         self.menuMenu.actions()[3].triggered.connect(self._hv_settings.show)
         self.menuMenu.actions()[4].triggered.connect(self._digitizer_settings.show)
+        self.menuMenu.actions()[5].triggered.connect(self._show_timing)
 
         self._can_exit = True
 
@@ -438,6 +445,21 @@ class MainWindow(QtWidgets.QMainWindow):
         control._take_hvoff_run.clicked.connect(lambda: self._set_hvoff_run(prm_id=prm_id))
 
 
+    def set_interval(self, prm_id, interval):
+        '''
+        Shows the time interval used in automatic mode (eg. adapted
+        by the manager), without setting it again in the manager.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            interval (float): The time interval in seconds.
+        '''
+        spinbox = self._prm_controls[prm_id]._interval_spinbox
+        spinbox.blockSignals(True)
+        spinbox.setValue(round(interval / 60))
+        spinbox.blockSignals(False)
+
+
     def set_start_button_status(self, prm_id=1, status=True):
         '''
         Disables the start/stop button for a certain PrM
@@ -532,6 +554,11 @@ class MainWindow(QtWidgets.QMainWindow):
             prm_id (int): The purity monitor ID.
         '''
 
+        # A queued run is taken out of the queue
+        if self._prm_manager.is_queued(prm_id):
+            self._stop_prm(prm_id)
+            return
+
         self._prm_controls[prm_id]._running = not self._prm_controls[prm_id]._running
 
         if self._prm_controls[prm_id].is_running():
@@ -616,11 +643,50 @@ class MainWindow(QtWidgets.QMainWindow):
         self._prm_manager.take_hvoff_run(prm_id, control._take_hvoff_run.isChecked())
 
 
+    def _show_queue_state(self):
+        '''
+        Shows the scheduled runs, and when they are predicted to start.
+        '''
+        items = []
+        for item in self._prm_manager.get_queue_state():
+            if item['state'] == 'running':
+                items.append(f"PrM {item['prm_id']}: running")
+            else:
+                minutes, seconds = divmod(item['predicted_start'], 60)
+                items.append(f"PrM {item['prm_id']}: {item['state']}, starts in {minutes:.0f}:{seconds:02.0f}")
+
+        self._queue_label.setText(' | '.join(items) if items else 'No runs scheduled')
+
+
+    def _show_timing(self):
+        '''
+        Shows the timing window.
+        '''
+        self._update_timing()
+        self._timing_window.show()
+
+
+    def _update_timing(self):
+        '''
+        Shows the latest timing statistics in the timing window.
+        '''
+        if self._prm_manager is None:
+            return
+
+        for prm_id in self._prm_controls:
+            self._timing_window.set_statistics(prm_id, self._prm_manager.get_timing_statistics(prm_id))
+
+
     def _check_status(self):
         '''
         Callback that checks the status.
         '''
 
+        self._show_queue_state()
+
+        if self._timing_window.isVisible():
+            self._update_timing()
+
         for control in self._prm_controls.values():
 
             if not control.isEnabled():
@@ -652,7 +718,12 @@ class MainWindow(QtWidgets.QMainWindow):
                 control._digi_status_label.setStyleSheet("color: green;")
                 self.repaint()
 
-            if control._mode_toggle.isChecked():
+            queued = self._prm_manager.is_queued(control.get_id())
+            if queued:
+                # Waiting for another PrM to free the HV crate, digitizer or lamp
+                control._run_status_label.setText('Queued')
+
+            if control._mode_toggle.isChecked() or queued:
                 rem_time = self._prm_manager.remaining_time(control.get_id()) / 1e3 # seconds
                 minutes, seconds = divmod(rem_time, 60)
                 control._start_stop_btn.setText(f"{minutes:.0f}:{seconds:.0f}")
@@ -687,11 +758,13 @@ class MainWindow(QtWidgets.QMainWindow):
             #
             # Plot waveform from channel A
             #
-            if 'A' in data and data['A'] is not None and len(data['A']):
+            waveforms = data['hv_on']
+
+            if 'A' in waveforms and waveforms.count:
 
-                av_waveform = np.mean(data['A'], axis=0)
+                av_waveform = waveforms.mean('A')
 
-                x_a = np.arange(len(av_waveform)) / self._prm_manager.samples_per_sec() * s_to_us
+                x_a = np.arange(len(av_waveform)) / waveforms.samples_per_second * s_to_us
                 y_a = av_waveform * v_to_mv
 
                 if self._show_graph[control.get_id()] and not self._diff_checkbox.isChecked():
@@ -702,11 +775,11 @@ class MainWindow(QtWidgets.QMainWindow):
             #
             # Plot waveform from channel A
             #
-            if 'B' in data and data['B'] is not None and len(data['B']):
+            if 'B' in waveforms and waveforms.count:
 
-                av_waveform = np.mean(data['B'], axis=0)
+                av_waveform = waveforms.mean('B')
 
-                x_b = np.arange(len(av_waveform)) / self._prm_manager.samples_per_sec() * s_to_us
+                x_b = np.arange(len(av_waveform)) / waveforms.samples_per_second * s_to_us
                 y_b = av_waveform * v_to_mv
 
                 if self._show_graph[control.get_id()] and not self._diff_checkbox.isChecked():
@@ -5,19 +5,51 @@ import os
 import time
 import datetime
 import logging
+import sqlite3
+import threading
+import dataclasses
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 import numpy as np
 import epics
 
-from PyQt5.QtCore import QThreadPool, QTimer
+from PyQt5.QtCore import Qt, QThreadPool, QTimer
 
 from sbndprmdaq.data_storage import DataStorage
-from sbndprmdaq.analysis import PrMAnalysisEstimate, PrMAnalysisFitter, PrMAnalysisFitterDiff
+from sbndprmdaq.upload_service import UploadService
+from sbndprmdaq.kerberos import KerberosCredentialManager
+from sbndprmdaq.analysis import AnalysisPool
 from sbndprmdaq.summary_plot import SummaryPlot
 from sbndprmdaq.threading_utils import Worker
+from sbndprmdaq.timing import StageTimer, TimingStatistics
+from sbndprmdaq.post_processing import PostProcessor, PostProcessingJob
+from sbndprmdaq.scheduler import MeasurementScheduler, prm_resources
+from sbndprmdaq.cadence import AdaptiveCadence, relative_lifetime_error
+from sbndprmdaq.run_catalog import RunCatalog
+from sbndprmdaq.run_file import RunFileWriter
+from sbndprmdaq.run_bundler import RunBundler
+from sbndprmdaq.hv_off_cache import HVOffReferenceCache
+from sbndprmdaq.early_stopping import EarlyStopping, quick_lifetime_estimate
 from sbndprmdaq.digitizer.prm_digitizer import PrMDigitizer
+from sbndprmdaq.digitizer.waveform_accumulator import WaveformAccumulator
 from sbndprmdaq.high_voltage.hv_control_mpod import HVControlMPOD
 
-#pylint: disable=too-many-public-methods,too-many-branches,too-many-statements,too-many-locals
+# Names of the digitizer channels, as used by the manager
+CHANNEL_NAMES = {'1': 'A', '2': 'B', '3': 'C', '4': 'D'}
+
+# Stages of a measurement done with the HV off
+HV_OFF_STAGES = ['post_processing_wait', 'hv_ramp_down_wait', 'settle', 'hv_off_check', 'hv_off_capture']
+
+# Lifetime error code sent to EPICS when a run could not be saved or analysed
+# (the analysis error codes are in PrMAnalysis._process_error)
+POST_PROCESSING_FAILED = -30
+
+# Post-processing stages run before the results are sent to EPICS
+UNPUBLISHED_STAGES = ['Persist', 'Analyse']
+
+# The analysis results sent to EPICS when a run could not be saved or analysed
+FAILED_MEAS = {'td': -1, 'qa': -1, 'qc': -1, 'tau': POST_PROCESSING_FAILED}
+
+#pylint: disable=too-many-public-methods,too-many-branches,too-many-statements,too-many-locals,too-many-lines
 class PrMManager():
     '''
     The purity monitor manager. Takes care of all DAQ aspects.
@@ -37,7 +69,6 @@ class PrMManager():
 
         self._digitizers = {}
         self._data = {}
-        self._epics_data = {}
         self._is_running = {}
         self._run_numbers = {}
         self._repetitions = {}
@@ -45,12 +76,14 @@ class PrMManager():
         self._mode = {}
         self._meas = {}
         self._time_interval = {}
-        self._timer = {}
+        self._base_interval = {} # set by the operator, adapted in _time_interval
         self._inhibit_run = {}
 
         self._data_files_path = config['data_files_path']
         self._save_as_npz = config['save_as_npz']
         self._save_as_txt = config['save_as_txt']
+        self._save_as_hdf5 = config.get('save_as_hdf5', False)
+        self._run_file_config = config.get('run_file', {})
 
         for prm_id in config['prm_ids']:
             self._data[prm_id] = None
@@ -62,13 +95,11 @@ class PrMManager():
             self._meas[prm_id] = None
             self._inhibit_run[prm_id] = False
 
-            # Timer for automatic runs
-            self._timer[prm_id] = QTimer()
-
             if self._window is not None:
                 self._time_interval[prm_id] = self._window._prm_controls[prm_id]._interval_spinbox.value() * 60
             else:
                 self._time_interval[prm_id] = 60
+            self._base_interval[prm_id] = self._time_interval[prm_id]
 
         self._set_digitizer_and_hv(config)
 
@@ -87,21 +118,108 @@ class PrMManager():
             self._prm_id_bounded[main_id] = bounded_id
 
 
-        self._data_storage = DataStorage(config)
+        # Keeps a valid Kerberos ticket for the uploads, renewed before it expires
+        self._credentials = KerberosCredentialManager(config.get('kerberos'))
+
+        self._data_storage = DataStorage(config, credentials=self._credentials)
+
+        # Uploads the run files in the background, and retries until they are uploaded
+        self._upload_service = None
+        if config['data_storage']:
+            self._credentials.start()
+            self._upload_service = UploadService(config, authenticate=self._credentials.ensure_valid)
+            self._upload_service.start()
+
+        # Packs the run files into one archive per day (or hour), uploaded once complete
+        self._run_bundler = None
+        if config.get('run_bundler', {}).get('enabled', False) and self._data_files_path is not None:
+            self._run_bundler = RunBundler(config, upload_service=self._upload_service)
+            self._run_bundler.start()
+
+        # Saving, analysing, publishing and uploading the runs is done
+        # by the post-processor, on its own threads
+        post_processing_config = config.get('post_processing', {})
+        self._post_processor = PostProcessor(
+            stages=[
+                ('Persist', self._persist_run),
+                ('Analyse', self._analyse_run),
+                ('Publish', self._publish_run),
+                ('Upload', self._upload_run),
+            ],
+            n_workers=post_processing_config.get('n_workers', 1),
+            max_queue_size=post_processing_config.get('max_queue_size', 8))
+        self._post_processor.progress.connect(self._post_processing_progress)
+        self._post_processor.job_done.connect(self._post_processing_done)
+        self._post_processor.job_failed.connect(self._post_processing_failed)
+        # On the post-processing thread, not to wait for EPICS on the GUI thread
+        self._post_processor.job_failed.connect(self._publish_failure, Qt.DirectConnection)
+        self._post_processor.start()
 
         self._do_analyze = config['analyze']
 
+        # Runs the analyses in separate processes, in parallel for the PrMs
+        analysis_pool_config = config.get('analysis_pool', {})
+        self._analysis_pool = AnalysisPool(n_processes=analysis_pool_config.get('n_processes', 3),
+                                           timeout=analysis_pool_config.get('timeout', 120))
+
         self._plotting_timer = None
 
         self._summary_plot = SummaryPlot(config)
         if config['populate_dataframe']:
-            self._summary_plot.set_dataframe_path(self._data_storage.get_dataframe_path())
+            self._summary_plot.set_measurement_store(self._data_storage.get_measurement_store())
             self._summary_plot.set_plot_savedir(self._data_files_path)
 
         self._comment = 'No comment'
 
         self._config = config
 
+        # Timing of the measurement steps
+        pipeline_config = config.get('capture_pipeline', {})
+        self._hv_off_settle_time = pipeline_config.get('hv_off_settle_time', 1)
+        self._wake_time = pipeline_config.get('wake_time', 4)
+        self._hv_off_delay = pipeline_config.get('hv_off_delay', 5)
+        self._hv_stable_poll_interval = pipeline_config.get('hv_stable_poll_interval', 2)
+        self._overlap_readout = pipeline_config.get('overlap_readout', True)
+
+        # Max number of raw records per channel kept for saving,
+        # on top of the mean and variance of all of them
+        self._record_reservoir_size = config.get('record_reservoir_size', 100)
+
+        # HV ramp-downs run in the background, the scheduler keeps the HV crate
+        # reserved until they are done: {prm_id: (future, abort_event)}
+        self._hv_off_executor = ThreadPoolExecutor(max_workers=len(config['prm_ids']),
+                                                   thread_name_prefix='HVOff')
+        self._pending_hv_off = {}
+
+        # Decides when the PrMs take data, running together
+        # the ones that do not share the HV crate, digitizer or lamp
+        scheduler_config = config.get('scheduler', {})
+        self._scheduler = MeasurementScheduler(
+            resources=prm_resources(config),
+            start_callback=self._start_scheduled,
+            min_interval=scheduler_config.get('min_interval', 300),
+            expected_duration=scheduler_config.get('expected_duration', 120),
+            tick_interval=scheduler_config.get('tick_interval', 1))
+
+        # Adapts the interval of the automatic runs to the purity stability
+        cadence_config = config.get('adaptive_cadence', {})
+        self._adaptive_cadence = cadence_config.get('enabled', False)
+        self._cadence = AdaptiveCadence(cadence_config)
+        self._bound_prms = config['bound_prms']
+
+        # Stops taking data once the lifetime is precise enough
+        self._early_stopping = EarlyStopping(config.get('early_stopping', {}))
+
+        # Reuses the HV off data between runs
+        self._hv_off_cache = HVOffReferenceCache(config.get('hv_off_cache', {}))
+
+        # Percentiles of the time spent in the stages of the latest runs
+        self._timing_statistics = TimingStatistics(config.get('timing_history_size', 50))
+
+        # Allocates the run numbers, and keeps the metadata of every run
+        self._run_catalog = None
+        self._run_catalog_file = config.get('run_catalog_file', 'run_catalog.sqlite')
+
         self.retrieve_run_numbers()
 
 
@@ -136,6 +254,19 @@ class PrMManager():
         #     self._prm_control.stop_prm(prm_id)
         #     self._logger.info('PrM is off.')
 
+        # No new runs
+        self._scheduler.stop()
+
+        # Let the pending HV ramp-downs and post-processing complete
+        self._hv_off_executor.shutdown(wait=True)
+        self._post_processor.stop(wait=True)
+        self._analysis_pool.stop()
+        if self._run_bundler is not None:
+            self._run_bundler.stop()
+        if self._upload_service is not None:
+            self._upload_service.stop()
+        self._credentials.stop()
+
         # Delete digiter log file
         os.remove('/tmp/ATSApi.log')
 
@@ -200,7 +331,9 @@ class PrMManager():
 
     def retrieve_run_numbers(self):
         '''
-        Retrieves the latest run number from file
+        Opens the run catalog, and retrieves the latest run numbers from it.
+        The catalog is seeded from latest_run_number.txt, so that it never
+        allocates a run number already in use.
         '''
         if self._data_files_path is None:
             self._logger.warning('Cannot retrieve run number as data_files_path is not set.')
@@ -225,9 +358,17 @@ class PrMManager():
                     self._logger.info(f'PrM: {prm_id} Run No: {run_no}')
                     self._run_numbers[int(prm_id)] = int(run_no)
 
+        self._run_catalog = RunCatalog(os.path.join(self._data_files_path, self._run_catalog_file))
+        self._run_catalog.seed_run_numbers(self._run_numbers)
+        for prm_id, run_no in self._run_catalog.latest_run_numbers().items():
+            if prm_id in self._run_numbers:
+                self._run_numbers[prm_id] = run_no
+        self.write_run_numbers()
+
     def write_run_numbers(self):
         '''
-        Writes run numbers to file
+        Writes run numbers to file. The run catalog allocates them, the
+        file is kept for the tools reading it.
         '''
         run_file_name = self._data_files_path + '/latest_run_number.txt'
         with open(run_file_name, "w", encoding="utf-8") as file:
@@ -236,11 +377,40 @@ class PrMManager():
 
     def increment_run_number(self, prm_id):
         '''
-        Increments the run number by 1 and writes it to file
+        Allocates the next run number, from the run catalog
+        if there is one, and writes it to file
         '''
-        self._run_numbers[prm_id] += 1
+        if self._run_catalog is not None:
+            self._run_numbers[prm_id] = self._run_catalog.allocate_run_number(
+                prm_id, after=self._run_numbers[prm_id])
+        else:
+            self._run_numbers[prm_id] += 1
         self.write_run_numbers()
 
+    def _catalog_run(self, job, **fields):
+        '''
+        Updates the metadata of a run in the run catalog, if there is one.
+        A failure is logged, but it does not stop the post-processing.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+            fields: The columns to update.
+        '''
+        if self._run_catalog is None:
+            return
+
+        try:
+            self._run_catalog.update_run(job.prm_id, job.run_number, **fields)
+        except sqlite3.Error as err:
+            self._logger.error(f'Cannot update run {job.run_number} of PrM {job.prm_id} '
+                               f'in the run catalog: {err}')
+
+    def get_run_catalog(self):
+        '''
+        Returns the run catalog, or None if there is none.
+        '''
+        return self._run_catalog
+
     def heartbeat(self):
         '''
         Writes a timestamp number in heartbeat.txt in the data
@@ -288,6 +458,7 @@ class PrMManager():
         worker = Worker(self.capture_data, prm_id=prm_id)
         # worker.signals.result.connect(self._result_callback)
         worker.signals.finished.connect(self._thread_complete)
+        worker.signals.finished.connect(lambda *_: self._measurement_finished(prm_id))
         worker.signals.progress.connect(self._thread_progress)
         worker.signals.data.connect(self._thread_data)
         # worker.setAutoDelete(False)
@@ -296,6 +467,16 @@ class PrMManager():
         self._threadpool.start(worker)
         self._logger.info(f'Thread started for prm_id {prm_id}.')
 
+    def _measured_together(self, prm_id):
+        '''
+        Returns prm_id, plus the PrM bound to it, if any.
+        '''
+        prm_ids = [prm_id]
+        if prm_id in self._prm_id_bounded:
+            prm_ids.append(self._prm_id_bounded[prm_id])
+        return prm_ids
+
+
     def _lamp_on(self, prm_ids):
 
         for prm_id in prm_ids:
@@ -326,7 +507,7 @@ class PrMManager():
             wait_time_max = 120 # seconds
             start = time.time()
             while not self._hv_control.hv_stable(prm_id):
-                time.sleep(2)
+                time.sleep(self._hv_stable_poll_interval)
 
                 if wait_time_max < time.time() - start:
                     break
@@ -339,55 +520,253 @@ class PrMManager():
             self._logger.info(f'Turning HV off for PrM {prm_id}.')
             self._hv_control.hv_off(prm_id)
 
-    def _take_data(self, prm_id, progress_callback=None):
+
+    def _turn_hv_off_later(self, prm_ids):
         '''
-        Takes the actual data
+        Turns the HV off in the background, after hv_off_delay seconds.
+        The ramp-down is skipped if the HV is turned on manually meanwhile.
         '''
+        abort = threading.Event()
 
-        data_raw_combined = {
-            'A': [],
-            'B': [],
-            'C': [],
-            'D': []
-        }
+        def ramp_down():
+            if abort.wait(self._hv_off_delay):
+                self._logger.info(f'HV ramp-down for PrMs {prm_ids} aborted.')
+                return
+            self._turn_hv_off(prm_ids)
+
+        future = self._hv_off_executor.submit(ramp_down)
+        for prm_id in prm_ids:
+            self._pending_hv_off[prm_id] = (future, abort)
+
+
+    def _measurement_finished(self, prm_id):
+        '''
+        Tells the scheduler a measurement ended. Its resources (the HV crate)
+        stay reserved until the HV ramp-down that follows it is done, so that
+        another PrM on the same crate does not ramp up meanwhile.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+        '''
+        future, _ = self._pending_hv_off.get(prm_id, (None, None))
+        self._scheduler.finished(prm_id, hold_until=future)
 
+
+    def _wait_hv_off(self, prm_ids):
+        '''
+        Waits for the background HV ramp-downs of prm_ids, if any.
+        '''
+        for prm_id in prm_ids:
+            future, _ = self._pending_hv_off.pop(prm_id, (None, None))
+            if future is None:
+                continue
+            err = future.exception()
+            if err is not None:
+                self._logger.critical(f'Failed to turn HV off for PrM {prm_id}: {err}')
+
+
+    def _start_data(self, prm_id, progress_callback=None, report_readout=True):
+        '''
+        Starts the acquisitions for all the repetitions, and returns as soon
+        as all the records have been captured. The readout of the last
+        repetition may still be running: pass the returned value to
+        _finish_data to get the data.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            progress_callback (fn): The callback function to be called to show progress (optional)
+            report_readout (bool): If False, progress is not reported once the records are captured.
+
+        Returns:
+            WaveformAccumulator: The accumulator the data is added to.
+            list: The AcquisitionFutures, one per repetition.
+        '''
+        captured = threading.Event()
+
+        def report_progress(name, perc):
+            if progress_callback is not None and (report_readout or not captured.is_set()):
+                progress_callback.emit(prm_id, name, int(perc))
+
+        # The records of all the repetitions are added to the accumulator
+        # as they are read out, and are not kept in memory. The same channel
+        # names (A to D) are used for all digitizers.
+        accumulator = WaveformAccumulator(self._record_reservoir_size, channel_map=CHANNEL_NAMES)
+
+        # All the repetitions are queued at once, but a digitizer runs them
+        # one after the other: a repetition is captured and read out before
+        # the next one starts, so captures and readouts do not overlap (only
+        # the readout of the last one overlaps what the caller does next)
+        futures = []
         for rep in range(self._repetitions[prm_id]):
             self._logger.info(f'*** Repetition number {rep}.')
             self._logger.info(f'Start capture for {prm_id}.')
-            self._prm_digitizer.start_capture(prm_id)
-            self._logger.info(f'Check capture for {prm_id}.')
-            status = self._prm_digitizer.check_capture(prm_id)
-
-            progress_callback.emit(prm_id, 'Retrieving Data', 100)
-            data_raw_ = self._prm_digitizer.get_data(prm_id)
-
-            print('PPPPPPPPPP')
-            print('len(data_raw_)', len(data_raw_))
-            if 1 in data_raw_:
-                print(len(data_raw_[1]))
-                print('len(data_raw_[1])', len(data_raw_[1]))
-
-            data_raw = {}
-
-            for k in data_raw_.keys():
-                if k == '1':
-                    data_raw['A'] = data_raw_[k]
-                elif k == '2':
-                    data_raw['B'] = data_raw_[k]
-                elif k == '3':
-                    data_raw['C'] = data_raw_[k]
-                elif k == '4':
-                    data_raw['D'] = data_raw_[k]
-                else:
-                    data_raw[k] = data_raw_[k]
-
-            # Combine data in case we are doing multiple repetitions
-            data_raw_combined['A'] = data_raw_combined['A'] + data_raw['A']
-            data_raw_combined['B'] = data_raw_combined['B'] + data_raw['B']
-            data_raw_combined['C'] = data_raw_combined['C'] + data_raw['C']
-            data_raw_combined['D'] = data_raw_combined['D'] + data_raw['D']
-
-        return data_raw_combined, status
+            futures.append(self._prm_digitizer.acquire_async(progress_callback=report_progress,
+                                                             accumulator=accumulator,
+                                                             prm_id=prm_id))
+
+        futures[-1].wait_captured()
+        captured.set()
+
+        return accumulator, futures
+
+
+    def _check_hv_off_reference(self, prm_id, prm_ids, digitizer_config, reference):
+        '''
+        Takes a few records with the HV off, and compares their baseline
+        with the one of a cached HV off reference (see HVOffReferenceCache).
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            prm_ids (list): The PrMs measured together.
+            digitizer_config (DigitizerConfig): The digitizer configuration of the run.
+            reference (WaveformAccumulator): The cached HV off data.
+
+        Returns:
+            float: The baseline drift (in volts), None if the check capture failed.
+        '''
+        accumulator = WaveformAccumulator(channel_map=CHANNEL_NAMES)
+
+        self._lamp_on(prm_ids)
+        try:
+            future = self._prm_digitizer.acquire_async(n_records=self._hv_off_cache.check_records,
+                                                       accumulator=accumulator, prm_id=prm_id)
+            future.result()
+        except CancelledError:
+            self._logger.warning(f'HV off check capture for {prm_id} was cancelled.')
+            accumulator = None
+        finally:
+            self._lamp_off(prm_ids)
+            # Back to the number of records of the runs
+            self._prm_digitizer.set_number_acquisitions(digitizer_config.number_acquisitions, prm_id)
+
+        return self._hv_off_cache.check_drift(prm_id, digitizer_config, reference, accumulator)
+
+
+    def _finish_data(self, prm_id, pending, timer=None):
+        '''
+        Waits for the acquisitions started by _start_data.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            pending (tuple): The accumulator and the futures returned by _start_data.
+            timer (StageTimer): If passed, the readout times are added to it.
+
+        Returns:
+            WaveformAccumulator: The accumulated data of all repetitions.
+            bool: The status of the last acquisition.
+        '''
+        accumulator, futures = pending
+        status = False
+
+        for future in futures:
+            try:
+                result = future.result()
+            except CancelledError:
+                self._logger.warning(f'Acquisition for {prm_id} was cancelled.')
+                return accumulator, False
+
+            status = result.status
+            self._logger.info(f'Retrieved data for {prm_id}: capture took {result.capture_time:.2f} s, '
+                              f'readout took {result.readout_time:.2f} s.')
+            if timer is not None:
+                timer.add('readout', result.readout_time)
+
+        return accumulator, status
+
+
+    def _take_data_until_precise(self, prm_id, data_hv_off, timer=None, progress_callback=None):
+        '''
+        Takes repetitions, one at a time, until the lifetime of all the PrMs
+        measured together is estimated with the target precision, or until
+        the max number of repetitions or the max time is reached.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            data_hv_off (WaveformAccumulator): The HV off data, subtracted in the estimates (or None).
+            timer (StageTimer): If passed, the readout times are added to it.
+            progress_callback (fn): The callback function to be called to show progress (optional)
+
+        Returns:
+            WaveformAccumulator: The accumulated data of all repetitions.
+            bool: The status of the last acquisition.
+            dict: The number of repetitions, why they stopped, and the estimates, keyed by PrM.
+        '''
+        accumulator = WaveformAccumulator(self._record_reservoir_size, channel_map=CHANNEL_NAMES)
+
+        prm_channels = {prm_id: ['A', 'B']}
+        if prm_id in self._prm_id_bounded:
+            prm_channels[self._prm_id_bounded[prm_id]] = ['C', 'D']
+
+        start = time.monotonic()
+        status = False
+        n_repetitions = 0
+        estimates = {}
+        reason = None
+
+        while reason is None:
+            self._logger.info(f'*** Repetition number {n_repetitions}.')
+            future = self._prm_digitizer.acquire_async(accumulator=accumulator, prm_id=prm_id)
+            try:
+                result = future.result()
+            except CancelledError:
+                self._logger.warning(f'Acquisition for {prm_id} was cancelled.')
+                break
+
+            n_repetitions += 1
+            status = result.status
+            if timer is not None:
+                timer.add('readout', result.readout_time)
+
+            estimates = {
+                p_id: quick_lifetime_estimate(accumulator, data_hv_off, channels,
+                                              self._config['analysis_config'].get(p_id, {}))
+                for p_id, channels in prm_channels.items()
+            }
+            _, reason = self._early_stopping.check(n_repetitions, time.monotonic() - start, estimates)
+
+            precision = ', '.join(f'PrM {p_id}: {e["tau_rel_err"]:.1%}' for p_id, e in estimates.items()
+                                  if e is not None and e['tau_rel_err'] is not None)
+            self._logger.info(f'Lifetime precision after {n_repetitions} repetitions: {precision or "unknown"}.')
+            if progress_callback is not None:
+                progress_callback.emit(prm_id, 'Capture',
+                                       int(n_repetitions / self._early_stopping.max_repetitions * 100))
+
+        self._logger.info(f'Stopped taking data for PrM {prm_id} after {n_repetitions} repetitions: {reason}.')
+
+        return accumulator, status, {'repetitions': n_repetitions, 'reason': reason, 'estimates': estimates}
+
+
+    @staticmethod
+    def _prm_waveforms(accumulator, channels):
+        '''
+        Returns the waveforms of one purity monitor, with the cathode and
+        anode channels renamed to A and B, or None if they were not acquired.
+
+        Args:
+            accumulator (WaveformAccumulator): The waveforms of all channels.
+            channels (list): The cathode and anode channels of the purity monitor.
+        '''
+        if accumulator is None or not all(ch in accumulator for ch in channels):
+            return None
+        return accumulator.select(channels, names=['A', 'B'])
+
+
+    def _read_hv(self, prm_id):
+        '''
+        Reads the voltage, current and temperature of all HV channels of a PrM.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+
+        Returns:
+            dict: The readings, keyed by item (cathode, anodegrid, anode) and quantity.
+        '''
+        return {
+            item: {
+                quantity: self._hv_control.get_hv_sense_value(item, quantity, prm_id)
+                for quantity in ['voltage', 'current', 'temperature']
+            } for item in ['anode', 'anodegrid', 'cathode']
+        }
 
 
     def _prm_wait(self, prm_id, purity_mon_wake_time=4, progress_callback=None):
@@ -399,7 +778,7 @@ class PrMManager():
         while purity_mon_wake_time > time.time() - start:
             perc = (time.time() - start) / purity_mon_wake_time * 100
             if progress_callback is not None:
-                progress_callback.emit(prm_id, 'Awake Monitor', perc)
+                progress_callback.emit(prm_id, 'Awake Monitor', int(perc))
             time.sleep(0.1)
 
 
@@ -411,35 +790,83 @@ class PrMManager():
         Args:
             prm_id (int): The purity monitor ID.
             progress_callback (fn): The callback function to be called to show progress (optional)
+            data_callback (fn): The callback function the data is sent to (optional,
+                                the data is saved directly if not passed)
         Returns:
             dict: A dictionary containing the prm_ids processed, and the statuses
         '''
         self._is_running[prm_id] = True
 
-        prm_ids = [prm_id]
-        if prm_id in self._prm_id_bounded:
-            prm_ids.append(self._prm_id_bounded[prm_id])
+        prm_ids = self._measured_together(prm_id)
+
+        # Without a worker thread, the data is saved from this thread
+        send_data = data_callback.emit if data_callback is not None else self._thread_data
+
+        timer = StageTimer()
+
+        # Do not take more data than the post-processing can keep up with
+        with timer.stage('post_processing_wait'):
+            self._post_processor.wait_for_capacity()
+
+        # The HV ramp-down of the previous measurement may still be running
+        with timer.stage('hv_ramp_down_wait'):
+            self._wait_hv_off(prm_ids)
+
+        data_hv_off = None
+        hv_off_futures = None
+
+        # The HV off data of a previous run may be reused, if a short
+        # HV off capture shows that the baseline did not drift since
+        hv_off_reference = None
+        settled = False
+        digitizer_config = self._prm_digitizer.get_config(prm_id)
+        if self._take_hvoff_run[prm_id]:
+            data_hv_off, hv_off_reference = self._hv_off_cache.get(prm_id, digitizer_config)
+
+        if data_hv_off is not None:
+            if progress_callback is not None:
+                progress_callback.emit(prm_id, 'NO HV check', 50)
 
-        data_hv_off = {'A': [], 'B': [], 'C': [], 'D': []}
-        data_hv_on  = {'A': [], 'B': [], 'C': [], 'D': []}
+            with timer.stage('settle'):
+                time.sleep(self._hv_off_settle_time)
+            settled = True
+
+            with timer.stage('hv_off_check'):
+                drift = self._check_hv_off_reference(prm_id, prm_ids, digitizer_config, data_hv_off)
+
+            if self._hv_off_cache.drifted(drift):
+                data_hv_off, hv_off_reference = None, None
+            else:
+                hv_off_reference['baseline_drift'] = drift
 
         #
         # First run with no HV
         #
-        if self._take_hvoff_run[prm_id]:
+        if self._take_hvoff_run[prm_id] and data_hv_off is None:
 
             if progress_callback is not None:
                 progress_callback.emit(prm_id, 'NO HV run', 50)
 
-            time.sleep(1)
+            if not settled:
+                with timer.stage('settle'):
+                    time.sleep(self._hv_off_settle_time)
 
             self._logger.info(f'NO HN Run for {prm_id}.')
 
-            self._lamp_on(prm_ids)
+            with timer.stage('lamp_on'):
+                self._lamp_on(prm_ids)
 
-            data_hv_off, _ = self._take_data(prm_id, progress_callback)
+            # Only wait for the records to be on the digitizer: they are
+            # read out while the HV is ramped up for the next run
+            with timer.stage('hv_off_capture'):
+                hv_off_futures = self._start_data(prm_id, progress_callback, report_readout=False)
 
-            self._lamp_off(prm_ids)
+            with timer.stage('lamp_off'):
+                self._lamp_off(prm_ids)
+
+            if not self._overlap_readout:
+                with timer.stage('hv_off_readout_wait'):
+                    data_hv_off, _ = self._finish_data(prm_id, hv_off_futures, timer)
 
             self._logger.info(f'NO HN Run for {prm_id} completed.')
 
@@ -451,46 +878,91 @@ class PrMManager():
         #
         # Second run with HV
         #
-        self._turn_hv_on(prm_ids)
-        self._prm_wait(prm_id, 4, progress_callback)
-        self._lamp_on(prm_ids)
+        with timer.stage('hv_ramp_up'):
+            self._turn_hv_on(prm_ids)
+        with timer.stage('wake'):
+            self._prm_wait(prm_id, self._wake_time, progress_callback)
+
+        if hv_off_futures is not None and data_hv_off is None:
+            with timer.stage('hv_off_readout_wait'):
+                data_hv_off, _ = self._finish_data(prm_id, hv_off_futures, timer)
+
+        with timer.stage('lamp_on'):
+            self._lamp_on(prm_ids)
 
         if progress_callback is not None:
             progress_callback.emit(prm_id, 'Start Capture', 100)
 
-        data_hv_on, status = self._take_data(prm_id, progress_callback)
+        # Either a fixed number of repetitions, or until the lifetime is precise enough
+        early_stopping = None
+        hv_on_futures = None
+        data_hv_on, status = None, False
+        with timer.stage('hv_on_capture'):
+            if self._early_stopping.enabled:
+                data_hv_on, status, early_stopping = self._take_data_until_precise(
+                    prm_id, data_hv_off, timer, progress_callback)
+            else:
+                hv_on_futures = self._start_data(prm_id, progress_callback)
+
+        with timer.stage('lamp_off'):
+            self._lamp_off(prm_ids)
+
+        # Read the HV while it is still on, and while the data is read out
+        with timer.stage('hv_readings'):
+            hv_readings = {p_id: self._read_hv(p_id) for p_id in prm_ids}
+
+        # The HV is turned off in the background, while reading out,
+        # and the worker does not wait for the ramp-down
+        self._turn_hv_off_later(prm_ids)
+
+        if hv_on_futures is not None:
+            with timer.stage('hv_on_readout_wait'):
+                data_hv_on, status = self._finish_data(prm_id, hv_on_futures, timer)
+
+        # Time spent reducing the records, while they were read out
+        for data in [data_hv_off if hv_off_reference is None else None, data_hv_on]:
+            if data is not None:
+                timer.add('conversion', data.processing_time)
+
+        if hv_off_reference is None:
+            self._hv_off_cache.store(prm_id, digitizer_config, data_hv_off)
+
+        timing = timer.breakdown()
+        self._logger.info(f'Measurement timing for PrM {prm_id}: {timer.summary()}')
 
         # Pack all the data in a dictionary
         data = {
             'prm_id': prm_id,
             'status': status,
             'time': datetime.datetime.today(),
-            'A': data_hv_on['A'],
-            'B': data_hv_on['B'],
-            'A_nohv': data_hv_off['A'],
-            'B_nohv': data_hv_off['B'],
+            'hv_on': self._prm_waveforms(data_hv_on, ['A', 'B']),
+            'hv_off': self._prm_waveforms(data_hv_off, ['A', 'B']),
+            'hv_off_reference': hv_off_reference,
+            'early_stopping': early_stopping,
+            'timing': timing,
+            'hv_readings': hv_readings[prm_id],
+            'digitizer_config': digitizer_config,
         }
 
         # Send the data for saving
-        data_callback.emit(data)
+        send_data(data)
 
         if prm_id in self._prm_id_bounded:
             data = {
                 'prm_id': self._prm_id_bounded[prm_id],
                 'status': status,
                 'time': datetime.datetime.today(),
-                'A': data_hv_on['C'],
-                'B': data_hv_on['D'],
-                'A_nohv': data_hv_off['C'],
-                'B_nohv': data_hv_off['D'],
+                'hv_on': self._prm_waveforms(data_hv_on, ['C', 'D']),
+                'hv_off': self._prm_waveforms(data_hv_off, ['C', 'D']),
+                'hv_off_reference': hv_off_reference,
+                'early_stopping': early_stopping,
+                'timing': timing,
+                'hv_readings': hv_readings[self._prm_id_bounded[prm_id]],
+                'digitizer_config': self._prm_digitizer.get_config(self._prm_id_bounded[prm_id]),
             }
 
             # Send the data for saving
-            data_callback.emit(data)
-
-        self._lamp_off(prm_ids)
-        time.sleep(5)
-        self._turn_hv_off(prm_ids)
+            send_data(data)
 
         self._is_running[prm_id] = False
 
@@ -511,18 +983,9 @@ class PrMManager():
         '''
         self._logger.info(f'Got data for PrM {data["prm_id"]}.')
 
-        if data['status']:
-            self._data[data['prm_id']] = {
-                'A': data['A'],
-                'B': data['B'],
-                'A_nohv': data['A_nohv'],
-                'B_nohv': data['B_nohv'],
-                'time': data['time'],
-            }
+        if data['status'] and data['hv_on'] is not None:
+            self._data[data['prm_id']] = data
             self.save_data(data['prm_id'])
-            if self._epics_data:
-                self.output_to_epics(data['prm_id'])
-            self._logger.info(f'Saved data for PrM {data["prm_id"]}.')
         else:
             self._logger.info(f'Bad capture, no data to save for PrM {data["prm_id"]}.')
 
@@ -536,6 +999,9 @@ class PrMManager():
             name (str): The name of the current task for display.
             progress (int): The progress (0 to 100 percent).
         '''
+        if self._window is None:
+            return
+
         self._window.set_progress(prm_id=prm_id, name=name, perc=progress)
         if prm_id in self._prm_id_bounded:
             self._window.set_progress(prm_id=self._prm_id_bounded[prm_id], name=name, perc=progress)
@@ -553,26 +1019,31 @@ class PrMManager():
         for prm_id, status in zip(prm_ids, statuses):
             self._logger.info(f'Thread completed for prm_id {prm_id}. Status: {status}.')
 
+            self._is_running[prm_id] = False
+
+            if self._window is None:
+                continue
+
             if status:
                 self._window.reset_progress([prm_id], name='Done!', color='#006400') # dark green
             else:
                 self._window.reset_progress([prm_id], name='Failed!', color='#B22222') # firebrick
 
-            self._is_running[prm_id] = False
-
-
-        QTimer.singleShot(3000, lambda: self._window.reset_progress(prm_ids))
+        if self._window is not None:
+            QTimer.singleShot(3000, lambda: self._window.reset_progress(prm_ids))
 
 
 
-    def save_data(self, prm_id=1):
+    def save_data(self, prm_id=1, wait=False):
         '''
-        Saves the most recent captured data, if any.
+        Saves the most recent captured data, if any. The run number, the comment
+        and the GUI configuration are taken now, while saving, analysing,
+        publishing and uploading the run is left to the post-processor.
 
         Args:
             prm_id (int): The purity monitor ID.
+            wait (bool): If True, the run is processed in this thread.
         '''
-        # pylint: disable=invalid-name
         self._logger.info(f'Saving data for PrM {prm_id}.')
 
         self.increment_run_number(prm_id)
@@ -580,153 +1051,433 @@ class PrMManager():
         if self._data_files_path is None:
             self._logger.warning('Cannot save to file, data_files_path not set.')
             return
-        if not self._save_as_npz and not self._save_as_txt:
-            self._logger.warning('Not saving to file, neither save_as_npz or save_as_txt are set')
+        if not self._save_as_npz and not self._save_as_txt and not self._save_as_hdf5:
+            self._logger.warning('Not saving to file, none of save_as_npz, save_as_txt or save_as_hdf5 are set')
             return
 
-        out_dict = {}
-        self._epics_data = {}
-
-        timestr = time.strftime("%Y%m%d-%H%M%S")
-
         if self._data[prm_id] is None:
             return
 
-        for ch in self._data[prm_id].keys():
-            out_dict[f'ch_{ch}'] = self._data[prm_id][ch]
+        configs = None
+        if self._window is not None:
+            configs = self._window.get_config_values(prm_id)
+
+        job = PostProcessingJob(prm_id,
+                                self._data[prm_id],
+                                self._run_numbers[prm_id],
+                                self._comment,
+                                configs)
+        job.hv_status = 'on' if self._hv_on else 'off'
 
-        if self._hv_on:
-            hv_status = 'on'
+        if wait:
+            self._post_processor.process(job)
         else:
-            hv_status = 'off'
-
-        out_dict['run'] = self._run_numbers[prm_id]
-        out_dict['date'] = timestr
-        out_dict['hv'] = hv_status
-        out_dict['comment'] = self._comment
-
-        out_dict['hv_anode'] = self._hv_control.get_hv_sense_value('anode', 'voltage', prm_id)
-        out_dict['hv_anodegrid'] = self._hv_control.get_hv_sense_value('anodegrid', 'voltage', prm_id)
-        out_dict['hv_cathode'] = self._hv_control.get_hv_sense_value('cathode', 'voltage', prm_id)
-
-        # Get EPICS data here to have the measurements at roughly the same time
-        self._epics_data['anode'] = {
-            'voltage' : out_dict['hv_anode'],
-            'current' : self._hv_control.get_hv_sense_value('anode', 'current', prm_id),
-            'temperature' : self._hv_control.get_hv_sense_value('anode', 'temperature', prm_id)
-        }
-        self._epics_data['anodegrid'] = {
-            'voltage' : out_dict['hv_anodegrid'],
-            'current' : self._hv_control.get_hv_sense_value('anodegrid', 'current', prm_id),
-            'temperature' : self._hv_control.get_hv_sense_value('anodegrid', 'temperature', prm_id)
-        }
-        self._epics_data['cathode'] = {
-            'voltage' : out_dict['hv_cathode'],
-            'current' : self._hv_control.get_hv_sense_value('cathode', 'current', prm_id),
-            'temperature' : self._hv_control.get_hv_sense_value('cathode', 'temperature', prm_id)
-        }
+            self._post_processor.submit(job)
+
+
+    def _persist_run(self, job):
+        '''
+        Post-processing stage: writes the run to the hdf5 file (and to the
+        former npz and txt files, if enabled). The raw records saved are the
+        reservoir sample of the run, which is only final once the capture is
+        over, so they are written here rather than as the data arrives.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+        '''
+        # pylint: disable=invalid-name
+        out_dict = job.out_dict
+
+        # The raw records kept in the reservoirs, plus the mean
+        # and variance waveforms of all the records
+        data_hv_on = job.data['hv_on']
+        data_hv_off = job.data['hv_off']
+        records_hv_on = data_hv_on.reservoir()
+        records_hv_off = data_hv_off.reservoir() if data_hv_off is not None else None
+        for ch in ['A', 'B']:
+            out_dict[f'ch_{ch}'] = records_hv_on[ch]
+        for ch in ['A', 'B']:
+            out_dict[f'ch_{ch}_nohv'] = records_hv_off[ch] if records_hv_off is not None else []
+        out_dict['ch_time'] = job.data['time']
+
+        out_dict['n_records'] = data_hv_on.count
+        out_dict['n_records_nohv'] = data_hv_off.count if data_hv_off is not None else 0
+
+        # The number of repetitions, if decided by the lifetime precision
+        early_stopping = job.data.get('early_stopping')
+        if early_stopping is not None:
+            out_dict['n_repetitions'] = early_stopping['repetitions']
+            out_dict['stop_reason'] = early_stopping['reason']
+            estimate = early_stopping['estimates'].get(job.prm_id)
+            if estimate is not None and estimate['tau_rel_err'] is not None:
+                out_dict['tau_rel_err_estimate'] = estimate['tau_rel_err']
+
+        # The HV off data may come from a previous run
+        hv_off_reference = job.data.get('hv_off_reference')
+        out_dict['hv_off_cached'] = hv_off_reference is not None
+        if hv_off_reference is not None:
+            out_dict['hv_off_age'] = hv_off_reference['age']
+            out_dict['hv_off_uses'] = hv_off_reference['uses']
+            out_dict['hv_off_baseline_drift'] = hv_off_reference['baseline_drift']
+        for ch in ['A', 'B']:
+            out_dict[f'ch_{ch}_mean'] = data_hv_on.mean(ch)
+            out_dict[f'ch_{ch}_variance'] = data_hv_on.variance(ch)
+            if data_hv_off is not None:
+                out_dict[f'ch_{ch}_nohv_mean'] = data_hv_off.mean(ch)
+                out_dict[f'ch_{ch}_nohv_variance'] = data_hv_off.variance(ch)
+
+        out_dict['run'] = job.run_number
+        out_dict['date'] = job.timestr
+        out_dict['hv'] = job.hv_status
+        out_dict['comment'] = job.comment
+
+        # The HV was read at the end of the run
+        job.epics_data = job.data['hv_readings']
+        out_dict['hv_anode'] = job.epics_data['anode']['voltage']
+        out_dict['hv_anodegrid'] = job.epics_data['anodegrid']['voltage']
+        out_dict['hv_cathode'] = job.epics_data['cathode']['voltage']
+
+        # The time spent in the stages of the measurement
+        for name, duration in job.data['timing'].items():
+            out_dict['timing_' + name] = duration
 
         # out_dict['samples_per_sec'] = self._digitizers[prm_id].get_samples_per_second()
         # out_dict['pre_trigger_samples'] = self._digitizers[prm_id].get_pre_trigger_samples()
         # out_dict['post_trigger_samples'] = self._digitizers[prm_id].get_post_trigger_samples()
         # out_dict['input_range_volts'] = self._digitizers[prm_id].get_input_range_volts()
 
-        out_dict['samples_per_sec'] = self._prm_digitizer.get_samples_per_second(prm_id)
-        out_dict['pre_trigger_samples'] = self._prm_digitizer.get_pre_trigger_samples(prm_id)
-        out_dict['post_trigger_samples'] = self._prm_digitizer.get_post_trigger_samples(prm_id)
-        # out_dict['input_range_volts'] = self._prm_digitizer.get_input_range_volts(prm_id)
+        digitizer_config = job.data['digitizer_config']
+        out_dict['samples_per_sec'] = digitizer_config.samples_per_second
+        out_dict['pre_trigger_samples'] = digitizer_config.pre_trigger_samples
+        out_dict['post_trigger_samples'] = digitizer_config.post_trigger_samples
+        # out_dict['input_range_volts'] = digitizer_config.input_range_volts
 
         # Add the extra configuration
-        configs = self._window.get_config_values(prm_id)
-        if configs is not None:
-            for k, v in configs.items():
+        if job.configs is not None:
+            for k, v in job.configs.items():
                 out_dict['config_' + k] = v
 
-        run_name = (
-            'sbnd_prm' + str(prm_id) +
-            '_run_' + str(self._run_numbers[prm_id]) +
+        job.run_name = (
+            'sbnd_prm' + str(job.prm_id) +
+            '_run_' + str(job.run_number) +
             '_data_' +
-            timestr
+            job.timestr
         )
 
-        saved_files = []
+        if self._save_as_hdf5:
+            file_name = os.path.join(self._data_files_path, job.run_name + '.h5')
+            job.saved_files.append(file_name)
+            # The raw records as the integer samples of the digitizer, if it has some
+            encoding = digitizer_config.sample_encoding if self._run_file_config.get('raw_samples', True) else None
+            with job.timer.stage('save_hdf5'), \
+                 RunFileWriter(file_name,
+                               compression=self._run_file_config.get('compression', 'gzip'),
+                               compression_opts=self._run_file_config.get('compression_level', 4)) as writer:
+                writer.append_records('hv_on', records_hv_on, encoding)
+                writer.write_summary('hv_on', data_hv_on)
+                if data_hv_off is not None:
+                    writer.append_records('hv_off', records_hv_off, encoding)
+                    writer.write_summary('hv_off', data_hv_off)
+                writer.set_attributes(prm_id=job.prm_id,
+                                      **{k: v for k, v in out_dict.items() if not k.startswith('ch_')})
 
         if self._save_as_npz:
-            file_name = os.path.join(self._data_files_path, run_name + '.npz')
-            saved_files.append(file_name)
-            np.savez(saved_files[-1], **out_dict)
+            file_name = os.path.join(self._data_files_path, job.run_name + '.npz')
+            job.saved_files.append(file_name)
+            with job.timer.stage('save_npz'):
+                np.savez(file_name, **out_dict)
 
         if self._save_as_txt:
-            file_name = os.path.join(self._data_files_path, run_name + '.txt')
-            saved_files.append(file_name)
-            with open(file_name, 'w', encoding='utf-8') as f:
+            file_name = os.path.join(self._data_files_path, job.run_name + '.txt')
+            job.saved_files.append(file_name)
+            with job.timer.stage('save_txt'), open(file_name, 'w', encoding='utf-8') as f:
                 for k, v in out_dict.items():
-                    if isinstance(v, list):
-                        if len(v):
-                            v = np.stack(v) # assuming list of arrays
-                            v = v.tolist()
+                    if isinstance(v, (list, np.ndarray)):
+                        v = np.asarray(v).tolist()
                         v_str = str(v).replace(" ", "")
                         f.write(k + '=' + v_str + '\n')
                     else:
                         f.write(k + '=' + str(v) + '\n')
 
-        # Analyze data
-        self._meas[prm_id] = None
-        if self._do_analyze:
-            try:
-                #pylint: disable=protected-access,attribute-defined-outside-init,broad-exception-caught
-                self._logger.info(f'Analyzing data for PrM {prm_id}.')
-                ana_config = self._config['analysis_config'][prm_id]
-                if ana_config['ana_type'] == 'estimate':
-                    ana_cls = PrMAnalysisEstimate
-                elif ana_config['ana_type'] == 'fit':
-                    ana_cls = PrMAnalysisFitter
-                elif ana_config['ana_type'] == 'fit_difference':
-                    ana_cls = PrMAnalysisFitterDiff
-                else:
-                    raise ValueError(f'Invalid ana_type {ana_config["ana_type"]}')
-                self._prmana = ana_cls(out_dict['ch_A'], out_dict['ch_B'],
-                                           config=ana_config,
-                                           wf_c_hvoff=out_dict['ch_A_nohv'], wf_a_hvoff=out_dict['ch_B_nohv'])
-                self._prmana.calculate()
-                file_name = os.path.join(self._data_files_path, run_name + '_ana.png')
-                self._prmana.plot_summary(container=out_dict, savename=file_name)
-                self._meas[prm_id] = {
-                    'date': out_dict['date'],
-                    'v_c': out_dict['hv_cathode'],
-                    'v_ag': out_dict['hv_anodegrid'],
-                    'v_a': out_dict['hv_anode'],
-                    'td': self._prmana.get_drifttime(unit='ms'),
-                    'qc': self._prmana.get_qc(unit='mV'),
-                    'qa': self._prmana.get_qa(unit='mV'),
-                    'tau': self._prmana.get_lifetime(unit='ms')
-                }
-                print('--->', self._meas[prm_id])
-                saved_files.append(file_name)
-            except Exception as err:
-                self._logger.warning('PrMAnalysis failed:')
-                self._logger.warning(type(err))
-                self._logger.warning(err)
-
-
-        # Copy data to sbndgpvm
-        if self._config['data_storage']:
-            self._logger.info(f'Storing data for PrM {prm_id}.')
-            self._data_storage.store_files(saved_files)
+        self._catalog_run(job,
+                          status='saved',
+                          date=job.timestr,
+                          comment=job.comment,
+                          hv_status=job.hv_status,
+                          n_records=data_hv_on.count,
+                          files=[os.path.basename(f) for f in job.saved_files],
+                          hv=job.epics_data,
+                          digitizer_config=dataclasses.asdict(digitizer_config),
+                          timing=job.data['timing'])
+
+
+    def _analyse_run(self, job):
+        '''
+        Post-processing stage: extracts the lifetime, and saves the summary plot.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+        '''
+        if not self._do_analyze:
+            return
+
+        out_dict = job.out_dict
+        data_hv_on = job.data['hv_on']
+        data_hv_off = job.data['hv_off']
+
+        try:
+            self._logger.info(f'Analyzing data for PrM {job.prm_id}.')
+            ana_config = self._config['analysis_config'][job.prm_id]
+            # The analysis averages the waveforms it gets, so it is
+            # given the mean waveforms of all records as single records
+            wf_hvoff = {ch: [] for ch in ['A', 'B']}
+            if data_hv_off is not None:
+                wf_hvoff = {ch: data_hv_off.mean(ch)[np.newaxis] for ch in ['A', 'B']}
+            file_name = os.path.join(self._data_files_path, job.run_name + '_ana.png')
+
+            # The analysis runs in another process, the waveforms are sent through shared memory
+            start = time.monotonic()
+            result = self._analysis_pool.analyse(ana_config['ana_type'], ana_config,
+                                                 data_hv_on.mean('A')[np.newaxis],
+                                                 data_hv_on.mean('B')[np.newaxis],
+                                                 wf_c_hvoff=wf_hvoff['A'], wf_a_hvoff=wf_hvoff['B'],
+                                                 container=out_dict, plot_file=file_name)
+            job.timer.add('analysis', result.calculate_time)
+            job.timer.add('plot', result.plot_time)
+            job.timer.add('analysis_overhead', time.monotonic() - start - result.calculate_time - result.plot_time)
+            if result.status != 'ok':
+                raise RuntimeError(f'Analysis {result.status}: {result.error}')
+
+            job.meas = {
+                'date': out_dict['date'],
+                'v_c': out_dict['hv_cathode'],
+                'v_ag': out_dict['hv_anodegrid'],
+                'v_a': out_dict['hv_anode'],
+                'td': result.td,
+                'qc': result.qc,
+                'qa': result.qa,
+                'tau': result.tau
+            }
+            self._add_uncertainties(job.meas, data_hv_on, data_hv_off)
+            self._logger.debug(f'Analysis results for PrM {job.prm_id}: {job.meas}')
+            job.saved_files.append(file_name)
+            self._catalog_run(job,
+                              status='analysed',
+                              files=[os.path.basename(f) for f in job.saved_files],
+                              **{key: job.meas.get(key) for key in
+                                 ['td', 'qa', 'qc', 'tau', 'qa_err', 'qc_err', 'tau_err']})
+        except Exception as err: #pylint: disable=broad-exception-caught
+            # The run files are still uploaded, and the failure is sent to EPICS by _publish_run
+            self._logger.error(f'PrMAnalysis failed for run {job.run_number} of PrM {job.prm_id}: '
+                               f'{type(err).__name__}: {err}')
+            job.meas = None
+            self._catalog_run(job, status='failed_analyse')
+
+
+    @staticmethod
+    def _add_uncertainties(meas, data_hv_on, data_hv_off):
+        '''
+        Adds the errors on Qa, Qc and the lifetime to the analysis results.
+        The charge errors are estimated from the noise on the mean waveforms
+        (difference of the peak and the baseline, both with the error of
+        the mean), before the smoothing done by the analysis.
+
+        Args:
+            meas (dict): The analysis results.
+            data_hv_on (WaveformAccumulator): The HV on records.
+            data_hv_off (WaveformAccumulator): The HV off records (or None).
+        '''
+        def charge_error(channel):
+            variance = np.nanmedian(data_hv_on.std_error(channel))**2
+            if data_hv_off is not None:
+                variance += np.nanmedian(data_hv_off.std_error(channel))**2
+            return float(np.sqrt(2 * variance) * 1e3) # mV
+
+        meas['qc_err'] = charge_error('A')
+        meas['qa_err'] = charge_error('B')
+
+        rel_err = relative_lifetime_error(meas['qa'], meas['qc'], meas['qa_err'], meas['qc_err'])
+        meas['tau_err'] = rel_err * meas['tau'] if rel_err is not None else None
+
+
+    def _publish_run(self, job):
+        '''
+        Post-processing stage: sends the run to EPICS and to the measurement store.
+        If the analysis failed, an error code is sent as the lifetime, so
+        that EPICS does not keep the previous one.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+        '''
+        meas = job.meas
+        if meas is None and self._do_analyze:
+            meas = FAILED_MEAS
+
+        with job.timer.stage('epics'):
+            self.output_to_epics(job.prm_id, job.epics_data, meas)
 
         if self._config['populate_dataframe']:
-            self._logger.info(f'Populating dataframe for PrM {prm_id}.')
-            self._data_storage.update_dataframe(self._meas[prm_id], prm_id)
+            self._logger.info(f'Storing the measurement of PrM {job.prm_id}.')
+            with job.timer.stage('dataframe'):
+                self._data_storage.store_measurement(job.meas, job.prm_id, job.run_number)
+
+
+    def _upload_run(self, job):
+        '''
+        Post-processing stage: adds the run files to the uploads to sbndgpvm.
+        It does not wait for the upload.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+        '''
+        if self._run_bundler is not None:
+            self._logger.info(f'Bundling data for PrM {job.prm_id}.')
+            with job.timer.stage('bundle'):
+                self._run_bundler.add_run(job.run_name, job.saved_files,
+                                          prm_id=job.prm_id, run_number=job.run_number)
+        elif self._upload_service is not None:
+            self._logger.info(f'Storing data for PrM {job.prm_id}.')
+            with job.timer.stage('upload'):
+                self._upload_service.submit(job.saved_files)
+
+
+    def _post_processing_progress(self, prm_id, stage, progress):
+        '''
+        Shows the post-processing progress, if the PrM is not taking data.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            stage (str): The name of the current stage.
+            progress (int): The progress (0 to 100 percent).
+        '''
+        if self._window is not None and not self._is_running[prm_id]:
+            self._window.set_progress(prm_id=prm_id, name=stage, perc=progress)
+
+
+    def _post_processing_done(self, job):
+        '''
+        Called on the GUI thread when a run has been processed.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+        '''
+        self._meas[job.prm_id] = job.meas
+        self._adapt_cadence(job)
+
+        stage_times = ', '.join(f'{name}: {duration:.2f} s' for name, duration in job.stage_times.items())
+        self._logger.info(f'Data saved for PrM {job.prm_id}, run {job.run_number} ({stage_times}).')
+
+        timing = self._run_timing(job)
+        self._timing_statistics.add(job.prm_id, timing)
+        self._catalog_run(job, timing=timing)
+        self._logger.info(f'Stage timing p50/p95 for PrM {job.prm_id}: '
+                          f'{self._timing_statistics.summary(job.prm_id)}')
+
+        if self._window is not None and not self._is_running[job.prm_id]:
+            self._window.reset_progress([job.prm_id])
+
+
+    def _publish_failure(self, job, stage):
+        '''
+        Called on the post-processing thread when a run could not be processed.
+        If the results of the run were not sent to EPICS yet, an error code
+        is sent as the lifetime, so that EPICS does not keep the previous one.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+            stage (str): The stage that failed.
+        '''
+        if stage not in UNPUBLISHED_STAGES:
+            return
+
+        job.meas = dict(FAILED_MEAS)
+        try:
+            self.output_to_epics(job.prm_id, job.data['hv_readings'], job.meas)
+        except (KeyError, TypeError, ValueError) as err:
+            self._logger.error(f'Cannot send the failure of run {job.run_number} '
+                               f'of PrM {job.prm_id} to EPICS: {err}')
+
+
+    def _post_processing_failed(self, job, stage):
+        '''
+        Called on the GUI thread when a run could not be processed.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+            stage (str): The stage that failed.
+        '''
+        self._logger.error(f'Post-processing of run {job.run_number} of PrM {job.prm_id} '
+                           f'failed at stage {stage}.')
+
+        if job.meas is not None:
+            self._meas[job.prm_id] = job.meas
+        self._catalog_run(job, status=f'failed_{stage.lower()}')
+
+        if self._window is not None and not self._is_running[job.prm_id]:
+            self._window.reset_progress([job.prm_id], name=f'{stage} failed!', color='#B22222') # firebrick
+            QTimer.singleShot(3000, lambda: self._window.reset_progress([job.prm_id]))
+
+
+    @staticmethod
+    def _run_timing(job):
+        '''
+        Returns the time spent in every stage of a run, from the
+        start of the measurement to the end of the post-processing.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+
+        Returns:
+            dict: The times (in seconds) keyed by stage.
+        '''
+        timing = dict(job.data['timing'])
+        timing['capture_total'] = timing.pop('total')
+        timing['post_processing_queue'] = job.start_time - job.submit_time
+        timing.update((name, duration) for name, duration in job.timer.breakdown().items()
+                      if name != 'total')
+        timing['post_processing_total'] = sum(job.stage_times.values())
+        return timing
+
+
+    def _adapt_cadence(self, job):
+        '''
+        Adds a processed run to the adaptive cadence and, if enabled,
+        sets the interval of its PrM in automatic mode.
+
+        Args:
+            job (PostProcessingJob): The post-processing job.
+        '''
+        timing = job.data['timing']
+        hv_on_time = (timing['total'] - sum(timing.get(stage, 0) for stage in HV_OFF_STAGES)
+                      + self._hv_off_delay)
+        self._cadence.add_measurement(job.prm_id, job.data['time'].timestamp(), job.meas, hv_on_time)
+
+        # A bound PrM is scheduled with the PrM it is bound to
+        prm_id = self._bound_prms.get(job.prm_id, job.prm_id)
+
+        if not self._adaptive_cadence or self._mode[prm_id] != 'auto':
+            return
+
+        self._cadence.next_interval(job.prm_id, self._base_interval[prm_id])
+
+        # Run as often as the least stable of the PrMs measured together needs
+        intervals = [self._cadence.interval(p_id) for p_id in self._measured_together(prm_id)]
+        self._time_interval[prm_id] = self._scheduler.set_interval(prm_id, min(i for i in intervals if i is not None))
+
+        if self._window is not None:
+            self._window.set_interval(prm_id, self._time_interval[prm_id])
 
-        self._logger.info(f'Data saved for PrM {prm_id}.')
 
     #pylint: disable=invalid-name
-    def output_to_epics(self, prm_id):
+    def output_to_epics(self, prm_id, epics_data, meas):
         '''
         Updates EPICS with run data.
 
         Args:
             prm_id (int): The purity monitor ID.
+            epics_data (dict): The HV readings, keyed by item and quantity.
+            meas (dict): The analysis results (None if the analysis did not run,
+                         the signal and its timestamp are then not updated).
         '''
         if prm_id == 1:
             prm = 'tpclong'
@@ -740,17 +1491,17 @@ class PrMManager():
         res = []
 
         for item in ['cathode', 'anodegrid', 'anode']:
-            res.append(epics.caput(f'sbnd_prm_{prm}_hv/{item}_voltage', self._epics_data[item]['voltage']))
-            res.append(epics.caput(f'sbnd_prm_{prm}_hv/{item}_current', self._epics_data[item]['current']))
-            res.append(epics.caput(f'sbnd_prm_{prm}_hv/{item}_temperature', self._epics_data[item]['temperature']))
-
-        print('--->prm id ',prm_id, '->', self._meas[prm_id])
-        res.append(epics.caput(f'sbnd_prm_{prm}_signal/drift_time', self._meas[prm_id]['td']))
-        res.append(epics.caput(f'sbnd_prm_{prm}_signal/lifetime', self._meas[prm_id]['tau']))
-        res.append(epics.caput(f'sbnd_prm_{prm}_signal/QA', self._meas[prm_id]['qa']))
-        res.append(epics.caput(f'sbnd_prm_{prm}_signal/QC', self._meas[prm_id]['qc']))
-
-        res.append(epics.caput(f'sbnd_prm_{prm}_signal/timestamp', int(time.time() * 1e3)))
+            res.append(epics.caput(f'sbnd_prm_{prm}_hv/{item}_voltage', epics_data[item]['voltage']))
+            res.append(epics.caput(f'sbnd_prm_{prm}_hv/{item}_current', epics_data[item]['current']))
+            res.append(epics.caput(f'sbnd_prm_{prm}_hv/{item}_temperature', epics_data[item]['temperature']))
+
+        self._logger.debug(f'Sending to EPICS for PrM {prm_id}: {meas}')
+        if meas is not None:
+            res.append(epics.caput(f'sbnd_prm_{prm}_signal/drift_time', meas['td']))
+            res.append(epics.caput(f'sbnd_prm_{prm}_signal/lifetime', meas['tau']))
+            res.append(epics.caput(f'sbnd_prm_{prm}_signal/QA', meas['qa']))
+            res.append(epics.caput(f'sbnd_prm_{prm}_signal/QC', meas['qc']))
+            res.append(epics.caput(f'sbnd_prm_{prm}_signal/timestamp', int(time.time() * 1e3)))
 
         if all(res):
             self._logger.info(f'All EPICS updates successful for PrM {prm_id}')
@@ -759,8 +1510,6 @@ class PrMManager():
         else:
             self._logger.info(f'All EPICS updates failed for PrM {prm_id}')
 
-        self._epics_data = {}
-
     def set_comment(self, comment):
         '''
         Sets a comment that will appear in the output file
@@ -777,32 +1526,43 @@ class PrMManager():
 
     def start_prm(self, prm_id=1):
         '''
-        Starts the thread for running prm_id.
+        Queues a run of prm_id, that starts as soon as the resources it
+        needs are free.
 
         Args:
             prm_id (int): The purity monitor ID.
         '''
         print(f'Starting PrM {prm_id}')
 
+        self._scheduler.request(prm_id)
+
+
+    def _start_scheduled(self, prm_id):
+        '''
+        Called by the scheduler to start the run of prm_id.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+        '''
         if self._inhibit_run[prm_id]:
             self._logger.info(f'Run for PrM {prm_id} is inhibited.')
+            self._scheduler.finished(prm_id)
             return
 
-        if self._window is not None:
-            # Start a thread where we let the digitizer run
-            print(f'Starting thread for {prm_id}')
-            self.start_thread(prm_id)
-        else:
-            self.capture_data(prm_id)
+        # Start a thread where we let the digitizer run
+        print(f'Starting thread for {prm_id}')
+        self.start_thread(prm_id)
 
 
     def stop_prm(self, prm_id=1):
         '''
-        Not implemented.
+        Removes the queued run of prm_id, if any. A run already
+        started is not interrupted.
 
         Args:
             prm_id (int): The purity monitor ID.
         '''
+        self._scheduler.cancel(prm_id)
 
 
     def hv_on(self, prm_id=1):
@@ -812,6 +1572,11 @@ class PrMManager():
         Args:
             prm_id (int): The purity monitor ID.
         '''
+        # Do not let a pending ramp-down turn it off again
+        _, abort = self._pending_hv_off.get(prm_id, (None, None))
+        if abort is not None:
+            abort.set()
+
         self._hv_control.hv_on(prm_id)
         self._hv_on = True
 
@@ -849,42 +1614,62 @@ class PrMManager():
         self._logger.info(f'Setting mode to: {self._mode[prm_id]}')
 
         if self._mode[prm_id] == 'auto':
-            self._window.set_start_button_status(prm_id, False)
             self.periodic_start_prm(prm_id)
         elif self._mode[prm_id] == 'manual':
-            self._timer[prm_id].stop()
-
-            # Wait until we have done running
-            while self._is_running[prm_id]:
-                time.sleep(0.1)
+            # A run already started completes, a queued automatic one is dropped
+            self._scheduler.stop_periodic(prm_id)
 
-            self._window.set_start_button_status(prm_id, True)
+            if self._window is not None:
+                self._window.set_start_button_status(prm_id, True)
 
     def set_interval(self, prm_id, interval):
         '''
-        Sets the time interval to use in automatic mode.
-        Time interval cannot be less than 60 seconds, and if so,
-        it will be set to 300 seconds.
+        Sets the time interval to use in automatic mode. It cannot be
+        less than the scheduler min_interval, and if so, it is set to it.
 
         Args:
             prm_id (int): The purity monitor ID.
-            interval (int): The time interval in minutes.
+            interval (int): The time interval in seconds.
         '''
-        self._time_interval[prm_id] = max(interval, 300)
+        self._time_interval[prm_id] = self._scheduler.set_interval(prm_id, interval)
+        self._base_interval[prm_id] = self._time_interval[prm_id]
+
+        # The adaptive cadence starts again from this interval
+        for p_id in self._measured_together(prm_id):
+            self._cadence.reset(p_id, self._base_interval[prm_id])
+
         self._logger.info(f'Time interval set to {self._time_interval[prm_id]} for PrM {prm_id}.')
 
 
     def remaining_time(self, prm_id):
         '''
-        Returns the remaining time on the timer
+        Returns the predicted time (in ms) until the next run of prm_id starts
 
         Args:
             prm_id (int): The purity monitor ID.
         '''
-        if self._timer[prm_id].isActive():
-            return self._timer[prm_id].remainingTime()
+        remaining = self._scheduler.predicted_start(prm_id)
+        if remaining is None:
+            return 0
+
+        return remaining * 1e3
+
+
+    def is_queued(self, prm_id):
+        '''
+        Returns True if a run of prm_id is waiting for resources to start
+        '''
+        return self._scheduler.is_queued(prm_id)
+
+
+    def get_queue_state(self):
+        '''
+        Returns the state of the scheduled runs, with their predicted start times.
 
-        return 0
+        Returns:
+            list: One dict per PrM (see MeasurementScheduler.queue_state).
+        '''
+        return self._scheduler.queue_state()
 
 
     def remaining_time_to_elog(self):
@@ -909,21 +1694,23 @@ class PrMManager():
 
     def periodic_start_prm(self, prm_id=1):
         '''
-        Starts purity monitor prm_id every time_interval seconds.
-        Time interval cannot be less than 60 seconds, and if so,
-        it will be set to 300 seconds.
+        Starts purity monitor prm_id every time_interval seconds,
+        the first time one interval from now.
 
         Args:
             prm_id (int): The purity monitor ID.
         '''
         print(f'periodic_start_prm {prm_id}')
-        time_interval = self._time_interval[prm_id]
 
-        self._window.set_start_button_status(prm_id, False)
+        if self._window is not None:
+            self._window.set_start_button_status(prm_id, False)
+
+        # Starts again from the interval set by the operator
+        self._time_interval[prm_id] = self._scheduler.set_periodic(prm_id, self._base_interval[prm_id])
+        self._base_interval[prm_id] = self._time_interval[prm_id]
 
-        self._timer[prm_id] = QTimer()
-        self._timer[prm_id].timeout.connect(lambda: self.start_prm(prm_id))
-        self._timer[prm_id].start(time_interval * 1000)
+        for p_id in self._measured_together(prm_id):
+            self._cadence.reset(p_id, self._base_interval[prm_id])
 
 
     def get_data(self, prm_id):
@@ -938,6 +1725,71 @@ class PrMManager():
         '''
         return self._data[prm_id]
 
+    def get_upload_statistics(self):
+        '''
+        Returns the state of the uploads (see UploadService.statistics),
+        or None if the data is not uploaded.
+        '''
+        if self._upload_service is None:
+            return None
+        statistics = self._upload_service.statistics()
+        statistics['kerberos'] = self._credentials.statistics()
+        if self._run_bundler is not None:
+            statistics['bundles'] = self._run_bundler.statistics()
+        return statistics
+
+    def get_timing_statistics(self, prm_id):
+        '''
+        Returns the percentiles of the time spent in the stages
+        of the latest runs of a PrM (see TimingStatistics.percentiles).
+
+        Args:
+            prm_id (int): The purity monitor ID.
+        '''
+        return self._timing_statistics.percentiles(prm_id)
+
+    def get_timing(self, prm_id):
+        '''
+        Returns the time spent in every stage of the latest measurement.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+
+        Returns:
+            dict: The times (in seconds) keyed by stage, or None.
+        '''
+        if self._data[prm_id] is None:
+            return None
+        return self._data[prm_id].get('timing')
+
+    def get_latest_measurement(self, prm_id):
+        '''
+        Returns the results of the latest analysed run of prm_id.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+
+        Returns:
+            dict: The results (date, HV, td, qa, qc, tau and errors), or None.
+        '''
+        return self._meas[prm_id]
+
+
+    def get_mode(self, prm_id):
+        '''
+        Returns the mode (auto, manual) of prm_id.
+        '''
+        return self._mode[prm_id]
+
+
+    def get_interval(self, prm_id):
+        '''
+        Returns the interval (in seconds) of prm_id in automatic mode
+        (the one used, adapted if the adaptive cadence is enabled).
+        '''
+        return self._time_interval[prm_id]
+
+
     def get_latest_lifetime(self, prm_id):
         '''
         Returns the Qa, Qc, tau from the latest data.
@@ -0,0 +1,220 @@
+'''
+Contains the store of the purity measurements, an SQLite database
+'''
+import os
+import time
+import logging
+import datetime
+
+import pandas as pd
+
+from sbndprmdaq.sqlite_store import SQLiteStore, to_sql_value
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prm_id INTEGER NOT NULL,
+    time REAL NOT NULL,
+    date TEXT NOT NULL,
+    run_number INTEGER,
+    drifttime REAL,
+    lifetime REAL,
+    qa REAL,
+    qc REAL,
+    qa_err REAL,
+    qc_err REAL,
+    tau_err REAL,
+    hv_c REAL,
+    hv_ag REAL,
+    hv_a REAL
+);
+
+CREATE INDEX IF NOT EXISTS measurements_prm_time ON measurements (prm_id, time);
+CREATE INDEX IF NOT EXISTS measurements_time ON measurements (time);
+
+CREATE TABLE IF NOT EXISTS imports (
+    file_name TEXT PRIMARY KEY,
+    import_time REAL NOT NULL,
+    n_measurements INTEGER NOT NULL
+);
+'''
+
+# The values stored, as named in the CSV dataframe
+COLUMNS = ['prm_id', 'date', 'run_number', 'drifttime', 'lifetime', 'qa', 'qc',
+           'qa_err', 'qc_err', 'tau_err', 'hv_c', 'hv_ag', 'hv_a']
+
+# The names of the analysis results, as named in the dataframe
+RENAMES = {
+    'td': 'drifttime',
+    'tau': 'lifetime',
+    'v_c': 'hv_c',
+    'v_ag': 'hv_ag',
+    'v_a': 'hv_a',
+}
+
+INSERT = (f'INSERT INTO measurements (time, {", ".join(COLUMNS)}) '
+          f'VALUES ({", ".join("?" * (len(COLUMNS) + 1))})')
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _parse_date(date):
+    '''
+    Returns the datetime of a measurement date, as saved by the
+    manager (eg. 20240324-101010) or in the CSV dataframe.
+    '''
+    if isinstance(date, datetime.datetime):
+        return date
+    try:
+        return datetime.datetime.strptime(date, '%Y%m%d-%H%M%S')
+    except ValueError:
+        return pd.to_datetime(date).to_pydatetime()
+
+
+class MeasurementStore(SQLiteStore):
+    '''
+    The purity measurements (lifetime, charges, drift time and HV) of all
+    PrMs. Measurements are only appended, and are indexed by PrM and time,
+    so that adding one or reading a time range does not depend on the
+    size of the history
+    (see SQLiteStore).
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Contructor.
+
+        Args:
+            file_name (str): The database file, created if it does not exist.
+        '''
+        self._logger = logging.getLogger(__name__)
+        super().__init__(file_name, SCHEMA)
+
+    def append(self, measurement, prm_id=None, run_number=None):
+        '''
+        Adds a measurement.
+
+        Args:
+            measurement (dict): The analysis results (date, td, tau, qa, qc,
+                                v_c, v_ag, v_a and the errors), or a dataframe row.
+            prm_id (int): The purity monitor ID (measurement['prm_id'] if None).
+            run_number (int): The run number, if known.
+        '''
+        with self._connection() as connection:
+            connection.execute(INSERT, self._to_row(measurement, prm_id, run_number))
+
+    def _to_row(self, measurement, prm_id=None, run_number=None):
+        '''
+        Converts a measurement to the values of the columns.
+        '''
+        values = {RENAMES.get(key, key): value for key, value in measurement.items()}
+        if prm_id is not None:
+            values['prm_id'] = prm_id
+        if run_number is not None:
+            values['run_number'] = run_number
+
+        date = _parse_date(values['date']) if values.get('date') is not None else datetime.datetime.now()
+        values['date'] = date.strftime(DATE_FORMAT)
+
+        return [date.timestamp()] + [to_sql_value(values.get(column)) for column in COLUMNS]
+
+    def query(self, prm_ids=None, since=None, until=None):
+        '''
+        Returns the measurements in a time range, oldest first.
+
+        Args:
+            prm_ids (list): Only the measurements of these PrMs (all if None).
+            since (datetime): Measurements from this time.
+            until (datetime): Measurements before this time.
+
+        Returns:
+            DataFrame: The measurements, with the columns of the CSV
+                       dataframe, and the date as a datetime.
+        '''
+        conditions, values = [], []
+        if prm_ids is not None:
+            conditions.append(f'prm_id IN ({", ".join("?" * len(prm_ids))})')
+            values += list(prm_ids)
+        for operator, value in [('>=', since), ('<', until)]:
+            if value is not None:
+                conditions.append(f'time {operator} ?')
+                values.append(value.timestamp())
+
+        query = f'SELECT {", ".join(COLUMNS)} FROM measurements'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY time'
+
+        df = pd.read_sql_query(query, self._connection(), params=values)
+        df['date'] = pd.to_datetime(df['date'], format=DATE_FORMAT)
+        return df
+
+    def count(self, prm_id=None, since=None):
+        '''
+        Returns the number of measurements.
+
+        Args:
+            prm_id (int): Only the measurements of this PrM (all if None).
+            since (datetime): Only the measurements from this time.
+        '''
+        conditions, values = [], []
+        if prm_id is not None:
+            conditions.append('prm_id = ?')
+            values.append(prm_id)
+        if since is not None:
+            conditions.append('time >= ?')
+            values.append(since.timestamp())
+
+        query = 'SELECT COUNT(*) FROM measurements'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        return self._connection().execute(query, values).fetchone()[0]
+
+    def import_csv(self, file_name):
+        '''
+        Imports the measurements of a CSV dataframe (prm_measurements.csv),
+        once: a file already imported is skipped.
+
+        Args:
+            file_name (str): The CSV file.
+
+        Returns:
+            int: The number of measurements imported.
+        '''
+        file_name = os.path.abspath(file_name)
+
+        connection = self._connection()
+        if connection.execute('SELECT 1 FROM imports WHERE file_name = ?', (file_name,)).fetchone():
+            self._logger.info(f'{file_name} was already imported.')
+            return 0
+
+        df = pd.read_csv(file_name)
+        df = df.drop(columns=[column for column in df.columns if column.startswith('Unnamed')])
+
+        rows = [self._to_row(measurement) for measurement in df.to_dict('records')
+                if not pd.isna(measurement.get('date')) and not pd.isna(measurement.get('prm_id'))]
+
+        with connection:
+            connection.executemany(INSERT, rows)
+            connection.execute('INSERT INTO imports VALUES (?, ?, ?)', (file_name, time.time(), len(rows)))
+
+        self._logger.info(f'Imported {len(rows)} measurements from {file_name}.')
+        return len(rows)
+
+    def export_csv(self, file_name, prm_ids=None, since=None, until=None):
+        '''
+        Writes the measurements to a CSV file, with the columns of
+        the former dataframe (prm_measurements.csv).
+
+        Args:
+            file_name (str): The CSV file.
+            prm_ids (list): Only the measurements of these PrMs (all if None).
+            since (datetime): Measurements from this time.
+            until (datetime): Measurements before this time.
+
+        Returns:
+            int: The number of measurements exported.
+        '''
+        df = self.query(prm_ids=prm_ids, since=since, until=until)
+        df.to_csv(file_name, index=False)
+        return len(df)
@@ -30,20 +30,7 @@ class MockPrMManager(PrMManager):
     def exit(self):
         pass
 
-    #pylint: disable=duplicate-code
-    def _thread_data(self, data):
+    def output_to_epics(self, prm_id, epics_data, meas):
         '''
-        Remove output_to_epics call for testing
+        Remove output to EPICS for testing
         '''
-        self._logger.info(f'Got data for PrM {data["prm_id"]}.')
-
-        if data['status']:
-            self._data[data['prm_id']] = {
-                'A': data['A'],
-                'B': data['B'],
-                'time': data['time'],
-            }
-            self.save_data(data['prm_id'])
-            self._logger.info(f'Saved data for PrM {data["prm_id"]}.')
-        else:
-            self._logger.info(f'Bad capture, no data to save for PrM {data["prm_id"]}.')
@@ -0,0 +1,235 @@
+'''
+Contains the classes to process the runs after they are taken,
+off the GUI thread
+'''
+import time
+import logging
+import threading
+import traceback
+import collections
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from sbndprmdaq.timing import StageTimer
+
+
+#pylint: disable=too-many-instance-attributes,too-few-public-methods
+class PostProcessingJob:
+    '''
+    The processing of one run. It carries everything the stages need,
+    collected when the job is submitted, and what the stages produce.
+    '''
+
+    #pylint: disable=too-many-arguments
+    def __init__(self, prm_id, data, run_number, comment, configs=None):
+        '''
+        Contructor.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            data (dict): The data of the run (waveforms, time, timing).
+            run_number (int): The run number.
+            comment (str): The run comment.
+            configs (dict): The extra configuration values from the GUI.
+        '''
+        self.prm_id = prm_id
+        self.data = data
+        self.run_number = run_number
+        self.comment = comment
+        self.configs = configs
+
+        self.timestr = time.strftime("%Y%m%d-%H%M%S")
+        self.submit_time = time.monotonic()
+        self.start_time = None
+
+        # Filled by the stages
+        self.out_dict = {}
+        self.run_name = None
+        self.saved_files = []
+        self.meas = None
+        self.epics_data = {}
+        self.stage_times = {}
+        self.timer = StageTimer() # Finer steps, timed by the stages
+
+
+class PostProcessor(QObject):
+    '''
+    Runs the post-processing jobs through a list of stages, on worker threads.
+    The jobs of a PrM are processed one at a time, in the order they were
+    submitted, while the jobs of different PrMs run in parallel. Progress
+    is reported through Qt signals, so that slots connected from the GUI
+    run on the GUI thread.
+
+    A submitted job is always queued, so a captured run is never lost:
+    the queue size only limits when new data can be taken (see
+    wait_for_capacity).
+    '''
+
+    progress = pyqtSignal(int, str, int) # prm_id, stage, percentage
+    job_done = pyqtSignal(object) # job
+    job_failed = pyqtSignal(object, str) # job, stage
+
+    def __init__(self, stages, n_workers=1, max_queue_size=8):
+        '''
+        Contructor.
+
+        Args:
+            stages (list): The (name, function) stages, each function taking the job.
+            n_workers (int): The number of worker threads.
+            max_queue_size (int): The number of jobs waiting above which no new data is taken.
+        '''
+        super().__init__()
+
+        self._logger = logging.getLogger(__name__)
+
+        self._stages = stages
+        self._n_workers = n_workers
+        self._max_queue_size = max_queue_size
+        self._workers = []
+
+        # The jobs waiting, and the PrMs with a job being processed
+        self._jobs = collections.deque()
+        self._busy_prm_ids = set()
+        self._stopping = False
+        self._condition = threading.Condition()
+
+    def start(self):
+        '''
+        Starts the worker threads.
+        '''
+        with self._condition:
+            self._stopping = False
+
+        for i in range(self._n_workers):
+            worker = threading.Thread(target=self._run, name=f'PostProcessor-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, wait=True):
+        '''
+        Stops the worker threads once the queued jobs are processed.
+
+        Args:
+            wait (bool): If True, waits for the workers to finish.
+        '''
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+        self._workers = []
+
+    def submit(self, job):
+        '''
+        Queues a job for processing. The job is queued even if the queue is
+        full (the data is already taken), it does not block.
+
+        Args:
+            job (PostProcessingJob): The job.
+
+        Returns:
+            bool: True (the job is always queued).
+        '''
+        with self._condition:
+            self._jobs.append(job)
+            n_queued = len(self._jobs)
+            self._condition.notify_all()
+
+        if n_queued > self._max_queue_size:
+            self._logger.warning(f'Post-processing queue is over its size ({n_queued} '
+                                 f'> {self._max_queue_size}), run {job.run_number} of '
+                                 f'PrM {job.prm_id} is queued anyway.')
+
+        self._logger.info(f'Queued run {job.run_number} of PrM {job.prm_id} '
+                          f'for post-processing ({n_queued} in queue).')
+        return True
+
+    def wait_for_capacity(self, timeout=None):
+        '''
+        Waits until the queue can take another job.
+
+        Args:
+            timeout (float): Max time to wait (in seconds).
+
+        Returns:
+            bool: True if the queue can take another job.
+        '''
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._jobs) < self._max_queue_size,
+                                            timeout=timeout)
+
+    def n_pending(self):
+        '''
+        Returns the number of jobs queued or being processed.
+        '''
+        with self._condition:
+            return len(self._jobs) + len(self._busy_prm_ids)
+
+    def process(self, job):
+        '''
+        Runs a job through all the stages, in the calling thread.
+
+        Args:
+            job (PostProcessingJob): The job.
+
+        Returns:
+            bool: True if all stages succeeded.
+        '''
+        job.start_time = time.monotonic()
+
+        for i, (name, stage) in enumerate(self._stages):
+            self.progress.emit(job.prm_id, name, int(i / len(self._stages) * 100))
+
+            start = time.monotonic()
+            try:
+                stage(job)
+            except Exception: #pylint: disable=broad-exception-caught
+                self._logger.error(f'Post-processing stage {name} failed for run {job.run_number} '
+                                   f'of PrM {job.prm_id}:\n{traceback.format_exc()}')
+                self.job_failed.emit(job, name)
+                return False
+            finally:
+                job.stage_times[name] = time.monotonic() - start
+
+        self.progress.emit(job.prm_id, 'Processed', 100)
+        self.job_done.emit(job)
+        return True
+
+    def _next_job(self):
+        '''
+        Waits for the oldest job of a PrM without a job being processed.
+
+        Returns:
+            PostProcessingJob: The job, None once stopped and there are no jobs left.
+        '''
+        def ready():
+            return next((job for job in self._jobs if job.prm_id not in self._busy_prm_ids), None)
+
+        with self._condition:
+            self._condition.wait_for(lambda: ready() is not None or (self._stopping and not self._jobs))
+
+            job = ready()
+            if job is not None:
+                self._jobs.remove(job)
+                self._busy_prm_ids.add(job.prm_id)
+                self._condition.notify_all()
+            return job
+
+    def _run(self):
+        '''
+        Processes jobs until stopped.
+        '''
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            try:
+                self.process(job)
+            finally:
+                with self._condition:
+                    self._busy_prm_ids.discard(job.prm_id)
+                    self._condition.notify_all()
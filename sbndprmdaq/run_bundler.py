@@ -0,0 +1,397 @@
+'''
+Contains the classes to bundle the run files into archives, and to read them
+'''
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+import zipfile
+
+# The name of the index in the bundles
+INDEX_NAME = 'index.json'
+
+# How the bundles are split in time (the format of the period in their name)
+PERIODS = {
+    'daily': '%Y%m%d',
+    'hourly': '%Y%m%d_%H',
+}
+
+# Files already compressed, stored as they are
+STORED_EXTENSIONS = ('.h5', '.png')
+
+
+#pylint: disable=too-many-instance-attributes
+class RunBundler:
+    '''
+    Packs the files of the completed runs into one zip archive per period
+    (day or hour), so that a few large files are uploaded instead of many
+    small ones. The runs are appended to the bundle of the current period,
+    written with a .part suffix, with an index of its runs and their files
+    next to it. Once the period is over (checked on a background thread,
+    and at every new run), the index is added to the archive, the archive
+    is renamed, and given to the upload service. A bundle left unfinished
+    when the DAQ stops is continued (or finished, if its period is over)
+    when it starts. If a bundle cannot be written, the files of its runs
+    are uploaded one by one instead.
+    '''
+
+    def __init__(self, config, upload_service=None):
+        '''
+        Contructor.
+
+        Args:
+            config (dict): The overall configuration.
+            upload_service (UploadService): Uploads the finished bundles (not uploaded if None).
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        bundler_config = config.get('run_bundler', {})
+
+        period = bundler_config.get('period', 'daily')
+        if period not in PERIODS:
+            raise ValueError(f'Unknown bundle period {period}, must be one of {list(PERIODS)}.')
+        self._period_format = PERIODS[period]
+        self._compression_level = bundler_config.get('compression_level', 6)
+        self._check_interval = bundler_config.get('check_interval', 60)
+
+        self._bundle_dir = bundler_config.get('bundle_dir')
+        if self._bundle_dir is None:
+            self._bundle_dir = os.path.join(config['data_files_path'], 'bundles')
+        os.makedirs(self._bundle_dir, exist_ok=True)
+
+        self._upload_service = upload_service
+
+        # Held while a bundle is written
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._bundled_runs = 0
+        self._bundled_bytes = 0
+        self._finished_bundles = 0
+        self._failed_bundles = 0
+        self._last_bundle = None
+
+    def start(self):
+        '''
+        Starts finishing the bundles in the background, as their periods end.
+        '''
+        if self._thread is not None:
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._roll_loop, name='run-bundler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the background thread. The current bundle is not finished,
+        it is continued when the bundler starts again.
+        '''
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _roll_loop(self):
+        '''
+        Finishes the bundles of the periods that are over, until stopped.
+        '''
+        while not self._stop_event.is_set():
+            self.roll()
+            self._stop_event.wait(self._check_interval)
+
+    def bundle_name(self, now=None):
+        '''
+        Returns the name of the bundle of a time.
+
+        Args:
+            now (float): The time (seconds since the epoch), now if None.
+
+        Returns:
+            str: The full path of the bundle.
+        '''
+        now = now if now is not None else time.time()
+        period = datetime.datetime.fromtimestamp(now).strftime(self._period_format)
+        return os.path.join(self._bundle_dir, f'sbnd_prm_runs_{period}.zip')
+
+    def add_run(self, run_name, files, now=None, **metadata):
+        '''
+        Appends the files of a run to the bundle of the current period.
+
+        Args:
+            run_name (str): The name of the run, the folder of its files in the bundle.
+            files (list): The full paths of the files of the run.
+            now (float): The time of the run (seconds since the epoch), now if None.
+            metadata: Stored in the index with the run (eg. prm_id, run_number).
+
+        Returns:
+            str: The bundle (without the .part suffix), None if the run
+                 could not be added (its files are then uploaded one by one).
+        '''
+        now = now if now is not None else time.time()
+        bundle = self.bundle_name(now)
+
+        files = [file_name for file_name in files if os.path.isfile(file_name)]
+
+        with self._lock:
+            self._roll(now)
+
+            try:
+                index = _read_index(bundle + '.part.json')
+                with zipfile.ZipFile(bundle + '.part', 'a') as archive:
+                    _check_members(archive, index)
+                    for file_name in files:
+                        member = run_name + '/' + os.path.basename(file_name)
+                        archive.write(file_name, member, **self._compression(file_name))
+
+                # The local files are kept, to upload them if the bundle cannot be finished
+                index['runs'][run_name] = dict(metadata, added=now,
+                                               files=[os.path.basename(f) for f in files],
+                                               local_files=files)
+                _write_index(bundle + '.part.json', index)
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                self._logger.critical(f'Cannot add run {run_name} to {os.path.basename(bundle)}: {e}. '
+                                      'Its files are uploaded one by one.')
+                self._upload_files(files)
+                return None
+
+            self._bundled_runs += 1
+            self._bundled_bytes += sum(os.path.getsize(f) for f in files)
+
+        self._logger.info(f'Run {run_name} added to {os.path.basename(bundle)}.')
+        return bundle
+
+    def _upload_files(self, files):
+        '''
+        Uploads files one by one, as without bundles.
+        '''
+        if self._upload_service is not None:
+            self._upload_service.submit([f for f in files if os.path.isfile(f)])
+
+    def _compression(self, file_name):
+        '''
+        Returns the zip compression of a file.
+        '''
+        if file_name.endswith(STORED_EXTENSIONS):
+            return {'compress_type': zipfile.ZIP_STORED}
+        return {'compress_type': zipfile.ZIP_DEFLATED, 'compresslevel': self._compression_level}
+
+    def roll(self, now=None):
+        '''
+        Finishes the bundles of the periods that are over.
+
+        Args:
+            now (float): The current time (seconds since the epoch), now if None.
+
+        Returns:
+            list: The bundles finished.
+        '''
+        with self._lock:
+            return self._roll(now if now is not None else time.time())
+
+    def _roll(self, now):
+        current = self.bundle_name(now) + '.part'
+
+        finished = []
+        for name in sorted(os.listdir(self._bundle_dir)):
+            part_name = os.path.join(self._bundle_dir, name)
+            if not name.endswith('.zip.part') or part_name == current:
+                continue
+            bundle = part_name[:-len('.part')]
+            try:
+                self._finish(bundle)
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                self._fail(bundle, e)
+                continue
+            finished.append(bundle)
+
+        if finished and self._upload_service is not None:
+            self._upload_service.submit(finished)
+        return finished
+
+    def _finish(self, bundle):
+        '''
+        Adds the index to a bundle, and gives it its final name.
+        '''
+        index = _read_index(bundle + '.part.json')
+        with zipfile.ZipFile(bundle + '.part', 'a') as archive:
+            _check_members(archive, index)
+            archive.writestr(INDEX_NAME, json.dumps(index, indent=1), compress_type=zipfile.ZIP_DEFLATED)
+
+        os.replace(bundle + '.part', bundle)
+        if os.path.exists(bundle + '.part.json'):
+            os.remove(bundle + '.part.json')
+
+        self._finished_bundles += 1
+        self._last_bundle = bundle
+        self._logger.info(f'Bundle {os.path.basename(bundle)} finished, with {len(index["runs"])} runs.')
+
+    def _fail(self, bundle, error):
+        '''
+        Uploads the files of the runs of a bundle that cannot be
+        finished one by one, and keeps the bundle aside as .bad.
+        '''
+        try:
+            index = _read_index(bundle + '.part.json')
+        except (OSError, ValueError):
+            index = {'runs': {}}
+        files = [file_name for run in index['runs'].values() for file_name in run.get('local_files', [])]
+
+        self._logger.critical(f'Cannot finish bundle {os.path.basename(bundle)}: {error}. '
+                              f'The {len(files)} files of its {len(index["runs"])} runs '
+                              'are uploaded one by one.')
+        self._upload_files(files)
+
+        os.replace(bundle + '.part', bundle + '.bad')
+        if os.path.exists(bundle + '.part.json'):
+            os.replace(bundle + '.part.json', bundle + '.bad.json')
+        self._failed_bundles += 1
+
+    def statistics(self):
+        '''
+        Returns the state of the bundles.
+
+        Returns:
+            dict: current_bundle, current_runs (runs in it), bundled_runs,
+                  bundled_bytes (size of the files before compression),
+                  finished_bundles, failed_bundles and last_bundle.
+        '''
+        # Not under the lock, not to wait for a bundle being written
+        current = self.bundle_name()
+        return {
+            'current_bundle': current,
+            'current_runs': len(_read_index(current + '.part.json')['runs']),
+            'bundled_runs': self._bundled_runs,
+            'bundled_bytes': self._bundled_bytes,
+            'finished_bundles': self._finished_bundles,
+            'failed_bundles': self._failed_bundles,
+            'last_bundle': self._last_bundle,
+        }
+
+
+def _check_members(archive, index):
+    '''
+    Checks that the files in the index of a bundle are in the archive
+    (a damaged archive, opened to append, starts as a new empty one).
+    '''
+    names = set(archive.namelist())
+    missing = [run_name + '/' + member for run_name, run in index['runs'].items()
+               for member in run['files'] if run_name + '/' + member not in names]
+    if missing:
+        raise zipfile.BadZipFile(f'{len(missing)} files missing from the archive, eg. {missing[0]}')
+
+
+def _read_index(file_name):
+    '''
+    Reads the index of a bundle, empty if there is none yet.
+    '''
+    if not os.path.exists(file_name):
+        return {'runs': {}}
+    with open(file_name, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _write_index(file_name, index):
+    '''
+    Writes the index of a bundle (atomically).
+    '''
+    with open(file_name + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(index, file, indent=1)
+    os.replace(file_name + '.tmp', file_name)
+
+
+class RunBundle:
+    '''
+    Reads a bundle of runs. A file of a run is read from the archive
+    alone, without extracting the others. The files stored uncompressed
+    (eg. the run files) can be read in place, with seeks: for instance
+    RunFile(bundle.open(run_name, run_name + '.h5')).
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Contructor.
+
+        Args:
+            file_name (str): The bundle (a finished bundle, or one being written).
+        '''
+        self._archive = zipfile.ZipFile(file_name, 'r') #pylint: disable=consider-using-with
+
+        if INDEX_NAME in self._archive.namelist():
+            self.index = json.loads(self._archive.read(INDEX_NAME))
+        elif os.path.exists(file_name + '.json'):
+            self.index = _read_index(file_name + '.json')
+        else:
+            # No index, made from the list of files
+            self.index = {'runs': {}}
+            for name in self._archive.namelist():
+                run_name, _, member = name.partition('/')
+                if member:
+                    self.index['runs'].setdefault(run_name, {'files': []})['files'].append(member)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def runs(self):
+        '''
+        Returns the names of the runs in the bundle.
+        '''
+        return list(self.index['runs'])
+
+    def members(self, run_name):
+        '''
+        Returns the names of the files of a run.
+        '''
+        return list(self.index['runs'][run_name]['files'])
+
+    def find_run(self, prm_id, run_number):
+        '''
+        Returns the name of a run, None if it is not in the bundle.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            run_number (int): The run number.
+        '''
+        for run_name, run in self.index['runs'].items():
+            if run.get('prm_id') == prm_id and run.get('run_number') == run_number:
+                return run_name
+        return None
+
+    def open(self, run_name, member):
+        '''
+        Opens a file of a run.
+
+        Args:
+            run_name (str): The run.
+            member (str): The name of the file.
+
+        Returns:
+            file: The file, opened for reading (binary).
+        '''
+        return self._archive.open(run_name + '/' + member)
+
+    def extract_run(self, run_name, path):
+        '''
+        Extracts the files of a run.
+
+        Args:
+            run_name (str): The run.
+            path (str): Where to extract them (in a folder named after the run).
+
+        Returns:
+            list: The full paths of the files extracted.
+        '''
+        return [self._archive.extract(run_name + '/' + member, path)
+                for member in self.members(run_name)]
+
+    def close(self):
+        '''
+        Closes the bundle.
+        '''
+        self._archive.close()
@@ -0,0 +1,217 @@
+'''
+Contains the catalog of the runs, an SQLite database
+'''
+import json
+import time
+import logging
+
+import numpy as np
+
+from sbndprmdaq.sqlite_store import SQLiteStore, to_sql_value
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS run_numbers (
+    prm_id INTEGER PRIMARY KEY,
+    latest INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS runs (
+    prm_id INTEGER NOT NULL,
+    run_number INTEGER NOT NULL,
+    start_time REAL NOT NULL,
+    status TEXT NOT NULL,
+    date TEXT,
+    comment TEXT,
+    hv_status TEXT,
+    n_records INTEGER,
+    td REAL,
+    qa REAL,
+    qc REAL,
+    tau REAL,
+    qa_err REAL,
+    qc_err REAL,
+    tau_err REAL,
+    files TEXT,
+    hv TEXT,
+    digitizer_config TEXT,
+    timing TEXT,
+    PRIMARY KEY (prm_id, run_number)
+);
+
+CREATE INDEX IF NOT EXISTS runs_prm_time ON runs (prm_id, start_time);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (start_time);
+CREATE INDEX IF NOT EXISTS runs_run_number ON runs (run_number);
+CREATE INDEX IF NOT EXISTS runs_prm_tau ON runs (prm_id, tau);
+'''
+
+# Columns stored as JSON
+JSON_COLUMNS = ['files', 'hv', 'digitizer_config', 'timing']
+
+COLUMNS = ['status', 'date', 'comment', 'hv_status', 'n_records',
+           'td', 'qa', 'qc', 'tau', 'qa_err', 'qc_err', 'tau_err'] + JSON_COLUMNS
+
+
+def _to_json(obj):
+    '''
+    Converts the numpy types json cannot serialize.
+    '''
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f'Cannot serialize {type(obj)}')
+
+
+class RunCatalog(SQLiteStore):
+    '''
+    The catalog of the runs: allocates the run numbers, and keeps the
+    metadata of every run (files, HV, digitizer configuration, analysis
+    results and timing), indexed by PrM, time, run number and lifetime
+    (see SQLiteStore).
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Contructor.
+
+        Args:
+            file_name (str): The database file, created if it does not exist.
+        '''
+        self._logger = logging.getLogger(__name__)
+        super().__init__(file_name, SCHEMA)
+
+    def seed_run_numbers(self, run_numbers):
+        '''
+        Makes sure the next run numbers come after the given ones
+        (eg. from latest_run_number.txt).
+
+        Args:
+            run_numbers (dict): The latest run number, keyed by PrM ID.
+        '''
+        with self._connection() as connection:
+            for prm_id, latest in run_numbers.items():
+                if latest is None:
+                    continue
+                connection.execute('INSERT OR IGNORE INTO run_numbers VALUES (?, ?)', (prm_id, latest))
+                connection.execute('UPDATE run_numbers SET latest = MAX(latest, ?) WHERE prm_id = ?',
+                                   (latest, prm_id))
+
+    def latest_run_numbers(self):
+        '''
+        Returns the latest run number, keyed by PrM ID.
+        '''
+        rows = self._connection().execute('SELECT prm_id, latest FROM run_numbers').fetchall()
+        return {row['prm_id']: row['latest'] for row in rows}
+
+    def allocate_run_number(self, prm_id, after=-1, start_time=None):
+        '''
+        Allocates the next run number of a PrM, and adds the run to the catalog.
+        The allocation is atomic, also across processes.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            after (int): The run number is larger than this one.
+            start_time (float): The time of the run (seconds since the epoch, defaults to now).
+
+        Returns:
+            int: The run number.
+        '''
+        if start_time is None:
+            start_time = time.time()
+
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('INSERT OR IGNORE INTO run_numbers VALUES (?, ?)', (prm_id, after))
+            connection.execute('UPDATE run_numbers SET latest = MAX(latest, ?) + 1 WHERE prm_id = ?',
+                               (after, prm_id))
+            run_number = connection.execute('SELECT latest FROM run_numbers WHERE prm_id = ?',
+                                            (prm_id,)).fetchone()['latest']
+            connection.execute('INSERT INTO runs (prm_id, run_number, start_time, status) VALUES (?, ?, ?, ?)',
+                               (prm_id, run_number, start_time, 'allocated'))
+
+        return run_number
+
+    def update_run(self, prm_id, run_number, **fields):
+        '''
+        Updates the metadata of a run.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            run_number (int): The run number.
+            fields: The columns to update (see COLUMNS).
+        '''
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f'Unknown run catalog columns {sorted(unknown)}.')
+
+        values = [json.dumps(value, default=_to_json) if key in JSON_COLUMNS else value
+                  for key, value in fields.items()]
+        values = [to_sql_value(value) for value in values]
+
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self._connection() as connection:
+            connection.execute(f'UPDATE runs SET {assignments} WHERE prm_id = ? AND run_number = ?',
+                               values + [prm_id, run_number])
+
+    def get_run(self, prm_id, run_number):
+        '''
+        Returns a run, or None if not in the catalog.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            run_number (int): The run number.
+
+        Returns:
+            dict: The run metadata.
+        '''
+        row = self._connection().execute('SELECT * FROM runs WHERE prm_id = ? AND run_number = ?',
+                                         (prm_id, run_number)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    #pylint: disable=too-many-arguments
+    def find_runs(self, prm_id=None, since=None, until=None, tau_min=None, tau_max=None, limit=None):
+        '''
+        Returns the runs matching all the given conditions, latest first.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            since (float): Runs from this time (seconds since the epoch).
+            until (float): Runs before this time (seconds since the epoch).
+            tau_min (float): Runs with a lifetime (in ms) at least this.
+            tau_max (float): Runs with a lifetime (in ms) below this.
+            limit (int): The max number of runs.
+
+        Returns:
+            list: The runs (dicts).
+        '''
+        conditions, values = [], []
+        for column, operator, value in [('prm_id', '=', prm_id),
+                                        ('start_time', '>=', since),
+                                        ('start_time', '<', until),
+                                        ('tau', '>=', tau_min),
+                                        ('tau', '<', tau_max)]:
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                values.append(value)
+
+        query = 'SELECT * FROM runs'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY start_time DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            values.append(limit)
+
+        return [self._to_dict(row) for row in self._connection().execute(query, values)]
+
+    @staticmethod
+    def _to_dict(row):
+        '''
+        Converts a row to a dict, decoding the JSON columns.
+        '''
+        run = dict(row)
+        for key in JSON_COLUMNS:
+            if run[key] is not None:
+                run[key] = json.loads(run[key])
+        return run
@@ -0,0 +1,327 @@
+'''
+Contains the classes to write and read the run files (HDF5)
+'''
+import os
+import json
+import datetime
+
+import numpy as np
+import h5py
+
+from sbndprmdaq.digitizer.sample_encoding import SampleEncoding
+
+PHASES = ('hv_on', 'hv_off')
+
+# The attributes of the records datasets stored as integer samples
+ENCODING_ATTRIBUTES = ('bits_per_sample', 'bit_shift', 'code_zero', 'code_range', 'input_range_volts')
+
+
+def _to_attribute(value):
+    '''
+    Converts a metadata value to something HDF5 can store as an attribute,
+    None if it cannot be stored.
+    '''
+    if value is None:
+        return None
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=str)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (str, bool, int, float, np.generic)):
+        return value
+    return str(value)
+
+
+class RunFileWriter:
+    '''
+    Writes a run to an HDF5 file. For every phase (hv_on, hv_off) and
+    channel, the raw records are in a dataset chunked by record (so that a
+    record, or a range of records, can be read alone), compressed, and
+    extended as records are appended. The records can be stored as the
+    integer samples of the digitizer, with the parameters to convert them
+    to volts (see SampleEncoding), a quarter of the size of float64 volts.
+    The mean and variance waveforms are next to them, and the metadata of
+    the run are attributes of the file.
+
+    The file is written with a .part suffix, and renamed when closed, so
+    a file with the final name is always complete.
+    '''
+
+    def __init__(self, file_name, compression='gzip', compression_opts=4):
+        '''
+        Contructor.
+
+        Args:
+            file_name (str): The run file.
+            compression (str): The HDF5 compression filter (gzip, lzf or None).
+            compression_opts (int): The compression level (gzip only).
+        '''
+        self.file_name = file_name
+        self._compression = compression
+        self._compression_opts = compression_opts if compression == 'gzip' else None
+        self._file = h5py.File(file_name + '.part', 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        self.close(discard=exc_type is not None)
+
+    def _phase(self, phase):
+        if phase not in PHASES:
+            raise ValueError(f'Unknown phase {phase}, must be one of {PHASES}.')
+        return self._file.require_group(phase)
+
+    def append_records(self, phase, batch, encoding=None):
+        '''
+        Appends records at the end of the datasets of a phase.
+
+        Args:
+            phase (str): hv_on or hv_off.
+            batch (WaveformBatch): The records.
+            encoding (SampleEncoding): If set, the records are stored as integer samples.
+        '''
+        if not batch.n_records:
+            return
+
+        group = self._phase(phase)
+        group.attrs['samples_per_second'] = batch.samples_per_second
+        group.attrs['trigger_sample'] = batch.trigger_sample
+
+        for index, channel in enumerate(batch.channels):
+            records = batch.waveforms[index]
+            if encoding is not None:
+                records = encoding.to_samples(records)
+            dataset = self._append(group.require_group(channel), 'records', records,
+                                   chunks=(1, records.shape[1]))
+            if encoding is not None:
+                for name in ENCODING_ATTRIBUTES:
+                    dataset.attrs[name] = getattr(encoding, name)
+        self._append(group, 'timestamps', batch.timestamps, chunks=True)
+
+    def _append(self, group, name, data, chunks):
+        '''
+        Appends data along the first axis of a dataset, made if needed.
+
+        Returns:
+            h5py.Dataset: The dataset.
+        '''
+        if name not in group:
+            group.create_dataset(name,
+                                 shape=(0,) + data.shape[1:],
+                                 maxshape=(None,) + data.shape[1:],
+                                 dtype=data.dtype,
+                                 chunks=chunks,
+                                 compression=self._compression,
+                                 compression_opts=self._compression_opts,
+                                 shuffle=self._compression is not None)
+
+        dataset = group[name]
+        n_records = dataset.shape[0]
+        dataset.resize(n_records + len(data), axis=0)
+        dataset[n_records:] = data
+        return dataset
+
+    def write_summary(self, phase, data):
+        '''
+        Writes the mean and variance waveforms of a phase.
+
+        Args:
+            phase (str): hv_on or hv_off.
+            data (WaveformAccumulator): The accumulated records.
+        '''
+        if data is None or not data.count:
+            return
+
+        group = self._phase(phase)
+        group.attrs['n_records'] = data.count
+        group.attrs['samples_per_second'] = data.samples_per_second
+        group.attrs['trigger_sample'] = data.trigger_sample
+
+        for channel in data.channels:
+            channel_group = group.require_group(channel)
+            channel_group.create_dataset('mean', data=data.mean(channel))
+            channel_group.create_dataset('variance', data=data.variance(channel))
+
+    def set_attributes(self, **metadata):
+        '''
+        Sets metadata of the run. Dicts and lists are stored as json,
+        and None values are not stored.
+        '''
+        for key, value in metadata.items():
+            value = _to_attribute(value)
+            if value is not None:
+                self._file.attrs[key] = value
+
+    def close(self, discard=False):
+        '''
+        Closes the file, and gives it its final name.
+
+        Args:
+            discard (bool): If True, the file is deleted instead.
+        '''
+        if self._file is None:
+            return
+
+        self._file.close()
+        self._file = None
+
+        if discard:
+            os.remove(self.file_name + '.part')
+        else:
+            os.replace(self.file_name + '.part', self.file_name)
+
+
+class RecordsView:
+    '''
+    The records of a channel, read from the file only when indexed
+    (eg. view[10:20]), and converted to float32 volts if they are
+    stored as integer samples.
+    '''
+
+    def __init__(self, dataset):
+        '''
+        Contructor.
+
+        Args:
+            dataset (h5py.Dataset): The records dataset.
+        '''
+        self._dataset = dataset
+        self.encoding = None
+        if 'bits_per_sample' in dataset.attrs:
+            self.encoding = SampleEncoding(**{name: dataset.attrs[name].item()
+                                              for name in ENCODING_ATTRIBUTES})
+
+    @property
+    def shape(self):
+        '''
+        The (record, sample) shape.
+        '''
+        return self._dataset.shape
+
+    def __len__(self):
+        return self._dataset.shape[0]
+
+    def __getitem__(self, key):
+        records = self._dataset[key]
+        if self.encoding is None:
+            return records
+        return self.encoding.to_volts(records)
+
+    def __array__(self, dtype=None, copy=None): #pylint: disable=unused-argument
+        records = self[()]
+        return records if dtype is None else records.astype(dtype)
+
+    def samples(self, key=()):
+        '''
+        Returns the stored values, without conversion.
+        '''
+        return self._dataset[key]
+
+
+class RunFile:
+    '''
+    Reads a run file. Only what is asked for is read from the file:
+    a channel, or a range of records.
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Contructor.
+
+        Args:
+            file_name (str): The run file.
+        '''
+        self._file = h5py.File(file_name, 'r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def attrs(self):
+        '''
+        The metadata of the run.
+        '''
+        return {key: value.item() if isinstance(value, np.generic) else value
+                for key, value in self._file.attrs.items()}
+
+    @property
+    def phases(self):
+        '''
+        The phases in the file (hv_on, hv_off).
+        '''
+        return [phase for phase in PHASES if phase in self._file]
+
+    def channels(self, phase='hv_on'):
+        '''
+        Returns the channels of a phase.
+        '''
+        return [name for name, item in self._file[phase].items() if isinstance(item, h5py.Group)]
+
+    def n_records(self, phase='hv_on'):
+        '''
+        Returns the number of records accumulated in a phase
+        (the records saved can be a subset).
+        '''
+        return int(self._file[phase].attrs.get('n_records', 0))
+
+    def records(self, channel, phase='hv_on', start=None, stop=None):
+        '''
+        Returns the saved records of a channel, in volts (float32 if
+        they are stored as integer samples).
+
+        Args:
+            channel (str): The channel.
+            phase (str): hv_on or hv_off.
+            start (int): The first record.
+            stop (int): The record after the last one.
+
+        Returns:
+            np.ndarray: The (record, sample) waveforms.
+        '''
+        group = self._file[phase][channel]
+        if 'records' not in group:
+            return np.empty((0, 0))
+        return self.records_view(channel, phase)[start:stop]
+
+    def records_view(self, channel, phase='hv_on'):
+        '''
+        Returns the saved records of a channel, without reading them.
+
+        Args:
+            channel (str): The channel.
+            phase (str): hv_on or hv_off.
+
+        Returns:
+            RecordsView: The records, read and converted when indexed.
+        '''
+        return RecordsView(self._file[phase][channel]['records'])
+
+    def timestamps(self, phase='hv_on'):
+        '''
+        Returns the time (seconds since the epoch) of the saved records.
+        '''
+        if 'timestamps' not in self._file[phase]:
+            return np.empty(0)
+        return self._file[phase]['timestamps'][()]
+
+    def mean(self, channel, phase='hv_on'):
+        '''
+        Returns the mean waveform of a channel.
+        '''
+        return self._file[phase][channel]['mean'][()]
+
+    def variance(self, channel, phase='hv_on'):
+        '''
+        Returns the per-sample variance of the waveforms of a channel.
+        '''
+        return self._file[phase][channel]['variance'][()]
+
+    def close(self):
+        '''
+        Closes the file.
+        '''
+        self._file.close()
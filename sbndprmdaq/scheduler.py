@@ -0,0 +1,436 @@
+'''
+Contains the scheduler deciding when the purity monitors take data
+'''
+import time
+import heapq
+import logging
+import itertools
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+def prm_resources(config):
+    '''
+    Returns the resources a measurement of every PrM holds while it runs:
+    the MPOD crates, the digitizer and the flash lamp driver. A PrM bound
+    to another one is measured with it, so both get the resources of both.
+
+    Args:
+        config (dict): The configuration dictionary.
+
+    Returns:
+        dict: The set of resource names, keyed by PrM ID.
+    '''
+    bound_prms = config.get('bound_prms', {})
+
+    def digitizer_of(prm_id):
+        prm_id = bound_prms.get(prm_id, prm_id)
+        digitizer_type = config['prm_id_to_digitizer_type'][prm_id]
+        if digitizer_type == 'ats310':
+            return f"ats310:{config['prm_id_to_ats_systemid'][prm_id]}"
+        # Only one ADPro is supported
+        return digitizer_type
+
+    def own_resources(prm_id):
+        digitizer = digitizer_of(prm_id)
+        # The ADPro drives its own lamp, the ATS310 boards share the Arduino
+        lamp = 'arduino' if digitizer.startswith('ats310') else digitizer
+        return {
+            f"mpod:{config['prm_id_to_mpod_ip'][prm_id]}",
+            f'digitizer:{digitizer}',
+            f'lamp:{lamp}',
+        }
+
+    resources = {prm_id: own_resources(prm_id) for prm_id in config['prm_ids']}
+
+    for bounded_id, main_id in bound_prms.items():
+        resources[main_id] = resources[main_id] | resources[bounded_id]
+        resources[bounded_id] = resources[main_id]
+
+    return resources
+
+
+#pylint: disable=too-few-public-methods
+class MeasurementRequest:
+    '''
+    A measurement waiting to start.
+    '''
+
+    #pylint: disable=too-many-arguments
+    def __init__(self, prm_id, priority, deadline, seq, periodic):
+        '''
+        Contructor.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            priority (int): The priority (lower runs first).
+            deadline (float): The time (monotonic) the measurement should start by, or None.
+            seq (int): Sequence number, keeps the submission order among equals.
+            periodic (bool): True if requested by the automatic mode.
+        '''
+        self.prm_id = prm_id
+        self.priority = priority
+        self.deadline = deadline
+        self.seq = seq
+        self.periodic = periodic
+        self.submit_time = time.monotonic()
+        self.cancelled = False
+
+    def key(self):
+        '''
+        Returns the ordering key: priority, then earliest deadline, then submission order.
+        '''
+        deadline = self.deadline if self.deadline is not None else float('inf')
+        return (self.priority, deadline, self.seq)
+
+    def __lt__(self, other):
+        return self.key() < other.key()
+
+
+#pylint: disable=too-many-instance-attributes
+class MeasurementScheduler(QObject):
+    '''
+    Queues the measurements of all the purity monitors and starts them when
+    the resources they need are free. Measurements that do not share any
+    resource run concurrently. A measurement can keep its resources after
+    it ends, while the HV ramp-down it started is still running. A
+    measurement waiting for a resource reserves it, so that lower priority
+    measurements cannot overtake it on that resource.
+
+    The automatic mode is implemented here too: every PrM in automatic mode
+    is queued once per interval. A single Qt timer drives the scheduler,
+    so everything runs on the thread that owns it (the GUI thread).
+    '''
+
+    queue_changed = pyqtSignal()
+
+    MANUAL_PRIORITY = 0
+    PERIODIC_PRIORITY = 10
+
+    #pylint: disable=too-many-arguments
+    def __init__(self, resources, start_callback, min_interval=300,
+                 expected_duration=120, tick_interval=1):
+        '''
+        Contructor.
+
+        Args:
+            resources (dict): The resources needed by every PrM (see prm_resources).
+            start_callback (fn): Called with the PrM ID to start a measurement.
+            min_interval (float): The minimum interval in automatic mode (in seconds).
+            expected_duration (float): The expected duration of a measurement (in seconds),
+                                       until one has been measured.
+            tick_interval (float): The interval between the scheduler checks (in seconds).
+        '''
+        super().__init__()
+
+        self._logger = logging.getLogger(__name__)
+
+        self._resources = resources
+        self._start_callback = start_callback
+        self._min_interval = min_interval
+        self._default_duration = expected_duration
+
+        self._heap = []
+        self._queued = {}    # prm_id -> MeasurementRequest
+        self._running = {}   # prm_id -> start time (monotonic)
+        self._holding = {}   # prm_id -> future, the resources are held until it is done
+        self._periodic = {}  # prm_id -> [interval, next due time (monotonic)]
+        self._durations = {} # prm_id -> running average of the measurement duration
+        self._seq = itertools.count()
+
+        self._timer = QTimer()
+        self._timer.timeout.connect(self.tick)
+        self._timer.start(int(tick_interval * 1000))
+
+    def stop(self):
+        '''
+        Stops the scheduler.
+        '''
+        self._timer.stop()
+
+    def request(self, prm_id, priority=None, deadline=None, periodic=False):
+        '''
+        Queues a measurement. If the PrM already has one queued, that one is kept,
+        with the highest of the priorities and the earliest of the deadlines.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            priority (int): The priority (lower runs first), defaults to MANUAL_PRIORITY.
+            deadline (float): Seconds from now the measurement should start by (optional).
+            periodic (bool): True if requested by the automatic mode.
+        '''
+        if priority is None:
+            priority = self.MANUAL_PRIORITY
+        if deadline is not None:
+            deadline = time.monotonic() + deadline
+
+        seq = next(self._seq)
+
+        queued = self._queued.get(prm_id)
+        if queued is not None:
+            priority = min(priority, queued.priority)
+            if queued.deadline is not None:
+                deadline = queued.deadline if deadline is None else min(deadline, queued.deadline)
+            periodic = periodic and queued.periodic
+            if (priority, deadline, periodic) == (queued.priority, queued.deadline, queued.periodic):
+                return
+            # Replace it, as the heap cannot reorder an entry
+            queued.cancelled = True
+            seq = queued.seq
+
+        request = MeasurementRequest(prm_id, priority, deadline, seq, periodic)
+        if queued is not None:
+            request.submit_time = queued.submit_time
+        self._queued[prm_id] = request
+        heapq.heappush(self._heap, request)
+
+        self._logger.info(f'Queued measurement of PrM {prm_id} (priority {priority}).')
+        self.queue_changed.emit()
+        self._dispatch()
+
+    def cancel(self, prm_id, periodic_only=False):
+        '''
+        Removes the queued measurement of a PrM, if any.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            periodic_only (bool): If True, only removes it if requested by the automatic mode.
+        '''
+        queued = self._queued.get(prm_id)
+        if queued is None or (periodic_only and not queued.periodic):
+            return
+        queued.cancelled = True
+        del self._queued[prm_id]
+        self.queue_changed.emit()
+
+    def set_periodic(self, prm_id, interval):
+        '''
+        Puts a PrM in automatic mode: one measurement is queued every interval,
+        starting one interval from now.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            interval (float): The interval (in seconds).
+
+        Returns:
+            float: The interval used.
+        '''
+        interval = self._check_interval(prm_id, interval)
+        self._periodic[prm_id] = [interval, time.monotonic() + interval]
+        self.queue_changed.emit()
+        return interval
+
+    def stop_periodic(self, prm_id):
+        '''
+        Takes a PrM out of automatic mode, and removes its queued automatic measurement.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+        '''
+        self._periodic.pop(prm_id, None)
+        self.cancel(prm_id, periodic_only=True)
+
+    def set_interval(self, prm_id, interval):
+        '''
+        Changes the interval of a PrM in automatic mode. The next measurement
+        is due one new interval after the previous one was due.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            interval (float): The interval (in seconds).
+
+        Returns:
+            float: The interval used.
+        '''
+        interval = self._check_interval(prm_id, interval)
+        if prm_id in self._periodic:
+            old_interval, next_due = self._periodic[prm_id]
+            self._periodic[prm_id] = [interval, next_due - old_interval + interval]
+            self.queue_changed.emit()
+        return interval
+
+    def _check_interval(self, prm_id, interval):
+        '''
+        Returns the interval, raised to the minimum interval if needed.
+        '''
+        if interval < self._min_interval:
+            self._logger.warning(f'Interval of {interval} s for PrM {prm_id} is below the minimum, '
+                                 f'using {self._min_interval} s.')
+            return self._min_interval
+        return interval
+
+    def started(self, prm_id):
+        '''
+        Returns True if a measurement of the PrM is running.
+        '''
+        return prm_id in self._running
+
+    def finished(self, prm_id, hold_until=None):
+        '''
+        Tells the scheduler a measurement ended, releasing its resources.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            hold_until (Future): If passed, the resources are held until it is done
+                                 (eg. the HV ramp-down that follows the measurement).
+        '''
+        start = self._running.pop(prm_id, None)
+        if start is None:
+            return
+
+        # Running average of the duration, for the predictions
+        duration = time.monotonic() - start
+        previous = self._durations.get(prm_id)
+        self._durations[prm_id] = duration if previous is None else 0.7 * previous + 0.3 * duration
+
+        if hold_until is not None and not hold_until.done():
+            self._logger.info(f'Holding the resources of PrM {prm_id} until its HV is ramped down.')
+            self._holding[prm_id] = hold_until
+
+        self._dispatch()
+
+    def tick(self):
+        '''
+        Queues the automatic measurements that are due, and starts what can be started.
+        '''
+        now = time.monotonic()
+        for prm_id, periodic in self._periodic.items():
+            interval, next_due = periodic
+            if next_due > now:
+                continue
+            # Should start before the next one is due
+            self.request(prm_id, self.PERIODIC_PRIORITY, deadline=next_due + interval - now, periodic=True)
+            # Do not try to catch up if we fell behind
+            periodic[1] = max(next_due + interval, now)
+
+        self._dispatch()
+
+    def _busy_resources(self):
+        '''
+        Returns the resources held by the running measurements.
+        '''
+        for prm_id, future in list(self._holding.items()):
+            if future.done():
+                del self._holding[prm_id]
+
+        busy = set()
+        for prm_id in list(self._running) + list(self._holding):
+            busy |= self._resources[prm_id]
+        return busy
+
+    def _pending(self):
+        '''
+        Returns the queued requests, in the order they should start.
+        '''
+        self._heap = [request for request in self._heap if not request.cancelled]
+        heapq.heapify(self._heap)
+        return sorted(self._heap)
+
+    def _dispatch(self):
+        '''
+        Starts the queued measurements whose resources are free.
+        '''
+        unavailable = self._busy_resources()
+        started = False
+
+        for request in self._pending():
+            # It may have been started by a measurement run in the callback
+            if request.cancelled:
+                continue
+
+            resources = self._resources[request.prm_id]
+
+            if request.prm_id in self._running or resources & unavailable:
+                # Reserve them, so that it is not overtaken
+                unavailable |= resources
+                continue
+
+            request.cancelled = True
+            del self._queued[request.prm_id]
+
+            now = time.monotonic()
+            if request.deadline is not None and now > request.deadline:
+                self._logger.warning(f'Measurement of PrM {request.prm_id} starts '
+                                     f'{now - request.deadline:.0f} s after its deadline.')
+
+            self._logger.info(f'Starting measurement of PrM {request.prm_id}, '
+                              f'queued for {now - request.submit_time:.0f} s.')
+            self._running[request.prm_id] = now
+            unavailable |= resources
+            started = True
+
+            self._start_callback(request.prm_id)
+
+        if started:
+            self.queue_changed.emit()
+
+    def expected_duration(self, prm_id):
+        '''
+        Returns the expected duration of a measurement of a PrM (in seconds).
+        '''
+        return self._durations.get(prm_id, self._default_duration)
+
+    def queue_state(self):
+        '''
+        Returns the state of all the measurements, running, queued and
+        scheduled (in automatic mode), with their predicted start times.
+        The predictions assume every measurement takes as long as the
+        previous ones of the same PrM did.
+
+        Returns:
+            list: One dict per PrM (prm_id, state, priority, deadline and predicted_start,
+                  the times being in seconds from now), in predicted start order.
+        '''
+        now = time.monotonic()
+        free_at = {}
+        state = []
+
+        def occupy(prm_id, end):
+            for resource in self._resources[prm_id]:
+                free_at[resource] = max(free_at.get(resource, now), end)
+
+        def first_free(prm_id, not_before):
+            return max([not_before] + [free_at.get(resource, now) for resource in self._resources[prm_id]])
+
+        for prm_id in self._holding:
+            occupy(prm_id, now + 1)
+
+        for prm_id, start in self._running.items():
+            # One taking longer than expected is assumed to be about to end
+            occupy(prm_id, max(start + self.expected_duration(prm_id), now + 1))
+            state.append({'prm_id': prm_id, 'state': 'running', 'priority': None,
+                          'deadline': None, 'predicted_start': start - now})
+
+        upcoming = [(request.key(), request.prm_id, 'queued', now, request.priority, request.deadline)
+                    for request in self._pending()]
+        upcoming += [((self.PERIODIC_PRIORITY, next_due + interval, 0), prm_id, 'scheduled',
+                      next_due, self.PERIODIC_PRIORITY, next_due + interval)
+                     for prm_id, (interval, next_due) in self._periodic.items()
+                     if prm_id not in self._queued]
+        # The scheduled ones are predicted in due time order, after what is already queued
+        upcoming.sort(key=lambda item: (item[3], item[0]))
+
+        for _, prm_id, kind, not_before, priority, deadline in upcoming:
+            start = first_free(prm_id, max(not_before, now))
+            occupy(prm_id, start + self.expected_duration(prm_id))
+            state.append({'prm_id': prm_id, 'state': kind, 'priority': priority,
+                          'deadline': deadline - now if deadline is not None else None,
+                          'predicted_start': start - now})
+
+        return sorted(state, key=lambda item: item['predicted_start'])
+
+    def predicted_start(self, prm_id):
+        '''
+        Returns the predicted time until the next measurement of a PrM starts
+        (in seconds), 0 if it is running, or None if nothing is planned.
+        '''
+        for item in self.queue_state():
+            if item['prm_id'] == prm_id:
+                return max(item['predicted_start'], 0)
+        return None
+
+    def is_queued(self, prm_id):
+        '''
+        Returns True if a measurement of the PrM is waiting to start.
+        '''
+        return prm_id in self._queued
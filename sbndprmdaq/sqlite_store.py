@@ -0,0 +1,62 @@
+'''
+Contains the base class of the SQLite databases (run catalog, measurement store)
+'''
+import sqlite3
+import threading
+
+import numpy as np
+
+
+def to_sql_value(value):
+    '''
+    Converts the numpy types and NaNs for sqlite.
+    '''
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+#pylint: disable=too-few-public-methods
+class SQLiteStore:
+    '''
+    An SQLite database in WAL mode, so that it can be read (eg. by another
+    process) while it is written. Each thread uses its own connection.
+    '''
+
+    def __init__(self, file_name, schema):
+        '''
+        Contructor.
+
+        Args:
+            file_name (str): The database file, created if it does not exist.
+            schema (str): The SQL script creating the tables, if they do not exist.
+        '''
+        self._file_name = file_name
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(schema)
+
+    def _connection(self):
+        '''
+        Returns the connection of the calling thread.
+        '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._file_name, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        '''
+        Closes the connection of the calling thread.
+        '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -0,0 +1,37 @@
+'''
+Contains the functions to open and check the paramiko SSH connections
+(used for the ADPro and for the data storage host)
+'''
+import paramiko
+
+
+def connect(host, keepalive, **connect_args):
+    '''
+    Opens an SSH connection and enables keepalives.
+
+    Args:
+        host (str): The remote host.
+        keepalive (float): The interval between the keepalive packets (in seconds).
+        connect_args: Passed to paramiko.SSHClient.connect (eg. username, timeout).
+
+    Returns:
+        paramiko.SSHClient: The connected client.
+    '''
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(host, **connect_args)
+    client.get_transport().set_keepalive(keepalive)
+    return client
+
+
+def is_active(client):
+    '''
+    Returns True if the SSH connection of a client is up.
+
+    Args:
+        client (paramiko.SSHClient): The client (None if not connected).
+    '''
+    if client is None:
+        return False
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
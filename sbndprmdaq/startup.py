@@ -0,0 +1,132 @@
+'''
+Contains the start-up steps shared by the DAQ entry points
+(prm_gui.py and prm_daemon.py)
+'''
+import os
+import time
+import logging
+import argparse
+
+import yaml
+
+from sbndprmdaq.prmlogger import get_logging
+
+# The settings file, at the top of the repository
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'settings.yaml')
+
+
+def argument_parser(description):
+    '''
+    Returns the parser of the command line options of all entry points.
+
+    Args:
+        description (str): The description of the program.
+
+    Returns:
+        argparse.ArgumentParser: The parser, to add the options of the entry point to.
+    '''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--mock', action='store_true',
+                        default=False,
+                        help='If true, runs a mock application for debugging purposes.')
+    parser.add_argument('--datafiles',
+                        default='',
+                        help='Path where data files will be saved.')
+    parser.add_argument('--logfile',
+                        default='prm_log.txt',
+                        help='File name where logs will be saved.')
+    return parser
+
+
+def start_logging(args):
+    '''
+    Starts the logging, to the log file and to the standard output.
+
+    Args:
+        args (argparse.Namespace): The command line options.
+    '''
+    get_logging(args.logfile)
+    logging.getLogger(__name__).info(f'Options: {args}')
+
+
+def load_config(args, settings=SETTINGS_FILE):
+    '''
+    Reads the settings file, and applies the command line options.
+
+    Args:
+        args (argparse.Namespace): The command line options.
+        settings (str): The settings file.
+
+    Returns:
+        dict: The configuration.
+    '''
+    with open(settings, encoding="utf-8") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)
+
+    if args.datafiles:
+        config["data_files_path"] = args.datafiles
+
+    if getattr(args, 'port', None) is not None:
+        config.setdefault('daemon', {})['port'] = args.port
+
+    if args.mock:
+        config['check_pmt_hv'] = False
+        config['check_lar_level'] = False
+        config['data_storage'] = False
+        config['populate_dataframe'] = False
+        config['summary_plot']['post_to_ecl'] = False
+
+    logging.getLogger(__name__).debug(f'Config:\n{yaml.dump(config)}')
+    return config
+
+
+def another_daq_running(config):
+    '''
+    Checks the heartbeat in the data directory, to find out if another
+    DAQ is running on it.
+
+    Args:
+        config (dict): The configuration.
+
+    Returns:
+        bool: True if another DAQ wrote the heartbeat in the last 5 seconds.
+    '''
+    heartbeat_file_name = config['data_files_path'] + '/heartbeat.txt'
+
+    if not os.path.exists(heartbeat_file_name):
+        return False
+
+    time_stamp = None
+    with open(heartbeat_file_name, encoding="utf-8") as f:
+        for line in f:
+            time_stamp = float(line)
+
+    if time_stamp is None or abs(time_stamp - time.time()) >= 5:
+        return False
+
+    logger = logging.getLogger(__name__)
+    logger.error(f'Another DAQ is running on this data directory: {config["data_files_path"]} '
+                 f'(heartbeat at {time_stamp}, now {time.time()}).')
+    logger.error('Either stop the other DAQ, or use a different path.')
+    return True
+
+
+def make_manager(args, config, window=None):
+    '''
+    Constructs the manager (the mock one with --mock).
+
+    Args:
+        args (argparse.Namespace): The command line options.
+        config (dict): The configuration.
+        window (MainWindow): The GUI, None without GUI.
+
+    Returns:
+        PrMManager: The manager.
+    '''
+    #pylint: disable=import-outside-toplevel
+    if args.mock:
+        from sbndprmdaq.mock_manager import MockPrMManager
+        return MockPrMManager(config, window)
+
+    from sbndprmdaq.manager import PrMManager
+    return PrMManager(config, window)
@@ -7,7 +7,6 @@ import time
 import datetime
 import xml.etree.ElementTree as ET
 
-import pandas as pd
 from PyQt5.QtCore import QTimer
 import matplotlib.pyplot as plt
 
@@ -17,7 +16,7 @@ from sbndprmdaq.eclapi import ECL, ECLEntry
 class SummaryPlot:
     '''
     A class that makes a plot of electron lifetime versus time, using teh measurement made
-    by the purity monitor DAQ and stored in a CSV file (dataframe).
+    by the purity monitor DAQ and stored in the measurement store.
     '''
     #pylint: disable=invalid-name,too-many-locals
 
@@ -32,7 +31,7 @@ class SummaryPlot:
         self._timer = None
         # self._timer_single = None
 
-        self._dataframe_filename = None
+        self._measurement_store = None
         self._plot_savedir = None
 
         self._first_day = {
@@ -77,12 +76,12 @@ class SummaryPlot:
         self._timer.start(self._config['time_interval'] * 1000 * 3600)
 
 
-    def set_dataframe_path(self, dataframe_filename):
+    def set_measurement_store(self, measurement_store):
         '''
-        Sets the path to the CSV file containing the dataframe
+        Sets the measurement store the plots are made from
         '''
 
-        self._dataframe_filename = dataframe_filename
+        self._measurement_store = measurement_store
 
 
     def set_plot_savedir(self, plot_savedir):
@@ -98,15 +97,14 @@ class SummaryPlot:
         Makes the plots for all PrMs
         '''
 
-        if self._dataframe_filename is None:
-            self._logger.warning('Dont have a dataframe filename. Plot will not be made.')
+        if self._measurement_store is None:
+            self._logger.warning('Dont have a measurement store. Plot will not be made.')
             return
 
-        # Read the dataframe
-        df = pd.read_csv(self._dataframe_filename)
-
-        # Convert the date string to datetime object
-        df['date'] = pd.to_datetime(df['date'])
+        # Read the measurements since the first day of the PrMs
+        first_day = min(datetime.datetime.strptime(self._first_day[prm_id], "%m/%d/%Y")
+                        for prm_id in self._config['prms'])
+        df = self._measurement_store.query(since=first_day)
 
         self._make_summary_plot(df)
 
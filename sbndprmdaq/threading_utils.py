@@ -57,7 +57,7 @@ class Worker(QRunnable):
         '''
         Initialise the runner function with passed args, kwargs.
         '''
-        result = {'prm_ids': None, 'statuses': None}
+        result = {'prm_ids': [], 'statuses': []}
 
         # Retrieve args/kwargs here; and fire processing using them
         try:
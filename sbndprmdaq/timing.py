@@ -0,0 +1,134 @@
+'''
+Contains the classes to measure the time spent in the stages of a measurement
+'''
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageTimer:
+    '''
+    Measures the wall time spent in named stages. Stages can also be
+    added with a duration measured elsewhere (eg. a readout running in
+    the background), so the sum of the stages can exceed the total time
+    when stages overlap.
+    '''
+
+    def __init__(self):
+        '''
+        Contructor.
+        '''
+        self._start = time.monotonic()
+        self._stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager measuring the time spent in a stage.
+
+        Args:
+            name (str): The name of the stage.
+        '''
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def add(self, name, duration):
+        '''
+        Adds a duration to a stage.
+
+        Args:
+            name (str): The name of the stage.
+            duration (float): The duration (in seconds).
+        '''
+        self._stages[name] = self._stages.get(name, 0.) + duration
+
+    def total(self):
+        '''
+        Returns the time (in seconds) since the timer was created.
+        '''
+        return time.monotonic() - self._start
+
+    def breakdown(self):
+        '''
+        Returns the time spent in every stage, plus the total time.
+
+        Returns:
+            dict: The times (in seconds) keyed by stage.
+        '''
+        breakdown = dict(self._stages)
+        breakdown['total'] = self.total()
+        return breakdown
+
+    def summary(self):
+        '''
+        Returns the breakdown as a string, for logging.
+        '''
+        return ', '.join(f'{name}: {duration:.2f} s' for name, duration in self.breakdown().items())
+
+
+class TimingStatistics:
+    '''
+    Keeps the durations of the stages of the latest runs of every PrM,
+    and returns their median and 95th percentile, to spot where the time
+    goes and catch regressions. It can be filled and read from different threads.
+    '''
+
+    def __init__(self, history_size=50):
+        '''
+        Contructor.
+
+        Args:
+            history_size (int): The number of runs the percentiles are computed on.
+        '''
+        self._history_size = history_size
+        self._durations = {} # prm_id -> stage -> deque of durations
+        self._lock = threading.Lock()
+
+    def add(self, prm_id, breakdown):
+        '''
+        Adds the stage durations of a run.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            breakdown (dict): The durations (in seconds) keyed by stage.
+        '''
+        with self._lock:
+            stages = self._durations.setdefault(prm_id, {})
+            for name, duration in breakdown.items():
+                stages.setdefault(name, deque(maxlen=self._history_size)).append(duration)
+
+    def percentiles(self, prm_id):
+        '''
+        Returns the percentiles of the stage durations of a PrM.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+
+        Returns:
+            dict: Keyed by stage, the number of runs ('n'), the latest,
+                  median ('p50') and 95th percentile ('p95') durations (in seconds).
+        '''
+        with self._lock:
+            stages = {name: list(durations) for name, durations in self._durations.get(prm_id, {}).items()}
+
+        return {
+            name: {
+                'n': len(durations),
+                'latest': durations[-1],
+                'p50': float(np.percentile(durations, 50)),
+                'p95': float(np.percentile(durations, 95)),
+            } for name, durations in stages.items()
+        }
+
+    def summary(self, prm_id):
+        '''
+        Returns the percentiles of a PrM as a string, for logging.
+        '''
+        return ', '.join(f'{name}: {p["p50"]:.2f}/{p["p95"]:.2f} s'
+                         for name, p in self.percentiles(prm_id).items())
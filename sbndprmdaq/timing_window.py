@@ -0,0 +1,60 @@
+'''
+Contains a window showing where the time of the measurements goes
+'''
+from PyQt5 import QtWidgets
+
+
+class TimingWindow(QtWidgets.QDialog):
+    '''
+    Shows, for every PrM, the latest, median and 95th percentile
+    time spent in every stage of the latest runs.
+    '''
+
+    COLUMNS = ['Stage', 'Runs', 'Latest [s]', 'p50 [s]', 'p95 [s]']
+
+    def __init__(self, prm_ids, parent=None):
+        '''
+        Contructor.
+
+        Args:
+            prm_ids (list): The purity monitor IDs.
+            parent (QtWidgets): the parent widget
+        '''
+        super().__init__(parent)
+
+        self.setWindowTitle("Measurement Stage Timing")
+        self.setGeometry(100, 100, 500, 600)
+
+        self._tabwidget = QtWidgets.QTabWidget()
+        self._tables = {}
+
+        for prm_id in prm_ids:
+            table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+            table.setHorizontalHeaderLabels(self.COLUMNS)
+            table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+            table.verticalHeader().setVisible(False)
+            table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+            self._tables[prm_id] = table
+            self._tabwidget.addTab(table, f"PrM {prm_id}")
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self._tabwidget)
+        self.setLayout(layout)
+
+    def set_statistics(self, prm_id, percentiles):
+        '''
+        Shows the timing statistics of a PrM.
+
+        Args:
+            prm_id (int): The purity monitor ID.
+            percentiles (dict): The statistics, keyed by stage (see TimingStatistics.percentiles).
+        '''
+        table = self._tables[prm_id]
+        table.setRowCount(len(percentiles))
+
+        # Slowest stages first
+        stages = sorted(percentiles.items(), key=lambda item: item[1]['p95'], reverse=True)
+        for row, (name, stats) in enumerate(stages):
+            values = [name, str(stats['n'])] + [f'{stats[key]:.3f}' for key in ['latest', 'p50', 'p95']]
+            for column, value in enumerate(values):
+                table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
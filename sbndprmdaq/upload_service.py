@@ -0,0 +1,496 @@
+'''
+Contains the service uploading the data files to the storage host
+'''
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import collections
+
+import paramiko
+
+from sbndprmdaq import ssh_client
+
+
+class SFTPSession:
+    '''
+    An SSH connection to the storage host, authenticated with GSSAPI
+    (Kerberos), kept open between the uploads. Every upload stream opens
+    its own SFTP channel on it. It reconnects when the connection drops.
+    '''
+
+    #pylint: disable=too-many-arguments
+    def __init__(self, host, username, authenticate=None, timeout=30, keepalive=30):
+        '''
+        Contructor.
+
+        Args:
+            host (str): The storage host.
+            username (str): The user name on the storage host.
+            authenticate (callable): Called before connecting (eg. to get a Kerberos ticket).
+            timeout (float): The connection timeout (in seconds).
+            keepalive (float): The interval between the keepalive packets (in seconds).
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        self._host = host
+        self._username = username
+        self._authenticate = authenticate
+        self._timeout = timeout
+        self._keepalive = keepalive
+
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        '''
+        True if the SSH connection is up.
+        '''
+        return ssh_client.is_active(self._client)
+
+    def open_sftp(self):
+        '''
+        Opens a new SFTP channel, connecting first if needed.
+
+        Returns:
+            paramiko.SFTPClient: The SFTP channel.
+        '''
+        with self._lock:
+            if not self.connected:
+                self._connect()
+            return self._client.open_sftp()
+
+    def _connect(self):
+        '''
+        Opens the SSH connection.
+        '''
+        self._close()
+
+        if self._authenticate is not None:
+            self._authenticate()
+
+        self._client = ssh_client.connect(self._host, self._keepalive,
+                                          username=self._username,
+                                          gss_auth=True,
+                                          timeout=self._timeout,
+                                          banner_timeout=self._timeout,
+                                          auth_timeout=self._timeout)
+        self._logger.info(f'Connected to {self._host}.')
+
+    def close(self):
+        '''
+        Closes the SSH connection.
+        '''
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+#pylint: disable=too-few-public-methods
+class _Upload:
+    '''
+    A file waiting to be uploaded, as stored in the spool.
+    '''
+
+    def __init__(self, local_path, remote_path, upload_id=None, added=None, attempts=0):
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.upload_id = upload_id if upload_id is not None else uuid.uuid4().hex
+        self.added = added if added is not None else time.time()
+        self.attempts = attempts
+        self.next_attempt = 0
+
+    def to_dict(self):
+        '''
+        Returns what is stored in the spool.
+        '''
+        return {
+            'local_path': self.local_path,
+            'remote_path': self.remote_path,
+            'upload_id': self.upload_id,
+            'added': self.added,
+            'attempts': self.attempts,
+        }
+
+
+#pylint: disable=too-many-instance-attributes
+class UploadService:
+    '''
+    Uploads the data files to the storage host, in the background.
+
+    The files to upload are written to a spool directory, one small json
+    file per upload, removed once the file is on the storage host. The
+    uploads are taken by several streams (threads), each with its own SFTP
+    channel on one SSH connection, kept open. A failed upload is retried
+    later, with an increasing delay, so the uploads catch up once the host
+    is back. The uploads left in the spool when the DAQ stops are taken
+    again when it starts. A file is first written with a .part suffix and
+    renamed when complete, and a partial file is resumed where it stopped.
+    '''
+
+    def __init__(self, config, session=None, authenticate=None):
+        '''
+        Contructor.
+
+        Args:
+            config (dict): The overall configuration.
+            session (SFTPSession): The connection to the storage host (one is made if None).
+            authenticate (callable): Called before connecting (eg. to get a Kerberos ticket).
+        '''
+        self._logger = logging.getLogger(__name__)
+
+        upload_config = config.get('upload_service', {})
+
+        self._remote_path = config['data_storage_path']
+        self._n_streams = upload_config.get('n_streams', 2)
+        self._retry_delay = upload_config.get('retry_delay', 10)
+        self._max_retry_delay = upload_config.get('max_retry_delay', 600)
+        self._chunk_size = upload_config.get('chunk_size', 1 << 20)
+
+        self._spool_dir = upload_config.get('spool_dir')
+        if self._spool_dir is None and config.get('data_files_path') is not None:
+            self._spool_dir = os.path.join(config['data_files_path'], 'upload_spool')
+        if self._spool_dir is not None:
+            os.makedirs(self._spool_dir, exist_ok=True)
+        else:
+            self._logger.warning('No upload spool directory, the pending uploads '
+                                 'will be lost if the DAQ stops.')
+
+        if session is None:
+            session = SFTPSession(config['data_storage_host'],
+                                  config['data_storage_username'],
+                                  authenticate=authenticate,
+                                  timeout=upload_config.get('timeout', 30))
+        self._session = session
+
+        self._pending = collections.deque()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._threads = []
+
+        self._uploaded_files = 0
+        self._uploaded_bytes = 0
+        self._failures = 0
+        self._last_error = None
+        # (bytes, seconds) of the latest uploads
+        self._transfers = collections.deque(maxlen=upload_config.get('throughput_history', 20))
+
+        self._load_spool()
+
+    def start(self):
+        '''
+        Starts the upload streams.
+        '''
+        if self._running:
+            return
+
+        self._running = True
+        self._threads = [threading.Thread(target=self._stream, name=f'upload-{i}', daemon=True)
+                         for i in range(self._n_streams)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=10):
+        '''
+        Stops the upload streams. The pending uploads stay in the spool.
+
+        Args:
+            timeout (float): How long to wait for every stream (in seconds).
+        '''
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+        self._session.close()
+
+    def submit(self, filenames, remote_dir=None):
+        '''
+        Adds files to upload. It does not wait for the upload.
+
+        Args:
+            filenames (list): The full paths of the files (or folders) to upload.
+            remote_dir (str): The remote directory (data_storage_path if None).
+
+        Returns:
+            int: The number of files added.
+        '''
+        remote_dir = remote_dir if remote_dir is not None else self._remote_path
+
+        uploads = []
+        for filename in filenames:
+            if os.path.isdir(filename):
+                parent = os.path.dirname(os.path.normpath(filename))
+                for root, _, files in os.walk(filename):
+                    for name in sorted(files):
+                        local_path = os.path.join(root, name)
+                        relative_path = os.path.relpath(local_path, parent)
+                        uploads.append(_Upload(local_path, os.path.join(remote_dir, relative_path)))
+            elif os.path.isfile(filename):
+                uploads.append(_Upload(filename, os.path.join(remote_dir, os.path.basename(filename))))
+            else:
+                self._logger.info(f'File {filename} does not exist.')
+
+        for upload in uploads:
+            self._write_spool(upload)
+
+        with self._condition:
+            self._pending.extend(uploads)
+            self._condition.notify_all()
+
+        return len(uploads)
+
+    def wait(self, timeout=None):
+        '''
+        Waits until there is nothing left to upload.
+
+        Args:
+            timeout (float): The max time to wait (in seconds), forever if None.
+
+        Returns:
+            bool: True if all uploads are done.
+        '''
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._in_flight,
+                                            timeout=timeout)
+
+    def statistics(self):
+        '''
+        Returns the state of the uploads.
+
+        Returns:
+            dict: queue_depth (files not uploaded yet, including the ones
+                  being uploaded), in_flight, pending_bytes, oldest_pending
+                  (age in seconds), uploaded_files, uploaded_bytes, failures,
+                  throughput (bytes per second per stream, on the latest
+                  uploads), connected and last_error.
+        '''
+        with self._condition:
+            uploads = list(self._pending)
+            in_flight = self._in_flight
+            transfers = list(self._transfers)
+            statistics = {
+                'uploaded_files': self._uploaded_files,
+                'uploaded_bytes': self._uploaded_bytes,
+                'failures': self._failures,
+                'last_error': self._last_error,
+            }
+
+        transfer_time = sum(seconds for _, seconds in transfers)
+
+        statistics.update({
+            'queue_depth': len(uploads) + in_flight,
+            'in_flight': in_flight,
+            'pending_bytes': sum(_file_size(upload.local_path) for upload in uploads),
+            'oldest_pending': time.time() - min(upload.added for upload in uploads) if uploads else 0,
+            'throughput': sum(size for size, _ in transfers) / transfer_time if transfer_time else None,
+            'connected': self._session.connected,
+        })
+        return statistics
+
+    def _stream(self):
+        '''
+        An upload stream: takes the uploads, one at a time, until stopped.
+        '''
+        sftp = None
+
+        while True:
+            upload = self._next_upload()
+            if upload is None:
+                break
+
+            if not os.path.isfile(upload.local_path):
+                self._logger.error(f'File {upload.local_path} disappeared, it will not be uploaded.')
+                self._done(upload, None, None)
+                continue
+
+            start = time.monotonic()
+            try:
+                if sftp is None:
+                    sftp = self._session.open_sftp()
+                size = _transfer(sftp, upload.local_path, upload.remote_path, self._chunk_size)
+            except (paramiko.SSHException, OSError, EOFError) as err:
+                if sftp is not None:
+                    sftp.close()
+                    sftp = None
+                self._failed(upload, err)
+                continue
+
+            self._done(upload, size, time.monotonic() - start)
+
+        if sftp is not None:
+            sftp.close()
+
+    def _next_upload(self):
+        '''
+        Waits for an upload that can be tried now.
+
+        Returns:
+            _Upload: The upload, or None when the service stops.
+        '''
+        with self._condition:
+            while self._running:
+                now = time.monotonic()
+                for upload in self._pending:
+                    if upload.next_attempt <= now:
+                        self._pending.remove(upload)
+                        self._in_flight += 1
+                        return upload
+
+                next_attempt = min((upload.next_attempt for upload in self._pending), default=None)
+                self._condition.wait(timeout=next_attempt - now if next_attempt is not None else None)
+
+        return None
+
+    def _done(self, upload, size, duration):
+        '''
+        Removes an upload from the spool.
+        '''
+        self._remove_spool(upload)
+
+        with self._condition:
+            self._in_flight -= 1
+            if size is not None:
+                self._uploaded_files += 1
+                self._uploaded_bytes += size
+                self._transfers.append((size, duration))
+            self._condition.notify_all()
+
+        if size is not None:
+            self._logger.info(f'Uploaded {upload.local_path} ({size / 1e6:.1f} MB in {duration:.1f} s).')
+
+    def _failed(self, upload, err):
+        '''
+        Puts back an upload, to be retried later.
+        '''
+        upload.attempts += 1
+        delay = min(self._retry_delay * 2**(upload.attempts - 1), self._max_retry_delay)
+        upload.next_attempt = time.monotonic() + delay
+        self._write_spool(upload)
+
+        self._logger.warning(f'Upload of {upload.local_path} failed ({err}), '
+                             f'attempt {upload.attempts}, retrying in {delay:.0f} s.')
+
+        with self._condition:
+            self._in_flight -= 1
+            self._failures += 1
+            self._last_error = str(err)
+            self._pending.append(upload)
+            self._condition.notify_all()
+
+    def _load_spool(self):
+        '''
+        Takes the uploads left in the spool.
+        '''
+        if self._spool_dir is None:
+            return
+
+        uploads = []
+        for name in os.listdir(self._spool_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self._spool_dir, name), encoding='utf-8') as file:
+                    uploads.append(_Upload(**json.load(file)))
+            except (OSError, ValueError, TypeError) as err:
+                self._logger.error(f'Cannot read the upload spool file {name}: {err}')
+
+        uploads.sort(key=lambda upload: upload.added)
+        self._pending.extend(uploads)
+
+        if uploads:
+            self._logger.info(f'{len(uploads)} files left to upload from the spool.')
+
+    def _write_spool(self, upload):
+        if self._spool_dir is None:
+            return
+
+        file_name = os.path.join(self._spool_dir, upload.upload_id + '.json')
+        with open(file_name + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(upload.to_dict(), file)
+        os.replace(file_name + '.tmp', file_name)
+
+    def _remove_spool(self, upload):
+        if self._spool_dir is None:
+            return
+
+        try:
+            os.remove(os.path.join(self._spool_dir, upload.upload_id + '.json'))
+        except FileNotFoundError:
+            pass
+
+
+def _file_size(file_name):
+    try:
+        return os.path.getsize(file_name)
+    except OSError:
+        return 0
+
+
+def _makedirs(sftp, remote_dir):
+    '''
+    Makes a remote directory, and its parents.
+    '''
+    try:
+        sftp.stat(remote_dir)
+        return
+    except IOError:
+        pass
+
+    parent = os.path.dirname(remote_dir)
+    if parent and parent != remote_dir:
+        _makedirs(sftp, parent)
+    sftp.mkdir(remote_dir)
+
+
+def _transfer(sftp, local_path, remote_path, chunk_size):
+    '''
+    Copies a file to the storage host, resuming a partial copy.
+
+    Args:
+        sftp (paramiko.SFTPClient): The SFTP channel.
+        local_path (str): The local file.
+        remote_path (str): The remote file.
+        chunk_size (int): The number of bytes written at a time.
+
+    Returns:
+        int: The file size.
+    '''
+    size = os.path.getsize(local_path)
+    partial_path = remote_path + '.part'
+
+    _makedirs(sftp, os.path.dirname(remote_path))
+
+    try:
+        offset = sftp.stat(partial_path).st_size
+    except IOError:
+        offset = 0
+    if offset > size:
+        offset = 0
+
+    with open(local_path, 'rb') as source, sftp.open(partial_path, 'ab' if offset else 'wb') as target:
+        target.set_pipelined(True)
+        source.seek(offset)
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            target.write(chunk)
+
+    remote_size = sftp.stat(partial_path).st_size
+    if remote_size != size:
+        raise IOError(f'{remote_path} has {remote_size} bytes instead of {size}')
+
+    sftp.posix_rename(partial_path, remote_path)
+    return size
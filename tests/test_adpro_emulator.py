@@ -0,0 +1,100 @@
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pytest
+
+from sbndprmdaq.digitizer.adpro_control import ADProControl
+from sbndprmdaq.digitizer.adpro_emulator import start_emulator
+from sbndprmdaq.digitizer.waveform_accumulator import WaveformAccumulator
+
+
+@pytest.fixture
+def emulator():
+    server = start_emulator(capture_time=0.2, seed=1)
+    yield server
+    server.shutdown()
+
+
+def test_adpro_control_with_emulator(emulator):
+    adpro = ADProControl(config={'adpro_url': emulator.url})
+
+    assert adpro.get_number_acquisitions() == 20
+    adpro.set_number_acquisitions(5)
+    assert adpro.get_number_acquisitions() == 5
+
+    adpro.lamp_frequency(10)
+    adpro.lamp_on()
+    assert adpro.start_capture()
+    assert adpro.check_capture()
+
+    data = adpro.get_data()
+    n_samples = adpro.get_pre_trigger_samples() + adpro.get_post_trigger_samples()
+    assert sorted(data.keys()) == ['1', '2', '3', '4']
+    assert np.shape(data['1']) == (5, n_samples)
+
+    # Cathode signal is negative, anode signal is positive
+    assert np.min(np.mean(data['1'], axis=0)) < -0.05
+    assert np.max(np.mean(data['2'], axis=0)) > 0.01
+
+
+def test_adpro_reduced_data(emulator):
+    adpro = ADProControl(config={'adpro_url': emulator.url, 'adpro_reduce_data': True})
+
+    adpro.set_number_acquisitions(8)
+    adpro.lamp_on()
+    adpro.start_capture()
+    adpro.check_capture()
+
+    data = adpro.get_data()
+    assert len(data['1']) == 1
+
+    summary = adpro.get_record_summary()
+    assert summary['1']['n_records'] == 8
+    assert len(summary['1']['baseline']) == 8
+    assert len(summary['1']['raw']) == 0
+
+
+def test_adpro_stream_data(emulator):
+    adpro = ADProControl(config={'adpro_url': emulator.url, 'adpro_stream_data': True})
+
+    adpro.set_number_acquisitions(7)
+    adpro.lamp_on()
+    adpro.start_capture()
+
+    chunks = list(adpro.stream_data(chunk_size=3))
+
+    assert [status for _, status in chunks[:-1]] == [None] * (len(chunks) - 1)
+    assert chunks[-1][1] is True
+    assert sum(len(data['1']) for data, _ in chunks) == 7
+
+
+def test_adpro_acquire_async(emulator):
+    adpro = ADProControl(config={'adpro_url': emulator.url, 'adpro_stream_data': True})
+    adpro.lamp_on()
+
+    progress = []
+    future = adpro.acquire_async(n_records=4, progress_callback=lambda name, perc: progress.append(perc))
+
+    assert future.wait_captured(timeout=10)
+    result = future.result(timeout=10)
+    assert result.status
+    assert len(result.data['1']) == 4
+    assert progress[-1] == 100
+
+    future = adpro.acquire_async()
+    assert future.cancel()
+    with pytest.raises(CancelledError):
+        future.result(timeout=10)
+
+
+def test_adpro_reduced_data_accumulator(emulator):
+    adpro = ADProControl(config={'adpro_url': emulator.url, 'adpro_reduce_data': True, 'adpro_reduce_n_raw': 2})
+    adpro.lamp_on()
+
+    accumulator = WaveformAccumulator(reservoir_size=5)
+    for _ in range(2):
+        adpro.acquire_async(n_records=6, accumulator=accumulator).result(timeout=10)
+
+    assert accumulator.count == 12
+    assert accumulator.reservoir().n_records == 4
+    assert np.all(accumulator.variance('1') > 0)
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from sbndprmdaq.analysis import AnalysisPool
+from sbndprmdaq.analysis import analysis_pool
+from sbndprmdaq.digitizer.adpro_emulator import ADProEmulator
+
+config = {
+    'ana_type': 'estimate',
+    'deltat_start_c': 310,
+    'deltat_start_a': 310,
+    'trigger_sample': 300,
+    'signal_range_c': [300, 500],
+    'signal_range_a': [2250, 2500],
+    'baseline_range_c': [0, 250],
+    'baseline_range_a': [2000, 2200],
+}
+
+
+def make_waveforms():
+    emulator = ADProEmulator(seed=1)
+    emulator._lamp_on = True
+    records = emulator.make_records(20)
+    return records[0].mean(axis=0)[np.newaxis], records[1].mean(axis=0)[np.newaxis]
+
+
+def test_analysis_pool(tmp_path):
+    wf_c, wf_a = make_waveforms()
+    container = {'date': '20250101-120000', 'run': 1, 'ch_B': np.zeros((20, 10)),
+                 'hv_cathode': -150, 'hv_anodegrid': 1000, 'hv_anode': 5000}
+
+    in_thread = AnalysisPool(n_processes=0).analyse('estimate', config, wf_c, wf_a)
+    assert in_thread.status == 'ok'
+    assert abs(in_thread.tau - 2) < 0.1 # ms, as simulated
+
+    pool = AnalysisPool(n_processes=2, timeout=60)
+    plot_file = os.path.join(tmp_path, 'ana.png')
+    result = pool.analyse('estimate', config, wf_c, wf_a, wf_c_hvoff=[], wf_a_hvoff=[],
+                          container=container, plot_file=plot_file)
+
+    assert result.status == 'ok', result.error
+    assert result.tau == in_thread.tau
+    assert result.qa == in_thread.qa
+    assert os.path.exists(plot_file)
+
+    # Errors in the child are returned, not raised
+    result = pool.analyse('estimate', config, wf_c[:, :10], wf_a)
+    assert result.status == 'failed'
+
+    pool.stop()
+
+
+@pytest.mark.skipif(analysis_pool._shared_memory() is None, reason='needs Python >= 3.8')
+def test_analysis_pool_timeout():
+    wf_c, wf_a = make_waveforms()
+
+    pool = AnalysisPool(n_processes=1, timeout=0.001)
+    result = pool.analyse('fit', dict(config, ana_type='fit'), wf_c, wf_a)
+    assert result.status == 'timeout'
+
+
+def test_analysis_pool_no_shared_memory(monkeypatch):
+    # As on Python < 3.8
+    monkeypatch.setattr(analysis_pool, '_shared_memory', lambda: None)
+    wf_c, wf_a = make_waveforms()
+
+    result = AnalysisPool(n_processes=2).analyse('estimate', config, wf_c, wf_a)
+    assert result.status == 'ok'
@@ -0,0 +1,35 @@
+from sbndprmdaq.cadence import AdaptiveCadence, relative_lifetime_error
+
+
+def meas(tau, qa=50., qc=100., tau_err=None):
+    return {'tau': tau, 'qa': qa, 'qc': qc, 'tau_err': tau_err}
+
+
+def test_relative_lifetime_error():
+    assert relative_lifetime_error(-1, 100, 1, 1) is None
+    assert abs(relative_lifetime_error(50, 100, 0.5, 1) - 0.0204) < 1e-3
+
+
+def test_adaptive_cadence():
+    cadence = AdaptiveCadence({'min_interval': 300, 'max_interval': 3600, 'max_hv_duty': 0.1})
+
+    # Stable and well measured: the interval grows, up to the max
+    for i in range(10):
+        cadence.add_measurement(1, i * 600, meas(10., tau_err=0.1), hv_on_time=20)
+        interval = cadence.next_interval(1, 600)
+    assert interval == 3600
+
+    # Poorly measured: the interval shrinks
+    cadence.add_measurement(1, 6000, meas(10., tau_err=5), hv_on_time=20)
+    assert cadence.next_interval(1, 600) == 900
+
+    # Failed analysis: the interval is kept
+    cadence.add_measurement(1, 6600, meas(-10.), hv_on_time=20)
+    assert cadence.next_interval(1, 600) == 900
+
+    # Drifting: down to the min interval, but keeping the HV duty below 10%
+    cadence.reset(2, 600)
+    for i, tau in enumerate([10., 8., 6.]):
+        cadence.add_measurement(2, i * 600, meas(tau, tau_err=0.1), hv_on_time=40)
+        interval = cadence.next_interval(2, 600)
+    assert interval == 400
@@ -0,0 +1,80 @@
+import os
+import json
+import yaml
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+from sbndprmdaq.daemon import PrMDaemon
+from sbndprmdaq.mock_manager import MockPrMManager
+
+settings = os.path.join(os.path.dirname(__file__), '../settings.yaml')
+
+with open(settings) as file:
+    config = yaml.load(file, Loader=yaml.FullLoader)
+    config['data_storage'] = False
+    config['check_lar_level'] = False
+    config['check_pmt_hv'] = False
+    config['populate_dataframe'] = False
+    config['data_files_path'] = None
+    config['daemon'] = {'host': '127.0.0.1', 'port': 0}
+
+
+def test_daemon(qtbot, tmp_path):
+    manager = MockPrMManager(config)
+    token_file = str(tmp_path / 'token')
+    daemon = PrMDaemon(manager, dict(config, daemon=dict(config['daemon'], token_file=token_file)))
+    daemon.start()
+    url = f'http://127.0.0.1:{daemon.address[1]}'
+
+    # The token file is created, readable by its owner only
+    assert os.stat(token_file).st_mode & 0o777 == 0o600
+    with open(token_file, encoding='utf-8') as file:
+        token = file.read().strip()
+
+    def request(path, body=None, **headers):
+        data = json.dumps(body).encode() if body is not None else None
+        headers = dict({'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}, **headers)
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url + path, data=data, headers=headers),
+                                        timeout=10) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as err:
+            return err.code, json.loads(err.read())
+
+    # The requests are served on the Qt thread, keep its event loop running
+    executor = ThreadPoolExecutor(max_workers=1)
+    def call(path, body=None, **headers):
+        future = executor.submit(request, path, body, **headers)
+        qtbot.waitUntil(future.done, timeout=10000)
+        return future.result()
+
+    status, result = call('/status')
+    assert status == 200
+    assert set(result['prms']) == {'1', '2', '3'}
+    assert result['prms']['1']['mode'] == 'manual'
+    assert result['uploads'] is None
+
+    status, result = call('/prm/1/mode', {'mode': 'auto', 'interval': 1800})
+    assert status == 200
+    assert result['mode'] == 'auto'
+    assert 1790 < result['next_run_in'] <= 1800
+
+    status, result = call('/queue')
+    assert [(item['prm_id'], item['state']) for item in result] == [(1, 'scheduled')]
+
+    assert call('/prm/1/mode', {'mode': 'manual'})[0] == 200
+    assert call('/prm/2/start', {})[0] == 400
+    assert call('/prm/5')[0] == 404
+    assert call('/prm/1/mode', {'mode': 'fast'})[0] == 400
+
+    # Requests a web page could send from a browser are refused
+    hv_on = []
+    manager.hv_on = hv_on.append
+    assert call('/prm/1/hv', {'on': True}, **{'Content-Type': 'text/plain'})[0] == 415
+    assert call('/status', Host='attacker.example:8765')[0] == 403
+    assert call('/status', Authorization='Bearer wrong')[0] == 401
+    assert hv_on == []
+
+    daemon.stop()
+    executor.shutdown()
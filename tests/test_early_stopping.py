@@ -0,0 +1,46 @@
+from sbndprmdaq.early_stopping import EarlyStopping, quick_lifetime_estimate
+from sbndprmdaq.digitizer.adpro_emulator import ADProEmulator
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+from sbndprmdaq.digitizer.waveform_accumulator import WaveformAccumulator
+
+config = {
+    'signal_range_c': [300, 500],
+    'signal_range_a': [2250, 2500],
+    'baseline_range_c': [0, 250],
+    'baseline_range_a': [2800, 3000],
+}
+
+
+def test_quick_lifetime_estimate():
+    emulator = ADProEmulator(seed=1)
+    emulator._lamp_on = True
+    emulator.noise = 2e-2
+
+    accumulator = WaveformAccumulator()
+    errors = []
+    for _ in range(4):
+        records = emulator.make_records(10)
+        accumulator.add(WaveformBatch(records, ['A', 'B', 'C', 'D'], 2e6, 300))
+        estimate = quick_lifetime_estimate(accumulator, None, ['A', 'B'], config)
+        errors.append(estimate['tau_rel_err'])
+
+    # Simulated: Qc = 150 mV (the peak is lower, because of the RC), Qa = Qc * exp(-1 / 2)
+    assert 0.13 < estimate['qc'] < 0.15
+    assert abs(estimate['qa'] / estimate['qc'] - 0.61) < 0.05
+    # The error shrinks as records are added
+    assert errors[-1] < errors[0] / 1.5
+
+
+def test_early_stopping():
+    early_stopping = EarlyStopping({'enabled': True, 'target_precision': 0.05,
+                                    'min_repetitions': 2, 'max_repetitions': 5, 'max_time': 60})
+
+    precise = {1: {'tau_rel_err': 0.01}, 2: {'tau_rel_err': 0.04}}
+    imprecise = {1: {'tau_rel_err': 0.01}, 2: {'tau_rel_err': 0.2}}
+
+    assert early_stopping.check(1, 10, precise) == (False, None)
+    assert early_stopping.check(2, 10, precise) == (True, 'precision reached')
+    assert early_stopping.check(2, 10, imprecise) == (False, None)
+    assert early_stopping.check(2, 10, {1: None}) == (False, None)
+    assert early_stopping.check(5, 10, imprecise) == (True, 'max repetitions')
+    assert early_stopping.check(3, 61, imprecise) == (True, 'max time')
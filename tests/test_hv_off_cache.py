@@ -0,0 +1,54 @@
+import numpy as np
+
+from sbndprmdaq.hv_off_cache import HVOffReferenceCache
+from sbndprmdaq.digitizer.digitizer_config import DigitizerConfig
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+from sbndprmdaq.digitizer.waveform_accumulator import WaveformAccumulator
+
+
+def make_data(offset=0.):
+    rng = np.random.default_rng(1)
+    accumulator = WaveformAccumulator()
+    accumulator.add(WaveformBatch(rng.normal(offset, 1e-3, size=(2, 20, 100)), ['A', 'B'], 2e6, 30))
+    return accumulator
+
+
+def test_hv_off_cache():
+    config = DigitizerConfig(2e6, 30, 30, 70, 20, 1)
+    cache = HVOffReferenceCache({'enabled': True, 'max_uses': 2, 'max_baseline_drift': 2e-3})
+
+    assert cache.get(1, config) == (None, None)
+
+    reference = make_data()
+    cache.store(1, config, reference)
+
+    data, info = cache.get(1, config)
+    assert data is reference
+    assert info['uses'] == 1
+
+    # Another digitizer configuration needs its own reference
+    assert cache.get(1, DigitizerConfig(2e6, 30, 30, 70, 40, 1)) == (None, None)
+
+    # Up to max_uses
+    assert cache.get(1, config)[0] is reference
+    assert cache.get(1, config) == (None, None)
+
+    # A drifted baseline drops the reference
+    cache.store(1, config, reference)
+    assert cache.check_drift(1, config, reference, make_data()) < 1e-3
+    assert cache.get(1, config)[0] is reference
+    drift = cache.check_drift(1, config, reference, make_data(offset=5e-3))
+    assert drift > 2e-3 and cache.drifted(drift)
+    assert cache.get(1, config) == (None, None)
+
+    # So does a check capture that failed
+    cache.store(1, config, reference)
+    assert cache.drifted(cache.check_drift(1, config, reference, None))
+    assert cache.get(1, config) == (None, None)
+
+
+def test_hv_off_cache_disabled():
+    config = DigitizerConfig(2e6, 30, 30, 70, 20, 1)
+    cache = HVOffReferenceCache()
+    cache.store(1, config, make_data())
+    assert cache.get(1, config) == (None, None)
@@ -0,0 +1,96 @@
+import os
+import time
+import struct
+import logging
+
+from sbndprmdaq.kerberos import KerberosCredentialManager, read_ccache
+
+PRINCIPAL = 'sbndprm/sbnd-prm01.fnal.gov@FNAL.GOV'
+
+
+def octets(value):
+    return struct.pack('>I', len(value)) + value
+
+
+def principal(name):
+    name, realm = name.split('@')
+    components = name.split('/')
+    return (struct.pack('>II', 1, len(components)) + octets(realm.encode())
+            + b''.join(octets(c.encode()) for c in components))
+
+
+def credential(server, end_time):
+    return (principal(PRINCIPAL) + principal(server)
+            + struct.pack('>H', 18) + octets(b'k' * 32)
+            + struct.pack('>IIII', 0, int(time.time()), int(end_time), int(end_time))
+            + struct.pack('>BI', 0, 0)
+            + struct.pack('>I', 0) + struct.pack('>I', 0)
+            + octets(b'ticket') + octets(b''))
+
+
+def write_ccache(file_name, end_time):
+    header = struct.pack('>HH', 1, 8) + b'\0' * 8
+    with open(file_name, 'wb') as file:
+        file.write(struct.pack('>HH', 0x0504, len(header)) + header + principal(PRINCIPAL)
+                   + credential('X-CACHECONF:/krb5_ccache_conf_data/pa_type@X-CACHECONF:', 0)
+                   + credential('krbtgt/FNAL.GOV@FNAL.GOV', end_time))
+
+
+def test_read_ccache(tmp_path):
+    end_time = time.time() + 3600
+    write_ccache(tmp_path / 'krb5cc', end_time)
+
+    name, tickets = read_ccache(tmp_path / 'krb5cc')
+    assert name == PRINCIPAL
+    assert len(tickets) == 1
+    assert tickets[0]['server'] == 'krbtgt/FNAL.GOV@FNAL.GOV'
+    assert tickets[0]['end_time'] == int(end_time)
+
+
+def test_credential_manager(tmp_path, monkeypatch):
+    # A kinit that writes a ticket valid for 10 hours
+    write_ccache(tmp_path / 'new_ticket', time.time() + 36000)
+    bin_path = tmp_path / 'bin'
+    bin_path.mkdir()
+    with open(bin_path / 'kinit', 'w') as file:
+        file.write(f'#!/bin/sh\ncp {tmp_path / "new_ticket"} "${{KRB5CCNAME#FILE:}}"\n')
+    os.chmod(bin_path / 'kinit', 0o755)
+    monkeypatch.setenv('PATH', f'{bin_path}:{os.environ["PATH"]}')
+    monkeypatch.setenv('KRB5CCNAME', 'FILE:/tmp/other_ccache')
+
+    ccache = str(tmp_path / 'krb5cc')
+    credentials = KerberosCredentialManager({'ccache': ccache, 'principal': PRINCIPAL,
+                                             'renew_before': 3600, 'check_interval': 0.05})
+
+    # No ticket
+    assert credentials.remaining_time() == 0
+    assert credentials.ensure_valid() == 'FILE:' + ccache
+    assert os.environ['KRB5CCNAME'] == 'FILE:' + ccache
+    assert credentials.remaining_time() > 35000
+
+    # A valid ticket is reused
+    credentials.ensure_valid()
+    statistics = credentials.statistics()
+    assert statistics['renewals'] == 1
+    assert statistics['latency']['kinit']['n'] == 1
+    assert statistics['latency']['ensure_valid']['n'] == 2
+
+    # A ticket close to its expiry is renewed in the background
+    write_ccache(ccache, time.time() + 600)
+    credentials.start()
+    deadline = time.time() + 5
+    while credentials.remaining_time() < 35000 and time.time() < deadline:
+        time.sleep(0.05)
+    credentials.stop()
+    assert credentials.remaining_time() > 35000
+    assert credentials.statistics()['renewals'] == 2
+
+
+def test_credential_manager_failure(tmp_path, monkeypatch):
+    # No kinit
+    monkeypatch.setenv('PATH', str(tmp_path))
+    monkeypatch.setattr(logging.getLogger('sbndprmdaq.kerberos'), 'propagate', False)
+
+    credentials = KerberosCredentialManager({'ccache': str(tmp_path / 'krb5cc')})
+    assert not credentials.renew()
+    assert credentials.statistics()['failures'] == 1
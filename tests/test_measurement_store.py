@@ -0,0 +1,64 @@
+import datetime
+
+import pandas as pd
+
+from sbndprmdaq.measurement_store import MeasurementStore
+
+
+def make_measurement(date, tau):
+    return {'date': date, 'v_c': -50, 'v_ag': 1000, 'v_a': 5000, 'td': 1.1,
+            'qc': 20., 'qa': 10., 'tau': tau, 'qc_err': 0.1, 'qa_err': 0.1, 'tau_err': 0.05}
+
+
+def test_measurement_store(tmp_path):
+    store = MeasurementStore(str(tmp_path / 'measurements.sqlite'))
+
+    store.append(make_measurement('20240324-101010', 1.2), prm_id=1, run_number=5)
+    store.append(make_measurement('20240325-101010', 1.5), prm_id=2)
+    store.append(make_measurement('20240326-101010', 1.4), prm_id=1)
+
+    df = store.query()
+    assert list(df['lifetime']) == [1.2, 1.5, 1.4]
+    assert df['date'][0] == datetime.datetime(2024, 3, 24, 10, 10, 10)
+    assert df['run_number'][0] == 5
+    assert df['hv_a'][0] == 5000
+
+    df = store.query(prm_ids=[1], since=datetime.datetime(2024, 3, 25))
+    assert list(df['lifetime']) == [1.4]
+
+    df = store.query(until=datetime.datetime(2024, 3, 26))
+    assert list(df['prm_id']) == [1, 2]
+
+    assert store.count() == 3
+    assert store.count(prm_id=1, since=datetime.datetime(2024, 3, 25)) == 1
+
+
+def test_measurement_store_csv(tmp_path):
+    # A dataframe as written by the former DataStorage.update_dataframe
+    csv_file_name = str(tmp_path / 'prm_measurements.csv')
+    pd.DataFrame({
+        'Unnamed: 0': [0, 1],
+        'date': ['20240324-101010', '20240324-111010'],
+        'prm_id': [1, 2],
+        'drifttime': [1.1, 0.6],
+        'lifetime': [1.2, 0.9],
+        'qa': [10., 12.],
+        'qc': [20., 15.],
+        'hv_c': [-50, -50],
+        'hv_ag': [1000, 1000],
+        'hv_a': [5000, 5000],
+    }).to_csv(csv_file_name)
+
+    store = MeasurementStore(str(tmp_path / 'measurements.sqlite'))
+    assert store.import_csv(csv_file_name) == 2
+    assert store.import_csv(csv_file_name) == 0
+    store.append(make_measurement('20240325-101010', 1.5), prm_id=1)
+
+    export_file_name = str(tmp_path / 'export.csv')
+    assert store.export_csv(export_file_name, prm_ids=[1]) == 2
+
+    df = pd.read_csv(export_file_name)
+    assert list(df['lifetime']) == [1.2, 1.5]
+    assert pd.isna(df['qa_err'][0])
+    assert list(pd.to_datetime(df['date'])) == [datetime.datetime(2024, 3, 24, 10, 10, 10),
+                                                datetime.datetime(2024, 3, 25, 10, 10, 10)]
@@ -0,0 +1,67 @@
+import time
+import random
+import threading
+
+from sbndprmdaq.post_processing import PostProcessor, PostProcessingJob
+
+
+def test_post_processor(qtbot):
+    order = []
+
+    def fail(job):
+        if job.run_number == 2:
+            raise RuntimeError('failed')
+        order.append(('fail', job.run_number))
+
+    processor = PostProcessor([('first', lambda job: order.append(('first', job.run_number))),
+                               ('fail', fail)],
+                              n_workers=1, max_queue_size=2)
+
+    done, failed = [], []
+    processor.job_done.connect(done.append)
+    processor.job_failed.connect(lambda job, stage: failed.append((job.run_number, stage)))
+
+    # No workers yet, so the queue fills up, but no run is dropped
+    assert processor.submit(PostProcessingJob(1, {}, 1, ''))
+    assert processor.submit(PostProcessingJob(1, {}, 2, ''))
+    assert not processor.wait_for_capacity(timeout=0.2)
+    assert processor.submit(PostProcessingJob(1, {}, 3, ''))
+    assert processor.n_pending() == 3
+
+    processor.start()
+    start = time.monotonic()
+    while processor.n_pending() and time.monotonic() - start < 5:
+        time.sleep(0.01)
+    processor.stop()
+    qtbot.wait(10)
+
+    assert order == [('first', 1), ('fail', 1), ('first', 2), ('first', 3), ('fail', 3)]
+    assert [job.run_number for job in done] == [1, 3]
+    assert set(done[0].stage_times) == {'first', 'fail'}
+    assert failed == [(2, 'fail')]
+
+
+def test_post_processor_order(qtbot):
+    lock = threading.Lock()
+    order = {1: [], 2: [], 3: []}
+    running = set()
+
+    def stage(job):
+        with lock:
+            assert job.prm_id not in running
+            running.add(job.prm_id)
+        time.sleep(random.uniform(0, 0.01))
+        with lock:
+            running.discard(job.prm_id)
+            order[job.prm_id].append(job.run_number)
+
+    processor = PostProcessor([('stage', stage)], n_workers=3, max_queue_size=100)
+    processor.start()
+    for run_number in range(20):
+        for prm_id in order:
+            processor.submit(PostProcessingJob(prm_id, {}, run_number, ''))
+    processor.stop()
+    qtbot.wait(10)
+
+    # The runs of a PrM are processed one at a time, in order
+    assert all(runs == list(range(20)) for runs in order.values())
@@ -0,0 +1,32 @@
+import os
+import threading
+
+import yaml
+
+from sbndprmdaq.digitizer.mock_prm_digitizer import MockPrMDigitizer
+
+settings = os.path.join(os.path.dirname(__file__), '../settings.yaml')
+
+with open(settings) as file:
+    config = yaml.load(file, Loader=yaml.FullLoader)
+
+
+def test_config_snapshot(monkeypatch):
+    prm_digitizer = MockPrMDigitizer(config)
+    digitizer = prm_digitizer._digitizers[3]
+
+    n_acquisitions = [1]
+    monkeypatch.setattr(digitizer, 'get_number_acquisitions', lambda: n_acquisitions[0])
+    monkeypatch.setattr(digitizer, 'set_number_acquisitions', lambda n: n_acquisitions.__setitem__(0, n))
+
+    assert prm_digitizer.get_config(3).number_acquisitions == 1
+
+    # The digitizer is busy, so the number of records is not set yet
+    busy = threading.Event()
+    digitizer._acquisition_executor.submit(busy.wait)
+    future = prm_digitizer.acquire_async(n_records=5, prm_id=3)
+    assert prm_digitizer.get_config(3).number_acquisitions == 1
+
+    busy.set()
+    future.result(timeout=10)
+    assert prm_digitizer.get_config(3).number_acquisitions == 5
@@ -0,0 +1,125 @@
+import os
+import logging
+import datetime
+
+import numpy as np
+
+from sbndprmdaq.run_bundler import RunBundler, RunBundle
+from sbndprmdaq.run_file import RunFile, RunFileWriter
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+
+
+class FakeUploadService:
+
+    def __init__(self):
+        self.files = []
+
+    def submit(self, filenames, remote_dir=None):
+        self.files.extend(filenames)
+        return len(filenames)
+
+
+def make_run(path, run_name):
+    np.savez(os.path.join(path, run_name + '.npz'), ch_A=np.arange(100.))
+    with open(os.path.join(path, run_name + '_ana.png'), 'wb') as f:
+        f.write(b'png')
+    with RunFileWriter(os.path.join(path, run_name + '.h5')) as writer:
+        writer.append_records('hv_on', WaveformBatch(np.ones((2, 3, 10)), ['A', 'B'], 2e6, 3))
+    return [os.path.join(path, run_name + suffix) for suffix in ['.h5', '.npz', '_ana.png']]
+
+
+def test_run_bundler(tmp_path):
+    data_path = tmp_path / 'data'
+    data_path.mkdir()
+    upload_service = FakeUploadService()
+    config = {'data_files_path': str(data_path), 'run_bundler': {'period': 'hourly'}}
+    bundler = RunBundler(config, upload_service=upload_service)
+
+    day = datetime.datetime(2024, 3, 24, 10, 5).timestamp()
+    bundle = bundler.add_run('run_1', make_run(data_path, 'run_1'), now=day, prm_id=1, run_number=1)
+    assert bundle == str(data_path / 'bundles' / 'sbnd_prm_runs_20240324_10.zip')
+    bundler.add_run('run_2', make_run(data_path, 'run_2'), now=day + 60, prm_id=2, run_number=4)
+
+    # Read while being written
+    with RunBundle(bundle + '.part') as run_bundle:
+        assert run_bundle.runs() == ['run_1', 'run_2']
+
+    # The hour is over
+    assert bundler.roll(now=day + 3600) == [bundle]
+    assert upload_service.files == [bundle]
+    assert sorted(os.listdir(data_path / 'bundles')) == ['sbnd_prm_runs_20240324_10.zip']
+
+    with RunBundle(bundle) as run_bundle:
+        assert run_bundle.runs() == ['run_1', 'run_2']
+        assert run_bundle.members('run_2') == ['run_2.h5', 'run_2.npz', 'run_2_ana.png']
+        assert run_bundle.find_run(2, 4) == 'run_2'
+        assert run_bundle.find_run(2, 5) is None
+
+        with run_bundle.open('run_2', 'run_2.npz') as f:
+            np.testing.assert_array_equal(np.load(f)['ch_A'], np.arange(100.))
+
+        # The run file read in place, from the bundle
+        with RunFile(run_bundle.open('run_2', 'run_2.h5')) as run_file:
+            assert run_file.records('A').shape == (3, 10)
+
+        files = run_bundle.extract_run('run_1', str(tmp_path / 'extracted'))
+        assert sorted(os.listdir(tmp_path / 'extracted' / 'run_1')) == ['run_1.h5', 'run_1.npz', 'run_1_ana.png']
+        assert len(files) == 3
+
+
+def test_run_bundler_restart(tmp_path):
+    config = {'data_files_path': str(tmp_path)}
+    upload_service = FakeUploadService()
+
+    day = datetime.datetime(2024, 3, 24, 10, 5).timestamp()
+    bundler = RunBundler(config, upload_service=upload_service)
+    bundle = bundler.add_run('run_1', make_run(tmp_path, 'run_1'), now=day, prm_id=1, run_number=1)
+
+    # Continued after a restart the same day
+    bundler = RunBundler(config, upload_service=upload_service)
+    bundler.add_run('run_2', make_run(tmp_path, 'run_2'), now=day + 3600, prm_id=1, run_number=2)
+    assert upload_service.files == []
+
+    # Finished at the first run of the next day
+    bundler.add_run('run_3', make_run(tmp_path, 'run_3'), now=day + 86400, prm_id=1, run_number=3)
+    assert upload_service.files == [bundle]
+    assert bundler.statistics()['bundled_runs'] == 2
+
+    with RunBundle(bundle) as run_bundle:
+        assert run_bundle.runs() == ['run_1', 'run_2']
+        assert run_bundle.index['runs']['run_2']['run_number'] == 2
+
+    # Finished in the background
+    bundle = bundler.bundle_name(day + 86400)
+    bundler.start()
+    bundler.stop()
+    assert upload_service.files[-1] == bundle
+    assert bundler.statistics()['finished_bundles'] == 2
+
+
+def test_run_bundler_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(logging.getLogger('sbndprmdaq.run_bundler'), 'propagate', False)
+    config = {'data_files_path': str(tmp_path)}
+    upload_service = FakeUploadService()
+
+    day = datetime.datetime(2024, 3, 24, 10, 5).timestamp()
+    bundler = RunBundler(config, upload_service=upload_service)
+    files = make_run(tmp_path, 'run_1')
+    bundle = bundler.add_run('run_1', files, now=day, prm_id=1, run_number=1)
+
+    # The bundle is damaged: the files of its runs are uploaded one by one
+    with open(bundle + '.part', 'wb') as f:
+        f.write(b'not a zip')
+    assert bundler.roll(now=day + 86400) == []
+    assert upload_service.files == files
+    assert os.path.exists(bundle + '.bad')
+    assert bundler.statistics()['failed_bundles'] == 1
+    assert all(os.path.exists(f) for f in files)
+
+    # Same for a run that cannot be added
+    bundle = bundler.add_run('run_2', make_run(tmp_path, 'run_2'), now=day + 86400)
+    with open(bundle + '.part', 'wb') as f:
+        f.write(b'not a zip')
+    files = make_run(tmp_path, 'run_3')
+    assert bundler.add_run('run_3', files, now=day + 86400) is None
+    assert upload_service.files[-3:] == files
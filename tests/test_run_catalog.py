@@ -0,0 +1,41 @@
+import os
+
+from sbndprmdaq.run_catalog import RunCatalog
+
+
+def test_run_numbers(tmp_path):
+    catalog = RunCatalog(os.path.join(tmp_path, 'run_catalog.sqlite'))
+
+    # Seeded from latest_run_number.txt
+    catalog.seed_run_numbers({1: 41, 2: -1})
+    assert catalog.allocate_run_number(1) == 42
+    assert catalog.allocate_run_number(2) == 0
+
+    # Seeding never goes back, allocation never reuses a number
+    catalog.seed_run_numbers({1: 10})
+    assert catalog.allocate_run_number(1) == 43
+    assert catalog.allocate_run_number(1, after=50) == 51
+    assert catalog.latest_run_numbers() == {1: 51, 2: 0}
+
+    # A second connection sees the same numbers
+    other = RunCatalog(os.path.join(tmp_path, 'run_catalog.sqlite'))
+    assert other.allocate_run_number(1) == 52
+
+
+def test_find_runs(tmp_path):
+    catalog = RunCatalog(os.path.join(tmp_path, 'run_catalog.sqlite'))
+
+    for i, tau in enumerate([1.5, 3.0, 6.0]):
+        run_number = catalog.allocate_run_number(1, start_time=1000 + i)
+        catalog.update_run(1, run_number, status='analysed', tau=tau,
+                           files=[f'run_{run_number}.npz'], hv={'cathode': {'voltage': -150}})
+    catalog.allocate_run_number(3, start_time=1010)
+
+    runs = catalog.find_runs(prm_id=1, tau_min=2)
+    assert [run['tau'] for run in runs] == [6.0, 3.0]
+    assert runs[0]['files'] == ['run_2.npz']
+    assert runs[0]['hv']['cathode']['voltage'] == -150
+
+    assert len(catalog.find_runs(since=1001, until=1010)) == 2
+    assert catalog.find_runs(limit=1)[0]['prm_id'] == 3
+    assert catalog.get_run(3, 0)['status'] == 'allocated'
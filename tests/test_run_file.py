@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+from sbndprmdaq.run_file import RunFile, RunFileWriter
+from sbndprmdaq.digitizer.sample_encoding import SampleEncoding
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+from sbndprmdaq.digitizer.waveform_accumulator import WaveformAccumulator
+
+
+def make_batch(rng, n_records, offset=0.):
+    return WaveformBatch(rng.normal(offset, 1e-3, size=(2, n_records, 100)), ['A', 'B'], 2e6, 30,
+                         timestamps=np.arange(n_records, dtype=float))
+
+
+def test_run_file(tmp_path):
+    rng = np.random.default_rng(1)
+    file_name = str(tmp_path / 'run.h5')
+
+    data_hv_on = WaveformAccumulator(reservoir_size=20, seed=1)
+    with RunFileWriter(file_name) as writer:
+        # Written as the batches come
+        for _ in range(3):
+            batch = make_batch(rng, 5, offset=0.1)
+            data_hv_on.add(batch)
+            writer.append_records('hv_on', batch)
+            assert not os.path.exists(file_name)
+
+        writer.write_summary('hv_on', data_hv_on)
+        writer.append_records('hv_off', make_batch(rng, 4))
+        writer.set_attributes(run=12, comment='test', hv={'cathode': -150}, tau_err=None)
+
+    assert not os.path.exists(file_name + '.part')
+
+    with RunFile(file_name) as run_file:
+        assert run_file.attrs['run'] == 12
+        assert run_file.attrs['comment'] == 'test'
+        assert run_file.attrs['hv'] == '{"cathode": -150}'
+        assert 'tau_err' not in run_file.attrs
+
+        assert run_file.phases == ['hv_on', 'hv_off']
+        assert run_file.channels() == ['A', 'B']
+        assert run_file.n_records() == 15
+
+        assert run_file.records('A').shape == (15, 100)
+        assert run_file.records('B', start=5, stop=7).shape == (2, 100)
+        assert run_file.records('A', phase='hv_off').shape == (4, 100)
+        assert len(run_file.timestamps()) == 15
+
+        np.testing.assert_allclose(run_file.mean('A'), data_hv_on.mean('A'))
+        np.testing.assert_allclose(run_file.variance('B'), data_hv_on.variance('B'))
+        np.testing.assert_allclose(run_file.mean('A'), run_file.records('A').mean(axis=0))
+
+
+def test_run_file_discarded(tmp_path):
+    file_name = str(tmp_path / 'run.h5')
+
+    with pytest.raises(RuntimeError):
+        with RunFileWriter(file_name) as writer:
+            writer.append_records('hv_on', make_batch(np.random.default_rng(1), 5))
+            raise RuntimeError()
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_run_file_samples(tmp_path):
+    rng = np.random.default_rng(1)
+    file_name = str(tmp_path / 'run.h5')
+
+    # 12-bit codes in 16-bit samples, as from the ATS310
+    encoding = SampleEncoding.from_bits(12, 5, bit_shift=4)
+    samples = (rng.integers(0, 1 << 12, size=(2, 5, 100)) << 4).astype(np.uint16)
+    volts = encoding.to_volts(samples, dtype=float)
+    np.testing.assert_array_equal(encoding.to_samples(volts), samples)
+
+    with RunFileWriter(file_name) as writer:
+        writer.append_records('hv_on', WaveformBatch(volts, ['A', 'B'], 2e6, 30), encoding)
+
+    with RunFile(file_name) as run_file:
+        view = run_file.records_view('A')
+        assert view.encoding == encoding
+        assert view.shape == (5, 100)
+        np.testing.assert_array_equal(view.samples(), samples[0])
+
+        records = view[1:3]
+        assert records.dtype == np.float32
+        np.testing.assert_allclose(records, volts[0, 1:3], atol=1e-6)
+        np.testing.assert_allclose(run_file.records('B'), volts[1], atol=1e-6)
@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import Future
+
+import yaml
+
+from sbndprmdaq.scheduler import MeasurementScheduler, prm_resources
+
+settings = os.path.join(os.path.dirname(__file__), '../settings.yaml')
+
+with open(settings) as file:
+    config = yaml.load(file, Loader=yaml.FullLoader)
+
+
+def test_prm_resources():
+    resources = prm_resources(config)
+
+    # PrM 2 is bound to PrM 1, PrM 3 has its own crate and digitizer
+    assert resources[1] == resources[2]
+    assert 'digitizer:adpro' in resources[1]
+    assert not resources[1] & resources[3]
+
+
+def test_scheduler(qtbot):
+    started = []
+    resources = {1: {'mpod:a', 'digitizer:a'},
+                 2: {'mpod:a', 'digitizer:b'},
+                 3: {'mpod:b', 'digitizer:b'}}
+    scheduler = MeasurementScheduler(resources, started.append, min_interval=300)
+
+    # 1 and 3 do not share anything, so they run together
+    scheduler.request(1)
+    scheduler.request(3, priority=5)
+    assert started == [1, 3]
+
+    # 2 needs both, and waits
+    scheduler.request(2)
+    assert scheduler.is_queued(2)
+
+    # 1 would be free to start, but it would take the crate 2 waits for
+    scheduler.finished(1)
+    scheduler.request(1, priority=5)
+    assert started == [1, 3]
+
+    scheduler.finished(3)
+    assert started == [1, 3, 2]
+
+    state = {item['prm_id']: item for item in scheduler.queue_state()}
+    assert state[2]['state'] == 'running'
+    assert state[1]['state'] == 'queued'
+    assert state[1]['predicted_start'] > 0
+
+    scheduler.finished(2)
+    assert started == [1, 3, 2, 1]
+
+    scheduler.set_periodic(3, 600)
+    assert 599 < scheduler.predicted_start(3) <= 600
+
+    scheduler.stop()
+
+
+def test_scheduler_hold(qtbot):
+    started = []
+    resources = {1: {'mpod:a'}, 2: {'mpod:a'}}
+    scheduler = MeasurementScheduler(resources, started.append)
+
+    scheduler.request(1)
+    scheduler.request(2)
+    assert started == [1]
+
+    # The crate is held until the ramp-down of 1 is done
+    ramp_down = Future()
+    scheduler.finished(1, hold_until=ramp_down)
+    assert started == [1]
+    assert not scheduler.started(1)
+
+    ramp_down.set_result(None)
+    scheduler.tick()
+    assert started == [1, 2]
+
+    scheduler.stop()
@@ -0,0 +1,35 @@
+import time
+
+from sbndprmdaq.timing import StageTimer, TimingStatistics
+
+
+def test_stage_timer():
+    timer = StageTimer()
+    with timer.stage('capture'):
+        time.sleep(0.01)
+    timer.add('readout', 2.)
+    timer.add('readout', 1.)
+
+    breakdown = timer.breakdown()
+    assert breakdown['capture'] >= 0.01
+    assert breakdown['readout'] == 3.
+    assert breakdown['total'] >= breakdown['capture']
+
+
+def test_timing_statistics():
+    statistics = TimingStatistics(history_size=20)
+    for i in range(30):
+        statistics.add(1, {'capture': float(i), 'upload': 1.})
+    statistics.add(1, {'lamp_on': 0.5})
+
+    percentiles = statistics.percentiles(1)
+    # Only the latest 20 runs are kept
+    assert percentiles['capture']['n'] == 20
+    assert percentiles['capture']['latest'] == 29.
+    assert percentiles['capture']['p50'] == 19.5
+    assert 28 < percentiles['capture']['p95'] < 29
+    assert percentiles['upload']['p95'] == 1.
+    assert percentiles['lamp_on']['n'] == 1
+
+    assert statistics.percentiles(2) == {}
+    assert 'upload: 1.00/1.00 s' in statistics.summary(1)
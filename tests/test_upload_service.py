@@ -0,0 +1,166 @@
+import os
+import logging
+import threading
+
+from sbndprmdaq.upload_service import UploadService
+
+
+class LocalSFTP:
+    '''
+    An SFTP channel writing to a local directory.
+    '''
+
+    def __init__(self, session):
+        self._session = session
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def open(self, path, mode):
+        return LocalFile(path, mode, self._session)
+
+    def posix_rename(self, source, target):
+        os.replace(source, target)
+
+    def close(self):
+        pass
+
+
+class LocalFile:
+
+    def __init__(self, path, mode, session):
+        self._file = open(path, mode)
+        self._session = session
+
+    def set_pipelined(self, _):
+        pass
+
+    def write(self, data):
+        if self._session.fail_after is not None:
+            if self._session.fail_after <= 0:
+                self._session.fail_after = None
+                raise OSError('Connection lost')
+            self._session.fail_after -= 1
+        self._file.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self._file.close()
+
+
+class LocalSession:
+
+    def __init__(self):
+        self.down = False
+        self.fail_after = None
+        self.connects = 0
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return not self.down
+
+    def open_sftp(self):
+        with self._lock:
+            if self.down:
+                raise OSError('Host unreachable')
+            self.connects += 1
+            return LocalSFTP(self)
+
+    def close(self):
+        pass
+
+
+def make_files(path, n_files, size):
+    file_names = []
+    for i in range(n_files):
+        file_name = os.path.join(path, f'run_{i}.npz')
+        with open(file_name, 'wb') as file:
+            file.write(os.urandom(size))
+        file_names.append(file_name)
+    return file_names
+
+
+def make_config(tmp_path, **kwargs):
+    upload_config = {'n_streams': 2, 'retry_delay': 0.05, 'max_retry_delay': 0.1, 'chunk_size': 100}
+    upload_config.update(kwargs)
+    return {
+        'data_files_path': str(tmp_path / 'data'),
+        'data_storage_path': str(tmp_path / 'remote'),
+        'upload_service': upload_config,
+    }
+
+
+def test_upload_service(tmp_path):
+    config = make_config(tmp_path)
+    os.makedirs(config['data_files_path'])
+    file_names = make_files(config['data_files_path'], 4, 1000)
+
+    session = LocalSession()
+    service = UploadService(config, session=session)
+    service.start()
+
+    assert service.submit(file_names + ['missing.npz']) == 4
+    assert service.wait(timeout=10)
+
+    for file_name in file_names:
+        with open(file_name, 'rb') as local, \
+             open(os.path.join(config['data_storage_path'], os.path.basename(file_name)), 'rb') as remote:
+            assert local.read() == remote.read()
+
+    statistics = service.statistics()
+    assert statistics['queue_depth'] == 0
+    assert statistics['uploaded_files'] == 4
+    assert statistics['uploaded_bytes'] == 4000
+    assert statistics['throughput'] > 0
+
+    # One SFTP channel per stream, kept between the uploads
+    assert session.connects <= 2
+
+    assert os.listdir(os.path.join(config['data_files_path'], 'upload_spool')) == []
+    service.stop()
+
+
+def test_upload_service_outage(tmp_path, monkeypatch):
+    # The log widget of the GUI tests is gone, keep the retry warnings away from it
+    monkeypatch.setattr(logging.getLogger('sbndprmdaq.upload_service'), 'propagate', False)
+
+    config = make_config(tmp_path, n_streams=1)
+    os.makedirs(config['data_files_path'])
+    file_names = make_files(config['data_files_path'], 2, 1000)
+
+    # The host is down: the uploads stay in the spool when the DAQ stops
+    session = LocalSession()
+    session.down = True
+    service = UploadService(config, session=session)
+    service.start()
+    service.submit(file_names)
+    assert not service.wait(timeout=0.3)
+
+    statistics = service.statistics()
+    assert statistics['queue_depth'] == 2
+    assert statistics['failures'] > 0
+    assert statistics['pending_bytes'] == 2000
+    service.stop()
+
+    assert len(os.listdir(os.path.join(config['data_files_path'], 'upload_spool'))) == 2
+
+    # The next DAQ takes them again, and resumes the interrupted upload
+    session = LocalSession()
+    session.fail_after = 3
+    service = UploadService(config, session=session)
+    assert service.statistics()['queue_depth'] == 2
+    service.start()
+    assert service.wait(timeout=10)
+
+    assert service.statistics()['failures'] == 1
+    for file_name in file_names:
+        remote_file_name = os.path.join(config['data_storage_path'], os.path.basename(file_name))
+        with open(file_name, 'rb') as local, open(remote_file_name, 'rb') as remote:
+            assert local.read() == remote.read()
+    service.stop()
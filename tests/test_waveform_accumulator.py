@@ -0,0 +1,44 @@
+import numpy as np
+
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+from sbndprmdaq.digitizer.waveform_accumulator import WaveformAccumulator
+
+
+def test_waveform_accumulator():
+    rng = np.random.default_rng(1)
+    waveforms = rng.normal(size=(2, 50, 10))
+
+    accumulator = WaveformAccumulator(reservoir_size=8, channel_map={'1': 'A', '2': 'B'}, seed=1)
+    for start in range(0, 50, 7):
+        accumulator.add(WaveformBatch(waveforms[:, start:start + 7], ['1', '2'], 2e6, 3))
+
+    assert accumulator.count == 50
+    assert accumulator.channels == ('A', 'B')
+    np.testing.assert_allclose(accumulator.mean('B'), waveforms[1].mean(axis=0))
+    np.testing.assert_allclose(accumulator.variance('A'), waveforms[0].var(axis=0))
+    np.testing.assert_allclose(accumulator.variance('A', ddof=1), waveforms[0].var(axis=0, ddof=1))
+
+    reservoir = accumulator.reservoir()
+    assert reservoir.n_records == 8
+    # Every kept record is one of the added records, with its channels aligned
+    for record in range(8):
+        index = np.flatnonzero((waveforms[0] == reservoir['A'][record]).all(axis=1))
+        assert len(index) == 1
+        np.testing.assert_array_equal(waveforms[1, index[0]], reservoir['B'][record])
+
+    selected = accumulator.select(['B'], names=['A'])
+    np.testing.assert_allclose(selected.mean('A'), accumulator.mean('B'))
+
+
+def test_waveform_accumulator_stats():
+    rng = np.random.default_rng(2)
+    first, second = rng.normal(size=(1, 5, 4)), rng.normal(size=(1, 9, 4))
+
+    accumulator = WaveformAccumulator()
+    accumulator.add(WaveformBatch(first, ['A'], 2e6, 1))
+    accumulator.add_stats(['A'], 9, second.mean(axis=1), second.var(axis=1))
+
+    both = np.concatenate([first, second], axis=1)[0]
+    assert accumulator.count == 14
+    np.testing.assert_allclose(accumulator.mean('A'), both.mean(axis=0))
+    np.testing.assert_allclose(accumulator.variance('A'), both.var(axis=0))
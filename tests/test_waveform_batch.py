@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+
+
+def test_waveform_batch():
+    data = {'1': [[1, 2, 3], [3, 4, 5]], '2': [[0, 0, 0], [2, 2, 2]], '3': [], '4': []}
+    batch = WaveformBatch.from_dict(data, samples_per_second=2e6, trigger_sample=1)
+
+    assert batch.channels == ('1', '2')
+    assert batch.waveforms.shape == (2, 2, 3)
+    assert batch.n_records == 2
+    np.testing.assert_allclose(batch.mean('1'), [2, 3, 4])
+
+    renamed = batch.rename({'1': 'A', '2': 'B'})
+    assert renamed.waveforms is batch.waveforms
+    assert np.shares_memory(renamed['B'], batch.waveforms)
+
+    both = WaveformBatch.concatenate([renamed, renamed, WaveformBatch.empty()])
+    assert both.waveforms.shape == (2, 4, 3)
+    assert len(both.timestamps) == 4
+
+    selected = both.select(['B'], names=['A'])
+    assert selected.channels == ('A',)
+    assert np.shares_memory(selected['A'], both.waveforms)
+
+    with pytest.raises(KeyError):
+        batch['C']
@@ -0,0 +1,139 @@
+'''
+Script to compare the size and the write, read and transfer times of the
+run files, with the records saved as float64 volts or as the integer samples
+of the digitizers, for typical PrM 1/2 (ADPro) and PrM 3 (ATS310) runs.
+'''
+
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from sbndprmdaq.run_file import RunFile, RunFileWriter
+from sbndprmdaq.digitizer.sample_encoding import SampleEncoding
+from sbndprmdaq.digitizer.waveform_batch import WaveformBatch
+from sbndprmdaq.digitizer.waveform_accumulator import WaveformAccumulator
+
+# PrM: (encoding, samples per second, pre and post trigger samples, (qc [V], td [s], tau [s]))
+RUNS = {
+    1: (SampleEncoding.from_bits(16, 5), 2e6, 300, 2700, (0.15, 1.0e-3, 2.0e-3)),
+    2: (SampleEncoding.from_bits(16, 5), 2e6, 300, 2700, (0.10, 0.4e-3, 2.0e-3)),
+    3: (SampleEncoding.from_bits(12, 5, bit_shift=4), 2e6, 512, 6000, (0.15, 1.0e-3, 2.0e-3)),
+}
+
+
+def make_records(rng, encoding, samples_per_second, pre, post, signal, n_records, lamp_on):
+    '''
+    Makes (channel, record, sample) cathode and anode records, as
+    digitized: noise, the pulses if the lamp is on, and quantized.
+    '''
+    qc, td, tau = signal
+    t = (np.arange(pre + post) - pre) / samples_per_second
+    records = rng.normal(0., 1e-3, size=(2, n_records, pre + post))
+
+    if lamp_on:
+        rc = 119e-6
+        jitter = rng.normal(1., 0.02, size=(n_records, 1))
+        records[0] -= qc * np.exp(-np.clip(t, 0, None) / rc) * (t > 0) * jitter
+        records[1] += qc * np.exp(-td / tau) * np.exp(-np.clip(t - td, 0, None) / rc) * (t > td) * jitter
+
+    return encoding.to_volts(encoding.to_samples(records), dtype=float)
+
+
+def write_npz(file_name, data):
+    np.savez(file_name, **{f'ch_{ch}{suffix}': batch[ch]
+                           for suffix, (batch, _) in zip(['', '_nohv'], data)
+                           for ch in ['A', 'B']})
+
+
+def write_txt(file_name, data):
+    with open(file_name, 'w', encoding='utf-8') as f:
+        for suffix, (batch, _) in zip(['', '_nohv'], data):
+            for ch in ['A', 'B']:
+                f.write(f'ch_{ch}{suffix}=' + str(np.asarray(batch[ch]).tolist()).replace(' ', '') + '\n')
+
+
+def write_hdf5(file_name, data, encoding, compression):
+    with RunFileWriter(file_name, compression=compression) as writer:
+        for phase, (batch, accumulator) in zip(['hv_on', 'hv_off'], data):
+            writer.append_records(phase, batch, encoding)
+            writer.write_summary(phase, accumulator)
+
+
+def read_hdf5(file_name):
+    with RunFile(file_name) as run_file:
+        return run_file.records('B', start=0, stop=10)
+
+
+def main():
+    '''
+    Runs the benchmark.
+    '''
+    parser = argparse.ArgumentParser(description='Run file size and speed benchmark')
+    parser.add_argument('--records', type=int, default=100,
+                        help='Records saved per channel and phase (record_reservoir_size).')
+    parser.add_argument('--bandwidth', type=float, default=10,
+                        help='Upload bandwidth (MB/s), to estimate the transfer times.')
+    parser.add_argument('--runs-per-day', type=float, default=48,
+                        help='Runs per day and PrM, to estimate the daily volume.')
+    parser.add_argument('--txt', action='store_true', default=False,
+                        help='Also time the former txt format (slow).')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+
+    formats = {
+        'npz float64': lambda f, d, e: write_npz(f + '.npz', d),
+        'hdf5 float64': lambda f, d, e: write_hdf5(f + '.h5', d, None, 'gzip'),
+        'hdf5 samples': lambda f, d, e: write_hdf5(f + '.h5', d, e, 'gzip'),
+        'hdf5 samples lzf': lambda f, d, e: write_hdf5(f + '.h5', d, e, 'lzf'),
+    }
+    if args.txt:
+        formats['txt'] = lambda f, d, e: write_txt(f + '.txt', d)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        for prm_id, (encoding, samples_per_second, pre, post, signal) in RUNS.items():
+            data = []
+            for lamp_on in [True, False]:
+                records = make_records(rng, encoding, samples_per_second, pre, post, signal, args.records, lamp_on)
+                batch = WaveformBatch(records, ['A', 'B'], samples_per_second, pre)
+                accumulator = WaveformAccumulator()
+                accumulator.add(batch)
+                data.append((batch, accumulator))
+
+            print(f'PrM {prm_id}: {args.records} records x {pre + post} samples, '
+                  f'{encoding.bits_per_sample}-bit samples')
+            print(f'  {"format":<18} {"size [MB]":>10} {"write [s]":>10} {"read [s]":>10} '
+                  f'{"upload [s]":>11} {"per day [MB]":>13}')
+
+            reference = None
+            for name, write in formats.items():
+                file_name = os.path.join(tmp_dir, f'prm{prm_id}_{name.replace(" ", "_")}')
+
+                start = time.perf_counter()
+                write(file_name, data, encoding)
+                write_time = time.perf_counter() - start
+
+                file_name = next(os.path.join(tmp_dir, f) for f in os.listdir(tmp_dir)
+                                 if os.path.join(tmp_dir, f).startswith(file_name + '.'))
+                size = os.path.getsize(file_name) / 1e6
+                reference = reference or size
+
+                read_time = ''
+                if file_name.endswith('.h5'):
+                    start = time.perf_counter()
+                    read_hdf5(file_name)
+                    read_time = f'{time.perf_counter() - start:.4f}'
+
+                print(f'  {name:<18} {size:>10.2f} {write_time:>10.3f} {read_time:>10} '
+                      f'{size / args.bandwidth:>11.2f} {size * args.runs_per_day:>13.0f}'
+                      f'   ({size / reference:.0%} of npz)')
+
+                os.remove(file_name)
+
+
+if __name__ == '__main__':
+    main()